@@ -0,0 +1,119 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.recommender.model import catalog_version_query, format_catalog_version
+
+
+class ResponseCache:
+    """Serialized JSON responses keyed on everything that determines them, with conditional GET support
+
+    Keys carry the versions their body depends on (catalog version, cache generation), so entries are
+    never invalidated, they stop being asked for and fall out of the LRU. The ETag is a hash of the
+    key, which lets a matching If-None-Match be answered with a 304 before the body is built.
+    """
+
+    def __init__(self, max_size: int = 2048, catalog_check_interval: float = 30.0):
+        self.max_size = max_size
+        self.catalog_check_interval = catalog_check_interval
+        self._entries: OrderedDict[Hashable, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+        self._catalog_version: Optional[str] = None
+        self._catalog_checked_at = 0.0
+        self._hits = 0
+        self._misses = 0
+        self._not_modified = 0
+
+    async def catalog_version(self, db: AsyncSession) -> str:
+        """Catalog fingerprint, read from the database at most every catalog_check_interval seconds"""
+        if self._catalog_version is not None and time.monotonic() - self._catalog_checked_at < self.catalog_check_interval:
+            return self._catalog_version
+
+        count, last_updated = (await db.execute(catalog_version_query())).one()
+        self._catalog_version = format_catalog_version(count, last_updated)
+        self._catalog_checked_at = time.monotonic()
+        return self._catalog_version
+
+    def invalidate_catalog(self):
+        self._catalog_checked_at = 0.0
+
+    @staticmethod
+    def etag(key: Hashable) -> str:
+        return '"' + hashlib.sha1(repr(key).encode()).hexdigest()[:20] + '"'
+
+    @staticmethod
+    def _matches(request: Request, etag: str) -> bool:
+        if_none_match = request.headers.get("if-none-match")
+        if not if_none_match:
+            return False
+        candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+        return "*" in candidates or etag in candidates
+
+    async def respond(
+            self,
+            request: Request,
+            key: Hashable,
+            build: Callable[[], Awaitable[Any]],
+            headers: Optional[Dict[str, str]] = None
+    ) -> Response:
+        """304 if the client already has this version, otherwise the cached body, building it on a miss"""
+        etag = self.etag(key)
+        headers = {"ETag": etag, "Cache-Control": "no-cache", **(headers or {})}
+
+        if self._matches(request, etag):
+            with self._lock:
+                self._not_modified += 1
+            return Response(status_code=304, headers=headers)
+
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+
+        if body is None:
+            body = JSONResponse(jsonable_encoder(await build())).body
+            with self._lock:
+                self._misses += 1
+                if self.max_size > 0:
+                    self._entries[key] = body
+                    while len(self._entries) > self.max_size:
+                        self._entries.popitem(last=False)
+
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "not_modified": self._not_modified
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(
+                max_size=int(os.getenv("RESPONSE_CACHE_SIZE", "2048")),
+                catalog_check_interval=float(os.getenv("MODEL_CHECK_INTERVAL", "30"))
+            )
+        return _response_cache
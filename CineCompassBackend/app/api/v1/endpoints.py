@@ -1,51 +1,86 @@
-from typing import Optional, List
-from fastapi import APIRouter, Depends, HTTPException, Header
+from typing import Optional, List, Dict, Any
+from fastapi import APIRouter, Depends, HTTPException, Header, Request
+from sqlalchemy import func, select, update
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.database.database_builder import CineCompassDatabaseBuilder
 from app.recommender.content_based import CineCompassRecommender
-from app.auth.deps import get_db
+from app.recommender.refresh_worker import RefreshWorker, get_refresh_worker
+from app.api.response_cache import ResponseCache, get_response_cache
+from app.auth.deps import get_db, get_async_db
+from app.auth.session_cache import SessionCache, SessionUser, get_session_cache
+from app.models.rating import Rating
 from app.models.user import User
 from app.schemas.recommendation import RecommendationResponse
 from datetime import datetime
 from app.schemas.rating import RatingCreate, BatchRatingCreate
 from app.schemas.movie import PopularMovie
 import uuid
+import asyncio
 
 router = APIRouter()
 
-def get_or_create_session(session_id: Optional[str] = Header(None, alias="X-Session-ID"), db: Session = Depends(get_db)) -> User:
+def _session_user_query(session_id: str):
+    # Counted in the database, loading the ratings relationship would pull every rating into Python
+    rating_count = select(func.count(Rating.id)).where(Rating.user_id == User.id).scalar_subquery()
+    return select(User.id, rating_count).where(User.session_id == session_id)
+
+async def get_or_create_session(
+        session_id: Optional[str] = Header(None, alias="X-Session-ID"),
+        db: AsyncSession = Depends(get_async_db),
+        session_cache: SessionCache = Depends(get_session_cache)
+) -> SessionUser:
     """Get existing session or create a new one"""
     if not session_id:
         session_id = str(uuid.uuid4())
 
-    user = db.query(User).filter(User.session_id == session_id).first()
+    cached = session_cache.get(session_id)
+    if cached is not None:
+        return cached
+
+    row = (await db.execute(_session_user_query(session_id))).first()
 
-    if not user:
-        user = User(
+    if row:
+        user = SessionUser(id=row[0], session_id=session_id, rating_count=row[1])
+    else:
+        new_user = User(
             session_id=session_id,
             created_at=datetime.utcnow(),
             last_session_refresh=datetime.utcnow()
         )
-        db.add(user)
-        db.add(user)
+        db.add(new_user)
         try:
-            db.commit()
-            db.refresh(user)
+            await db.commit()
+            user = SessionUser(id=new_user.id, session_id=session_id, rating_count=0)
         except Exception:
-            db.rollback()
-            user = db.query(User).filter(User.session_id == session_id).first()
-            if not user:
+            await db.rollback()
+            row = (await db.execute(_session_user_query(session_id))).first()
+            if not row:
                 raise HTTPException(status_code=500, detail="Failed to create session")
+            user = SessionUser(id=row[0], session_id=session_id, rating_count=row[1])
 
+    session_cache.put(user)
     return user
 
+def get_builder():
+    builder = CineCompassDatabaseBuilder()
+    return builder
+
+
+def get_recommender(
+        db: Session = Depends(get_db),
+        refresh_worker: RefreshWorker = Depends(get_refresh_worker)
+) -> CineCompassRecommender:
+    return CineCompassRecommender(db, refresh_worker=refresh_worker)
+
+
 @router.get("/")
 async def root():
     return {"message": "CineCompass is running"}
 
 @router.post("/init-session")
 async def init_session(
-    current_user: User = Depends(get_or_create_session)
+    current_user: SessionUser = Depends(get_or_create_session)
 ):
     """Initialize or retrieve session"""
     return {
@@ -55,88 +90,157 @@ async def init_session(
 
 @router.post("/refresh-session")
 async def refresh_session(
-    current_user: User = Depends(get_or_create_session),
-    db: Session = Depends(get_db)
+    current_user: SessionUser = Depends(get_or_create_session),
+    db: AsyncSession = Depends(get_async_db),
+    recommender: CineCompassRecommender = Depends(get_recommender)
 ):
     try:
-        current_user.last_session_refresh = datetime.utcnow()
-        db.commit()
+        await db.execute(
+            update(User).where(User.id == current_user.id).values(last_session_refresh=datetime.utcnow())
+        )
+        await db.commit()
 
-        recommender = CineCompassRecommender(db)
-        recommender.update_recommendations(current_user.id)
+        refresh_status = await asyncio.to_thread(recommender.schedule_refresh, current_user.id)
 
-        return {"status": "success", "message": "Session refreshed and recommendations updated"}
+        return {
+            "status": "success",
+            "message": "Session refreshed and recommendation update queued",
+            "refresh_status": refresh_status
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/is-onboarded", response_model=bool)
-async def is_onboarded(current_user: User = Depends(get_or_create_session)):
+async def is_onboarded(current_user: SessionUser = Depends(get_or_create_session)):
     try:
         return current_user.has_finished_onboarding
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-def get_builder():
-    builder = CineCompassDatabaseBuilder()
-    return builder
-
-
-def get_recommender(db: Session = Depends(get_db)) -> CineCompassRecommender:
-    return CineCompassRecommender(db)
-
-
+# Writes and scoring go through the synchronous recommender, plain def routes run them in the threadpool
 @router.post("/ratings")
-async def add_rating(
+def add_rating(
     rating: RatingCreate,
-    current_user: User = Depends(get_or_create_session),
-    recommender: CineCompassRecommender = Depends(get_recommender)
+    current_user: SessionUser = Depends(get_or_create_session),
+    recommender: CineCompassRecommender = Depends(get_recommender),
+    session_cache: SessionCache = Depends(get_session_cache)
 ):
     try:
-        return recommender.process_rating(
+        result = recommender.process_rating(
             user_id=current_user.id,
             movie_id=rating.movie_id,
             rating=rating.rating
         )
+        session_cache.invalidate(current_user.session_id)
+        return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/recommendations", response_model=RecommendationResponse)
 async def get_recommendations(
+    request: Request,
     page: int = 1,
     page_size: int = 20,
     last_sync_time: Optional[str] = None,
-    current_user: User = Depends(get_or_create_session),
-    recommender: CineCompassRecommender = Depends(get_recommender)
+    cursor: Optional[int] = None,
+    diversity: str = "genre",
+    mmr_lambda: float = 0.7,
+    pool_size: Optional[int] = None,
+    current_user: SessionUser = Depends(get_or_create_session),
+    db: AsyncSession = Depends(get_async_db),
+    recommender: CineCompassRecommender = Depends(get_recommender),
+    response_cache: ResponseCache = Depends(get_response_cache)
 ):
     try:
+        if diversity not in ("genre", "embedding"):
+            raise HTTPException(status_code=400, detail="diversity must be 'genre' or 'embedding'")
+        if not 0 <= mmr_lambda <= 1:
+            raise HTTPException(status_code=400, detail="mmr_lambda must be between 0 and 1")
+        if pool_size is not None and not page_size <= pool_size <= 500:
+            raise HTTPException(status_code=400, detail="pool_size must be between page_size and 500")
+
         sync_time = datetime.fromisoformat(last_sync_time) if last_sync_time else None
-        return recommender.get_recommendations(
+        options = {
+            "page": page,
+            "page_size": page_size,
+            "cursor": cursor,
+            "diversity": diversity,
+            "mmr_lambda": mmr_lambda,
+            "pool_size": pool_size
+        }
+        state = await recommender.get_cache_state_async(db, current_user.id)
+
+        # A page only changes with the user's cache generation, unless the client is syncing new ratings
+        if sync_time is None and state is not None and state.total is not None and recommender.model is not None:
+            refresh_pending = recommender.refresh_worker.is_pending(current_user.id) if recommender.refresh_worker else False
+
+            async def build_page():
+                response = await recommender.get_recommendations_async(
+                    db, user_id=current_user.id, state=state, **options
+                )
+                response.refresh_pending = refresh_pending
+                return response
+
+            key = ("recommendations", current_user.id, state.generation, recommender.model.version,
+                   recommender.model.details_version, refresh_pending, tuple(options.items()))
+            return await response_cache.respond(request, key, build_page, headers={"Vary": "X-Session-ID"})
+
+        return await recommender.get_recommendations_async(
+            db,
             user_id=current_user.id,
-            page=page,
-            page_size=page_size,
-            last_sync_time=sync_time
+            last_sync_time=sync_time,
+            state=state,
+            **options
         )
+    except HTTPException as e:
+        raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/movies/popular", response_model=List[PopularMovie])
 async def get_popular_movies(
+        request: Request,
+        limit: int = 10,
+        db: AsyncSession = Depends(get_async_db),
+        response_cache: ResponseCache = Depends(get_response_cache)
+):
+    try:
+        key = ("popular", await response_cache.catalog_version(db), limit)
+        return await response_cache.respond(
+            request, key, lambda: CineCompassRecommender.get_popular_movies_async(db, limit=limit)
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/movies/{movie_id}/similar", response_model=List[Dict[str, Any]])
+def get_similar_movies(
+        movie_id: int,
         limit: int = 10,
         recommender: CineCompassRecommender = Depends(get_recommender)
 ):
     try:
-        return recommender.get_popular_movies(limit=limit)
+        if not 1 <= limit <= 100:
+            raise HTTPException(status_code=400, detail="limit must be between 1 and 100")
+
+        similar_movies = recommender.get_similar_movies(movie_id, limit=limit)
+        if similar_movies is None:
+            raise HTTPException(status_code=404, detail="Movie not found")
+        return similar_movies
+    except HTTPException as e:
+        raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.post("/ratings/batch")
-async def add_batch_ratings(
+def add_batch_ratings(
         ratings: BatchRatingCreate,
-        current_user: User = Depends(get_or_create_session),
-        recommender: CineCompassRecommender = Depends(get_recommender)
+        current_user: SessionUser = Depends(get_or_create_session),
+        recommender: CineCompassRecommender = Depends(get_recommender),
+        session_cache: SessionCache = Depends(get_session_cache)
 ):
     try:
         if len(ratings.ratings) > 20:
@@ -145,11 +249,22 @@ async def add_batch_ratings(
                 detail="Maximum 20 ratings can be submitted at once"
             )
 
-        return recommender.process_batch_ratings(
+        result = recommender.process_batch_ratings(
             user_id=current_user.id,
             ratings=ratings.ratings
         )
+        session_cache.invalidate(current_user.session_id)
+        return result
     except HTTPException as e:
         raise e
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/metrics/refresh")
+async def get_refresh_metrics(refresh_worker: RefreshWorker = Depends(get_refresh_worker)):
+    return refresh_worker.metrics()
+
+@router.get("/metrics/responses")
+async def get_response_metrics(response_cache: ResponseCache = Depends(get_response_cache)):
+    return response_cache.metrics()
@@ -1,19 +1,22 @@
 from fastapi import Depends, HTTPException
 from sqlalchemy.orm import Session
-from app.database.init_db import init_db
+from app.database.init_db import get_sessionmaker, get_async_sessionmaker
 from app.auth.jwt_handler import JWTHandler
 from app.models.user import User
 
 jwt_handler = JWTHandler()
 
 def get_db():
-    engine, SessionLocal = init_db()
-    db = SessionLocal()
+    db = get_sessionmaker()()
     try:
         yield db
     finally:
         db.close()
 
+async def get_async_db():
+    async with get_async_sessionmaker()() as db:
+        yield db
+
 async def get_current_user(
     db: Session = Depends(get_db),
     token_data: dict = Depends(jwt_handler.verify_token)
@@ -0,0 +1,77 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from app.models.user import ONBOARDING_RATINGS
+
+
+class SessionUser(NamedTuple):
+    """What the endpoints need to know about the user behind a session id"""
+    id: int
+    session_id: str
+    rating_count: int
+
+    @property
+    def has_finished_onboarding(self) -> bool:
+        return self.rating_count > ONBOARDING_RATINGS
+
+
+class SessionCache:
+    """LRU of session id to SessionUser shared by all requests, entries expire after ttl seconds
+
+    Rating writes invalidate the session they came from. Other processes only see the change once
+    their entry expires, so ttl bounds how long another worker reports a stale onboarding status.
+    A max_size of 0 disables the cache.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Optional[SessionUser]:
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[session_id]
+                return None
+            self._entries.move_to_end(session_id)
+            return user
+
+    def put(self, user: SessionUser):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[user.session_id] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user.session_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, session_id: str):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_session_cache: Optional[SessionCache] = None
+_session_cache_lock = threading.Lock()
+
+
+def get_session_cache() -> SessionCache:
+    global _session_cache
+    with _session_cache_lock:
+        if _session_cache is None:
+            _session_cache = SessionCache(
+                max_size=int(os.getenv("SESSION_CACHE_SIZE", "10000")),
+                ttl=float(os.getenv("SESSION_CACHE_TTL", "300"))
+            )
+        return _session_cache
@@ -2,26 +2,106 @@ import asyncio
 import aiohttp
 import logging
 import os
-import math
-from typing import List, Set, Dict, Any
-from datetime import datetime
-from sqlalchemy.orm import Session
+import json
+import time
+import hashlib
+import argparse
+from typing import List, Set, Dict, Any, Optional, Callable, Awaitable, Tuple
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from sqlalchemy.orm import Session, sessionmaker
 from dotenv import load_dotenv
 
-from app.database.init_db import init_db
+from app.database.init_db import init_db, get_engine, get_sessionmaker
+from app.database.rate_limit import TokenBucket, backoff_delay, parse_retry_after
+from app.database.upsert import upsert
 from app.models.movie import Movie
+from app.models.catalog_sync import CatalogSync
 
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-class CineCompassDatabaseBuilder:
+MAX_LIST_PAGES = 500
+
+# TMDB's changes feed covers at most 14 days per request
+MAX_CHANGES_WINDOW = timedelta(days=14)
+CHANGES_FEED = "tmdb_changes"
+
+MOVIE_UPDATE_COLUMNS = ["title", "overview", "genres", "cast", "director", "popularity", "vote_average",
+                        "last_updated", "combined_features", "poster_path", "backdrop_path", "features_updated",
+                        "content_hash"]
+# Everything that goes into content_hash
+MOVIE_CONTENT_COLUMNS = ["title", "overview", "genres", "cast", "director", "popularity", "vote_average",
+                         "combined_features", "poster_path", "backdrop_path"]
+
+# Throttling and server errors are worth retrying, anything else (404 for a removed movie) is final
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TMDBUnavailable(Exception):
+    """A request still failed after every retry"""
+
+
+class IngestionStats:
     def __init__(self):
+        self.started = time.monotonic()
+        self.requests = 0
+        self.throttled = 0
+        self.retries = 0
+        self.candidates = 0
+        self.saved = 0
+        self.requeued = 0
+        self.dropped = 0
+        self.write_failures = 0
+        self.unchanged = 0
+        self.features_changed = 0
+
+    def report(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self.started
+        return {
+            "seconds": round(elapsed, 2),
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "retries": self.retries,
+            "candidates": self.candidates,
+            "saved": self.saved,
+            "requeued": self.requeued,
+            "dropped": self.dropped,
+            "write_failures": self.write_failures,
+            "unchanged": self.unchanged,
+            "features_changed": self.features_changed,
+            "movies_per_second": round(self.saved / elapsed, 2) if elapsed > 0 else 0.0,
+            "drop_rate": round(self.dropped / self.candidates, 4) if self.candidates else 0.0
+        }
+
+
+class CineCompassDatabaseBuilder:
+    def __init__(
+            self,
+            session_factory: Optional[sessionmaker] = None,
+            base_url: Optional[str] = None,
+            rate_limiter: Optional[TokenBucket] = None
+    ):
         self.tmdb_access_token = os.getenv("TMDB_ACCESS_TOKEN")
-        self.engine, self.Session = init_db()
+        self.base_url = (base_url or os.getenv("TMDB_BASE_URL", "https://api.themoviedb.org/3")).rstrip("/")
+        self.engine = get_engine()
+        self.Session = session_factory or get_sessionmaker()
         self.processed_movies: Set[int] = set()
-        self.semaphore = asyncio.Semaphore(30) 
+        self.semaphore = asyncio.Semaphore(30)
+        # One limit for list and detail requests, TMDB counts them together
+        self.rate_limiter = rate_limiter or TokenBucket(rate=float(os.getenv("TMDB_RATE_LIMIT", "40")))
+        self.max_retries = int(os.getenv("TMDB_MAX_RETRIES", "5"))
+        # Movies whose details could not be fetched, retried at the end of this run and the next one
+        self.retry_queue: Dict[int, Dict] = {}
+        self.stats = IngestionStats()
+        self.fetch_workers = int(os.getenv("TMDB_FETCH_WORKERS", "30"))
+        self.queue_size = 200
+        self.write_batch_size = 50
+        self.flush_interval = 1.0
+        self.stale_after = timedelta(days=float(os.getenv("TMDB_STALE_DAYS", "30")))
+        self.max_stale = int(os.getenv("TMDB_MAX_STALE", "1000"))
         self.load_processed_movies()
 
     def load_processed_movies(self):
@@ -30,56 +110,84 @@ class CineCompassDatabaseBuilder:
             self.processed_movies = set(id[0] for id in movie_ids)
         logger.info(f"Loaded {len(self.processed_movies)} existing movie IDs")
 
+    async def _get_json(self, session: aiohttp.ClientSession, path: str, params: Dict[str, Any]) -> Optional[Dict]:
+        """GET through the shared rate limit, retrying throttled and failed requests with jittered backoff
+
+        Returns None for responses that are not worth retrying and raises TMDBUnavailable once the
+        retries are used up.
+        """
+        url = f"{self.base_url}{path}"
+        headers = {"Authorization": f"Bearer {self.tmdb_access_token}", "accept": "application/json"}
+        error = None
+
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.acquire()
+            retry_after = None
+            async with self.semaphore:
+                try:
+                    async with session.get(url, headers=headers, params=params) as response:
+                        self.stats.requests += 1
+                        if response.status == 200:
+                            self.rate_limiter.on_success()
+                            return await response.json()
+                        if response.status not in RETRY_STATUSES:
+                            logger.warning(f"Failed to fetch {path}: {response.status}")
+                            return None
+                        if response.status == 429:
+                            self.stats.throttled += 1
+                            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                            self.rate_limiter.on_throttled(retry_after)
+                        error = f"HTTP {response.status}"
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = repr(e)
+
+            if attempt < self.max_retries:
+                self.stats.retries += 1
+                await asyncio.sleep(backoff_delay(attempt, retry_after))
+
+        raise TMDBUnavailable(f"{path} failed after {self.max_retries + 1} attempts: {error}")
+
     async def fetch_page_async(self, session: aiohttp.ClientSession, list_type: str, page: int) -> List[Dict]:
         """Fetch a single page of movie lists (popular, top_rated, etc)"""
-        url = f"https://api.themoviedb.org/3/movie/{list_type}"
-        headers = {"Authorization": f"Bearer {self.tmdb_access_token}", "accept": "application/json"}
-        params = {"page": page}
-        
         try:
-            async with session.get(url, headers=headers, params=params) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return data.get("results", [])
-                else:
-                    logger.warning(f"Failed to fetch {list_type} page {page}: {response.status}")
-                    return []
+            data = await self._get_json(session, f"/movie/{list_type}", {"page": page})
+            return data.get("results", []) if data else []
         except Exception as e:
             logger.error(f"Error fetching {list_type} page {page}: {e}")
             return []
 
-    async def fetch_movie_details_async(self, session: aiohttp.ClientSession, movie_basic_data: Dict) -> Dict:
-        """Fetch details for a specific movie ID"""
+    async def fetch_movie_details_async(self, session: aiohttp.ClientSession, movie_basic_data: Dict) -> Optional[Dict]:
+        """Fetch details for a specific movie ID, queueing it for a later retry if TMDB keeps failing"""
         movie_id = movie_basic_data['id']
-        url = f"https://api.themoviedb.org/3/movie/{movie_id}"
-        headers = {"Authorization": f"Bearer {self.tmdb_access_token}", "accept": "application/json"}
-        params = {"append_to_response": "credits"}
+        try:
+            data = await self._get_json(session, f"/movie/{movie_id}", {"append_to_response": "credits"})
+        except Exception as e:
+            if movie_id in self.processed_movies:
+                # A refresh, the movie stays stale and is picked up again by the next one
+                logger.warning(f"Could not refresh {movie_id}: {e}")
+            else:
+                logger.warning(f"Queued {movie_id} for a retry: {e}")
+                self.retry_queue[movie_id] = movie_basic_data
+            return None
 
-        # Use semaphore to limit concurrency so we don't hit 429 Too Many Requests
-        async with self.semaphore:
-            try:
-                async with session.get(url, headers=headers, params=params) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return {
-                            "basic_data": movie_basic_data,
-                            "details": data
-                        }
-                    elif response.status == 429:
-                        logger.warning("Rate limit hit, sleeping briefly...")
-                        await asyncio.sleep(1)
-                        return None
-                    else:
-                        return None
-            except Exception as e:
-                logger.error(f"Error fetching details for {movie_id}: {e}")
-                return None
+        self.retry_queue.pop(movie_id, None)
+        if data is None:
+            return None
+        return {
+            "basic_data": movie_basic_data,
+            "details": data
+        }
 
     @staticmethod
     def process_movie_data(data: Dict) -> Movie:
         """Transform raw API data into a Movie object"""
-        basic = data['basic_data']
+        return Movie(**CineCompassDatabaseBuilder.movie_row(data))
+
+    @staticmethod
+    def movie_row(data: Dict) -> Dict[str, Any]:
+        """Column values of the movies row for raw API data, the details response wins over the list entry"""
         details = data['details']
+        basic = {**data['basic_data'], **details}
         
         genres = [g["name"] for g in details.get("genres", [])]
         # Take top 5 cast
@@ -91,88 +199,351 @@ class CineCompassDatabaseBuilder:
 
         combined_features = f"{basic['title']} {basic.get('overview', '')} {' '.join(genres)} {' '.join(cast)} {director}"
 
-        return Movie(
-            id=basic["id"],
-            title=basic["title"],
-            overview=basic.get("overview", ""),
-            genres=genres,
-            cast=cast,
-            director=director,
-            popularity=basic.get("popularity", 0),
-            vote_average=basic.get("vote_average", 0),
-            last_updated=datetime.now(),
-            combined_features=combined_features,
-            poster_path=basic.get("poster_path"),
-            backdrop_path=basic.get("backdrop_path")
-        )
+        now = datetime.now()
+        row = {
+            "id": basic["id"],
+            "title": basic["title"],
+            "overview": basic.get("overview", ""),
+            "genres": genres,
+            "cast": cast,
+            "director": director,
+            "popularity": basic.get("popularity", 0),
+            "vote_average": basic.get("vote_average", 0),
+            "last_updated": now,
+            "combined_features": combined_features,
+            "poster_path": basic.get("poster_path"),
+            "backdrop_path": basic.get("backdrop_path"),
+            "features_updated": now
+        }
+        row["content_hash"] = CineCompassDatabaseBuilder.content_hash(row)
+        return row
+
+    @staticmethod
+    def content_hash(row: Dict[str, Any]) -> str:
+        content = json.dumps([row[column] for column in MOVIE_CONTENT_COLUMNS], sort_keys=True, default=str)
+        return hashlib.sha1(content.encode()).hexdigest()
 
-    async def run_population_async(self, target_size: int = 5000):
+    async def run_population_async(self, target_size: int = 5000) -> Dict[str, Any]:
+        self.stats = IngestionStats()
         current_size = len(self.processed_movies)
         if current_size >= target_size:
             logger.info("Database already populated.")
-            return
+            return self.stats.report()
 
         needed = target_size - current_size
         logger.info(f"Need to fetch approximately {needed} more movies.")
 
         async with aiohttp.ClientSession() as session:
-            sources = ["popular", "top_rated", "now_playing"]
-            candidates = []
-            
-            pages_per_source = math.ceil((needed / 20) / len(sources)) + 5
-            
-            tasks = []
-            for source in sources:
-                for page in range(1, pages_per_source + 1):
-                    tasks.append(self.fetch_page_async(session, source, page))
-            
-            logger.info(f"Fetching movie lists from {len(tasks)} pages...")
-            results = await asyncio.gather(*tasks)
-            
-            unique_candidates = {}
-            for batch in results:
-                for movie in batch:
-                    if movie['id'] not in self.processed_movies:
-                        unique_candidates[movie['id']] = movie
-            
-            candidates_list = list(unique_candidates.values())[:needed]
-            logger.info(f"Found {len(candidates_list)} unique new movies to process.")
-
-            batch_size = 50
-            
-            for i in range(0, len(candidates_list), batch_size):
-                batch_candidates = candidates_list[i : i + batch_size]
-                logger.info(f"Enriching batch {i} to {i + len(batch_candidates)}...")
-                
-                detail_tasks = [self.fetch_movie_details_async(session, m) for m in batch_candidates]
-                detailed_results = await asyncio.gather(*detail_tasks)
-                
-                valid_results = [r for r in detailed_results if r is not None]
-                
-                self._bulk_save(valid_results)
-                
+            await self._ingest(session, lambda candidates: self._discover(session, candidates, needed))
+            await self._drain_retry_queue(session)
+
+        report = self.stats.report()
+        logger.info(f"Ingestion finished: {report}")
+        return report
+
+    async def run_refresh_async(
+            self,
+            since: Optional[datetime] = None,
+            stale_after: Optional[timedelta] = None
+    ) -> Dict[str, Any]:
+        """Re-fetch movies TMDB reports as changed since the last fetch, plus the ones not fetched within stale_after
+
+        Only rows whose content changed are written. The report's features_changed counts the movies
+        whose text changed, the recommender only needs to rebuild its model when that is non-zero.
+        """
+        self.stats = IngestionStats()
+        stale_after = self.stale_after if stale_after is None else stale_after
+        now = datetime.now()
+        with self.Session() as db_session:
+            # Not max(last_updated), stale refreshes move that past a window the feed failed to deliver
+            sync = db_session.get(CatalogSync, CHANGES_FEED)
+            last_fetched = db_session.query(func.max(Movie.last_updated)).scalar()
+            stale = [movie_id for movie_id, in db_session.query(Movie.id)
+                     .filter(Movie.last_updated < now - stale_after)
+                     .order_by(Movie.last_updated)
+                     .limit(self.max_stale)]
+        start = since or (sync.synced_at if sync else None) or last_fetched or now - timedelta(days=1)
+
+        async with aiohttp.ClientSession() as session:
+            try:
+                changed = await self.fetch_changed_ids_async(session, start, now)
+                feed_read = True
+            except Exception as e:
+                logger.error(f"Could not read the changes feed since {start}, refreshing stale movies only: {e}")
+                changed = []
+                feed_read = False
+
+            movie_ids = list(dict.fromkeys(
+                [movie_id for movie_id in changed if movie_id in self.processed_movies] + stale
+            ))
+            self.stats.candidates = len(movie_ids)
+            logger.info(f"Refreshing {len(movie_ids)} movies, {len(changed)} changed on TMDB and {len(stale)} stale")
+
+            async def produce(candidates: asyncio.Queue):
+                for movie_id in movie_ids:
+                    await candidates.put({"id": movie_id})
+
+            await self._ingest(session, produce)
+
+        if feed_read:
+            with self.Session() as db_session:
+                db_session.merge(CatalogSync(source=CHANGES_FEED, synced_at=now))
+                db_session.commit()
+
+        report = self.stats.report()
+        logger.info(f"Refresh finished: {report}")
+        return report
+
+    async def fetch_changed_ids_async(self, session: aiohttp.ClientSession, since: datetime, until: datetime) -> List[int]:
+        """Ids from TMDB's /movie/changes feed between two dates, in windows of at most 14 days"""
+        movie_ids = []
+        start = since
+        while start < until:
+            end = min(until, start + MAX_CHANGES_WINDOW)
+            page = 1
+            while True:
+                data = await self._get_json(session, "/movie/changes", {
+                    "start_date": start.date().isoformat(),
+                    "end_date": end.date().isoformat(),
+                    "page": page
+                })
+                if data is None:
+                    # A partly read window would be skipped by the next refresh
+                    raise TMDBUnavailable(f"/movie/changes failed for {start.date()} to {end.date()}")
+                movie_ids.extend(item["id"] for item in data.get("results", []))
+                if page >= data.get("total_pages", 1):
+                    break
+                page += 1
+            start = end
+        return movie_ids
+
+    async def _ingest(self, session: aiohttp.ClientSession, produce: Callable[[asyncio.Queue], Awaitable[None]]):
+        """Stream candidates from produce through fetch workers into a batching writer
+
+        Every stage is connected by a bounded queue, so a slow database holds back the fetch workers
+        and slow fetches hold back the producer instead of piling up in memory.
+        """
+        candidates: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        results: asyncio.Queue = asyncio.Queue(maxsize=self.write_batch_size * 2)
+
+        writer = asyncio.create_task(self._write(results))
+        workers = [asyncio.create_task(self._fetch_worker(session, candidates, results))
+                   for _ in range(self.fetch_workers)]
+
+        async def feed():
+            await produce(candidates)
+            for _ in workers:
+                await candidates.put(None)
+            await asyncio.gather(*workers)
+            await results.put(None)
+
+        feeder = asyncio.create_task(feed())
+        try:
+            # A stage that dies would leave the others blocked on its queue, so fail the run instead
+            done, _ = await asyncio.wait((feeder, writer), return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+        finally:
+            for task in (feeder, writer, *workers):
+                task.cancel()
+
+    async def _discover(self, session: aiohttp.ClientSession, candidates: asyncio.Queue, needed: int):
+        """Queue up to needed new movies, dropped ones from an earlier run first, then the list pages"""
+        seen: Set[int] = set()
+
+        async def offer(movie: Dict):
+            if len(seen) < needed and movie['id'] not in seen and movie['id'] not in self.processed_movies:
+                seen.add(movie['id'])
+                await candidates.put(movie)
+
+        for movie in list(self.retry_queue.values()):
+            await offer(movie)
+
+        async def walk(source: str):
+            # TMDB serves at most 500 pages per list
+            for page in range(1, MAX_LIST_PAGES + 1):
+                if len(seen) >= needed:
+                    return
+                movies = await self.fetch_page_async(session, source, page)
+                if not movies:
+                    return
+                for movie in movies:
+                    await offer(movie)
+
+        await asyncio.gather(*(walk(source) for source in ("popular", "top_rated", "now_playing")))
+        self.stats.candidates = len(seen)
+        logger.info(f"Found {len(seen)} unique new movies to process.")
+
+    async def _fetch_worker(self, session: aiohttp.ClientSession, candidates: asyncio.Queue, results: asyncio.Queue):
+        while True:
+            movie = await candidates.get()
+            if movie is None:
+                return
+            detailed = await self.fetch_movie_details_async(session, movie)
+            if detailed is not None:
+                await results.put(detailed)
+
+    async def _write(self, results: asyncio.Queue):
+        """Save fetched movies in a worker thread, whenever write_batch_size are ready or flush_interval has passed"""
+        batch: List[Dict] = []
+        flush_at = 0.0
+        done = False
+        while not done:
+            timeout = max(0.0, flush_at - time.monotonic()) if batch else None
+            try:
+                item = await asyncio.wait_for(results.get(), timeout)
+            except asyncio.TimeoutError:
+                item = False
+
+            if item is None:
+                done = True
+            elif item:
+                if not batch:
+                    flush_at = time.monotonic() + self.flush_interval
+                batch.append(item)
+
+            if batch and (done or item is False or len(batch) >= self.write_batch_size):
+                try:
+                    await asyncio.to_thread(self._bulk_save, batch)
+                except Exception as e:
+                    logger.error(f"Could not save {len(batch)} movies: {str(e)}")
+                    self.stats.write_failures += len(batch)
+                batch = []
+
+    async def _drain_retry_queue(self, session: aiohttp.ClientSession):
+        """One more pass over the movies that ran out of retries, whatever still fails counts as dropped"""
+        queued = [movie for movie_id, movie in self.retry_queue.items() if movie_id not in self.processed_movies]
+        if not queued:
+            return
+
+        self.stats.requeued = len(queued)
+        logger.info(f"Retrying {len(queued)} movies that could not be fetched")
+
+        async def produce(candidates: asyncio.Queue):
+            for movie in queued:
+                await candidates.put(movie)
+
+        await self._ingest(session, produce)
+
+        self.stats.dropped = len(self.retry_queue)
+        if self.retry_queue:
+            logger.warning(f"Dropped {len(self.retry_queue)} movies for now, they are retried on the next run")
+
     def _bulk_save(self, valid_results: List[Dict]):
         if not valid_results:
             return
 
+        rows = []
+        for data in valid_results:
+            try:
+                rows.append(self.movie_row(data))
+            except Exception as e:
+                # A malformed payload only loses its own movie
+                logger.error(f"Could not process movie {data.get('basic_data', {}).get('id')}: {str(e)}")
+        self.stats.write_failures += len(valid_results) - len(rows)
+        if not rows:
+            return
+
         with self.Session() as db_session:
-            movie_objects = []
-            for data in valid_results:
-                movie_objects.append(self.process_movie_data(data))
-                self.processed_movies.add(data['basic_data']['id'])
-            
+            saved, unchanged, features_changed = self.save_changes(db_session, rows)
+
+        self.processed_movies.update(row["id"] for row in saved)
+        self.stats.saved += len(saved)
+        self.stats.unchanged += len(unchanged)
+        self.stats.features_changed += len(features_changed)
+        self.stats.write_failures += len(rows) - len(saved) - len(unchanged)
+        logger.info(f"Saved {len(saved)} movies to database, {len(unchanged)} were unchanged.")
+
+    @staticmethod
+    def save_changes(db_session: Session, rows: List[Dict[str, Any]]) -> Tuple[List[Dict], List[int], Set[int]]:
+        """Write the rows whose content hash differs from the stored one
+
+        Returns the rows written, the ids that were unchanged and the ids whose text features changed.
+        Unchanged rows only get their last_updated bumped, and features_updated is kept unless
+        combined_features differ, so refreshes that move popularity do not invalidate the model.
+        """
+        try:
+            stored = {
+                movie_id: (content_hash, combined_features)
+                for movie_id, content_hash, combined_features in db_session.query(
+                    Movie.id, Movie.content_hash, Movie.combined_features
+                ).filter(Movie.id.in_([row["id"] for row in rows]))
+            }
+        except Exception as e:
+            logger.error(f"Could not read the stored versions of {len(rows)} movies: {str(e)}")
+            db_session.rollback()
+            return [], [], set()
+
+        unchanged = [row["id"] for row in rows if row["id"] in stored and stored[row["id"]][0] == row["content_hash"]]
+        changed = [row for row in rows if row["id"] not in stored or stored[row["id"]][0] != row["content_hash"]]
+        new_features = [row for row in changed
+                        if row["id"] not in stored or stored[row["id"]][1] != row["combined_features"]]
+        same_features = [row for row in changed
+                         if row["id"] in stored and stored[row["id"]][1] == row["combined_features"]]
+
+        if unchanged:
             try:
-                for movie in movie_objects:
-                    db_session.merge(movie)
+                db_session.query(Movie).filter(Movie.id.in_(unchanged)).update({
+                    Movie.last_updated: datetime.now(),
+                    # Rows written without features_updated would otherwise follow last_updated
+                    Movie.features_updated: func.coalesce(Movie.features_updated, Movie.last_updated)
+                }, synchronize_session=False)
                 db_session.commit()
-                logger.info(f"Saved {len(movie_objects)} movies to database.")
             except Exception as e:
-                logger.error(f"Database error: {e}")
+                # Still refetched next time, the changed rows are written regardless
+                logger.error(f"Could not mark {len(unchanged)} unchanged movies as fetched: {str(e)}")
                 db_session.rollback()
+                unchanged = []
+
+        saved_features = CineCompassDatabaseBuilder.save_movies(db_session, new_features)
+        saved = saved_features + CineCompassDatabaseBuilder.save_movies(
+            db_session, same_features, [column for column in MOVIE_UPDATE_COLUMNS if column != "features_updated"]
+        )
+        return saved, unchanged, {row["id"] for row in saved_features}
+
+    @staticmethod
+    def save_movies(
+            db_session: Session,
+            rows: List[Dict[str, Any]],
+            update_columns: List[str] = MOVIE_UPDATE_COLUMNS
+    ) -> List[Dict[str, Any]]:
+        """Upsert a batch of movie rows in one statement, returns the rows that were saved
+
+        A failing batch is split in halves and each half retried, down to single rows, so a bad movie
+        only loses itself and costs a few extra statements instead of one per row.
+        """
+        if not rows:
+            return []
+        try:
+            upsert(db_session, Movie, rows, conflict_columns=["id"], update_columns=update_columns)
+            db_session.commit()
+            return rows
+        except Exception as e:
+            db_session.rollback()
+            if len(rows) == 1:
+                logger.error(f"Could not save movie {rows[0]['id']}: {e}")
+                return []
+            logger.warning(f"Batch of {len(rows)} movies failed, retrying it in halves: {e}")
+
+        middle = len(rows) // 2
+        return (CineCompassDatabaseBuilder.save_movies(db_session, rows[:middle], update_columns) +
+                CineCompassDatabaseBuilder.save_movies(db_session, rows[middle:], update_columns))
 
     def populate(self, target_size: int = 5000):
         asyncio.run(self.run_population_async(target_size))
 
+    def refresh(self):
+        return asyncio.run(self.run_refresh_async())
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Populate or refresh the movie catalog from TMDB")
+    parser.add_argument("--refresh", action="store_true", help="re-fetch changed and stale movies instead of adding new ones")
+    parser.add_argument("--target-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    init_db()
     builder = CineCompassDatabaseBuilder()
-    builder.populate(target_size=5000)
\ No newline at end of file
+    if args.refresh:
+        builder.refresh()
+    else:
+        builder.populate(target_size=args.target_size)
\ No newline at end of file
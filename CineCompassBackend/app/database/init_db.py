@@ -1,27 +1,189 @@
 import os
+import threading
 from pathlib import Path
-from sqlalchemy import create_engine
-from sqlalchemy.orm import declarative_base, sessionmaker
+from typing import Any, Dict, Optional
+from datetime import datetime
+from sqlalchemy import and_, create_engine, delete, exists, func, inspect, or_, select, text, update
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import aliased, declarative_base, sessionmaker
 
 Base = declarative_base()
 
-def init_db():
+_engine: Optional[Engine] = None
+_session_factory: Optional[sessionmaker] = None
+_async_engine: Optional[AsyncEngine] = None
+_async_session_factory: Optional[async_sessionmaker] = None
+_engine_lock = threading.Lock()
+
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+def get_database_url() -> str:
     database_url = os.getenv('DATABASE_URL')
 
     if database_url:
-        print("Using DATABASE_URL")
-    else:
-        directory = Path(__file__).parent
-        db_path = directory / "movies.db"
-        database_url = f"sqlite:///{db_path}"
-
-    engine = create_engine(database_url)
-    
+        return database_url
+
+    directory = Path(__file__).parent
+    db_path = directory / "movies.db"
+    return f"sqlite:///{db_path}"
+
+def pool_options(database_url: str) -> Dict[str, Any]:
+    """Pool settings from the environment, in-memory SQLite keeps SQLAlchemy's single connection pool"""
+    url = make_url(database_url)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}
+
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true") == "true",
+    }
+
+def create_db_engine(database_url: Optional[str] = None) -> Engine:
+    database_url = database_url or get_database_url()
+    return create_engine(database_url, **pool_options(database_url))
+
+def get_engine() -> Engine:
+    """The process-wide engine, created on first use so every session shares one connection pool"""
+    global _engine, _session_factory
+    with _engine_lock:
+        if _engine is None:
+            if os.getenv('DATABASE_URL'):
+                print("Using DATABASE_URL")
+            _engine = create_db_engine()
+            _session_factory = sessionmaker(bind=_engine)
+        return _engine
+
+def get_sessionmaker() -> sessionmaker:
+    get_engine()
+    return _session_factory
+
+def async_database_url(database_url: str) -> str:
+    """Same database through its asyncio driver, aiosqlite for SQLite and asyncpg for PostgreSQL"""
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise NotImplementedError(f"No async driver configured for {backend}")
+    return url.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+def get_async_engine() -> AsyncEngine:
+    """The process-wide asyncio engine used by the read-only endpoints, with the same pool settings"""
+    global _async_engine, _async_session_factory
+    with _engine_lock:
+        if _async_engine is None:
+            database_url = get_database_url()
+            _async_engine = create_async_engine(async_database_url(database_url), **pool_options(database_url))
+            _async_session_factory = async_sessionmaker(_async_engine, expire_on_commit=False)
+        return _async_engine
+
+def get_async_sessionmaker() -> async_sessionmaker:
+    get_async_engine()
+    return _async_session_factory
+
+def dispose_engine():
+    global _engine, _session_factory
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+            _engine = None
+            _session_factory = None
+
+async def dispose_async_engine():
+    global _async_engine, _async_session_factory
+    with _engine_lock:
+        engine, _async_engine, _async_session_factory = _async_engine, None, None
+    if engine is not None:
+        await engine.dispose()
+
+def create_schema(engine: Engine):
+    """Create missing tables and indexes, run once at startup or with python -m app.database.init_db"""
     from app.models.user import User
     from app.models.movie import Movie
     from app.models.rating import Rating
     from app.models.cached_recommendation import CachedRecommendation
-    from app.models.cached_recommendation import CachedRecommendation
-    
+    from app.models.recommendation_state import RecommendationState
+    from app.models.user_profile import UserProfile
+    from app.models.catalog_sync import CatalogSync
+
     Base.metadata.create_all(engine)
-    return engine, sessionmaker(bind=engine)
\ No newline at end of file
+    ensure_columns(engine)
+    backfill_columns(engine)
+    remove_duplicate_ratings(engine)
+    ensure_indexes(engine)
+
+def init_db():
+    """Shared engine and session factory with the schema in place, for scripts that run outside the app"""
+    engine = get_engine()
+    create_schema(engine)
+    return engine, get_sessionmaker()
+
+def ensure_columns(engine):
+    """create_all skips tables that already exist, add any nullable columns introduced since"""
+    inspector = inspect(engine)
+    quote = engine.dialect.identifier_preparer.quote
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=engine.dialect)
+            try:
+                with engine.begin() as connection:
+                    connection.execute(text(
+                        f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column_type}"
+                    ))
+            except Exception as e:
+                print(f"Could not add column {table.name}.{column.name}: {e}")
+
+def backfill_columns(engine):
+    """Fill added columns whose value follows from the rest of the row"""
+    from app.models.movie import Movie
+    from app.models.cached_recommendation import CachedRecommendation
+
+    # Until their text is written again, movies fetched before features_updated existed keep their fetch time
+    with engine.begin() as connection:
+        connection.execute(
+            update(Movie).where(Movie.features_updated.is_(None)).values(features_updated=Movie.last_updated)
+        )
+        # Cached rows from before generations existed are never read again
+        connection.execute(delete(CachedRecommendation).where(CachedRecommendation.generation.is_(None)))
+
+def remove_duplicate_ratings(engine):
+    """Keep the newest rating per user and movie, so the unique index the rating upserts rely on can be created"""
+    from app.models.rating import Rating
+
+    if any(index["name"] == "uq_ratings_user_movie" for index in inspect(engine).get_indexes(Rating.__tablename__)):
+        return
+
+    newer = aliased(Rating)
+    newer_timestamp = func.coalesce(newer.timestamp, datetime.min)
+    timestamp = func.coalesce(Rating.timestamp, datetime.min)
+    with engine.begin() as connection:
+        result = connection.execute(delete(Rating).where(exists(select(newer.id).where(
+            newer.user_id == Rating.user_id,
+            newer.movie_id == Rating.movie_id,
+            or_(newer_timestamp > timestamp, and_(newer_timestamp == timestamp, newer.id > Rating.id))
+        ))))
+    if result.rowcount:
+        print(f"Removed {result.rowcount} duplicate ratings")
+
+def ensure_indexes(engine):
+    """create_all skips the indexes of tables that already exist, add any that are missing"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(engine, checkfirst=True)
+            except Exception as e:
+                # Upserts need their unique index, without it every write would fail
+                if index.unique:
+                    raise
+                print(f"Could not create index {index.name}: {e}")
+
+if __name__ == "__main__":
+    create_schema(get_engine())
+    print("Schema is up to date")
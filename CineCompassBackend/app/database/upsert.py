@@ -0,0 +1,27 @@
+from typing import Any, Dict, List
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+
+def upsert(db: Session, model, rows: List[Dict[str, Any]], conflict_columns: List[str], update_columns: List[str]):
+    """Insert rows in a single INSERT ... ON CONFLICT DO UPDATE statement (PostgreSQL and SQLite)"""
+    if not rows:
+        return None
+
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        insert = postgresql.insert
+    elif dialect == "sqlite":
+        insert = sqlite.insert
+    else:
+        raise NotImplementedError(f"Upsert is not supported for {dialect}")
+
+    # Executed with the rows as parameters rather than inlined VALUES, so the compiled statement is cached
+    # and the driver batches them, executemany on SQLite and multi-row VALUES on PostgreSQL
+    statement = insert(model)
+    statement = statement.on_conflict_do_update(
+        index_elements=conflict_columns,
+        set_={column: statement.excluded[column] for column in update_columns}
+    )
+    return db.execute(statement, rows)
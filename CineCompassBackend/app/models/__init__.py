@@ -0,0 +1,8 @@
+# Import every model so the string relationships between them resolve, whichever one is imported first
+from app.models.user import User
+from app.models.movie import Movie
+from app.models.rating import Rating
+from app.models.cached_recommendation import CachedRecommendation
+from app.models.recommendation_state import RecommendationState
+from app.models.user_profile import UserProfile
+from app.models.catalog_sync import CatalogSync
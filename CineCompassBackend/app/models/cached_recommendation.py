@@ -1,15 +1,17 @@
-from sqlalchemy import Column, Integer, Float, DateTime, JSON, ForeignKey, String
+from sqlalchemy import Column, Integer, Float, DateTime, ForeignKey, Index
 from app.database.init_db import Base
 from datetime import datetime
 
 class CachedRecommendation(Base):
     __tablename__ = "cached_recommendations"
+    __table_args__ = (
+        Index("ix_cached_recommendations_user_generation_rank", "user_id", "generation", "rank", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
+    generation = Column(Integer, default=0)
     movie_id = Column(Integer, ForeignKey("movies.id"))
     similarity_score = Column(Float)
-    details = Column(JSON)
-    reason = Column(String, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    last_updated = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
\ No newline at end of file
+    rank = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
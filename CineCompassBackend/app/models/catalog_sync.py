@@ -0,0 +1,10 @@
+from sqlalchemy import Column, String, DateTime
+from app.database.init_db import Base
+
+class CatalogSync(Base):
+    __tablename__ = "catalog_syncs"
+
+    # One row per feed the catalog follows, such as TMDB's changes feed
+    source = Column(String(50), primary_key=True)
+    # End of the last window that was read completely, the next refresh starts there
+    synced_at = Column(DateTime)
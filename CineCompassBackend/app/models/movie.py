@@ -14,7 +14,12 @@ class Movie(Base):
     director = Column(String)
     popularity = Column(Float)
     vote_average = Column(Float)
+    # When the row was last fetched from TMDB
     last_updated = Column(DateTime)
+    # When combined_features last changed, the recommender model only needs a rebuild then
+    features_updated = Column(DateTime)
+    # Hash of the fetched content, refreshes that come back identical skip the write
+    content_hash = Column(String(40))
     combined_features = Column(Text)
     poster_path = Column(String)
     backdrop_path = Column(String)
@@ -1,11 +1,14 @@
 from pydantic import BaseModel
-from sqlalchemy import Column, Integer, Float, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, Float, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.database.init_db import Base
 
 class Rating(Base):
     __tablename__ = "ratings"
+    __table_args__ = (
+        Index("uq_ratings_user_movie", "user_id", "movie_id", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -0,0 +1,12 @@
+from sqlalchemy import Column, Integer, DateTime, ForeignKey
+from app.database.init_db import Base
+from datetime import datetime
+
+class RecommendationState(Base):
+    __tablename__ = "recommendation_states"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    total = Column(Integer, default=0)
+    # Cache generation readers should use, flipped once a refresh has written all of its rows
+    generation = Column(Integer, default=0)
+    refreshed_at = Column(DateTime, default=datetime.utcnow)
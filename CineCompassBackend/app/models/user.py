@@ -3,6 +3,9 @@ from sqlalchemy.orm import relationship
 from app.database.init_db import Base
 from datetime import datetime
 
+# Users with more ratings than this have finished onboarding
+ONBOARDING_RATINGS = 5
+
 class User(Base):
     __tablename__ = 'users'
 
@@ -10,8 +13,4 @@ class User(Base):
     session_id = Column(String, unique=True, nullable=False, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     last_session_refresh = Column(DateTime, nullable=True)
-    ratings = relationship("Rating", back_populates="user")
-
-    @property
-    def has_finished_onboarding(self) -> bool:
-        return len(self.ratings) > 5
\ No newline at end of file
+    ratings = relationship("Rating", back_populates="user")
\ No newline at end of file
@@ -0,0 +1,16 @@
+from sqlalchemy import Column, Integer, String, DateTime, JSON, ForeignKey
+from app.database.init_db import Base
+from datetime import datetime
+
+class UserProfile(Base):
+    __tablename__ = "user_profiles"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    # Vocabulary version of the model the vector was built against, it survives incremental model updates
+    model_version = Column(String)
+    vector = Column(JSON)
+    contributions = Column(JSON)
+    genre_preferences = Column(JSON)
+    director_preferences = Column(JSON)
+    rebuilt_at = Column(DateTime)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
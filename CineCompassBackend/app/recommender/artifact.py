@@ -0,0 +1,238 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from sqlalchemy.orm import Session
+
+from app.recommender.model import MovieModel, TfidfState, create_vectorizer, load_movies_df, get_catalog_version
+from app.recommender.retrieval import IVFIndex, IVF_ARRAY_NAMES
+
+logger = logging.getLogger(__name__)
+
+ARRAY_NAMES = ["data", "indices", "indptr", "idf", "row_norms", "movie_ids"]
+NEIGHBOR_ARRAY_NAMES = ["neighbor_scores", "neighbor_rows"]
+CURRENT_FILE = "current.json"
+
+
+def get_artifact_dir() -> Path:
+    directory = os.getenv("MODEL_ARTIFACT_DIR")
+    if directory:
+        return Path(directory)
+    return Path(__file__).parent / "artifacts"
+
+
+def _checksum(arrays: Dict[str, np.ndarray]) -> str:
+    digest = hashlib.sha256()
+    for name in ARRAY_NAMES:
+        digest.update(name.encode())
+        digest.update(np.ascontiguousarray(arrays[name]).tobytes())
+    return digest.hexdigest()
+
+
+def _read_manifest(root: Path) -> Optional[Dict[str, Any]]:
+    try:
+        with open(root / CURRENT_FILE) as f:
+            current = json.load(f)
+        with open(root / current["directory"] / "manifest.json") as f:
+            manifest = json.load(f)
+        manifest["path"] = root / current["directory"]
+        return manifest
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def published_version(root: Optional[Path] = None) -> Optional[str]:
+    """Catalog version of the current artifact"""
+    manifest = _read_manifest(root or get_artifact_dir())
+    return manifest["catalog_version"] if manifest else None
+
+
+def _save_arrays(target: Path, arrays: Dict[str, np.ndarray], names):
+    # The last name doubles as the completion marker, so it is written last
+    for name in names:
+        partial = target / f".{name}.{os.getpid()}.npy"
+        np.save(partial, arrays[name])
+        os.replace(partial, target / f"{name}.npy")
+
+
+def save_model(model: MovieModel, root: Optional[Path] = None) -> Optional[Path]:
+    """Write the model as .npy arrays into a versioned directory and atomically point current.json at it"""
+    root = root or get_artifact_dir()
+    matrix = model.tfidf_matrix
+    arrays = {
+        "data": matrix.data.astype(np.float32),
+        "indices": matrix.indices.astype(matrix.indices.dtype),
+        "indptr": matrix.indptr.astype(matrix.indices.dtype),
+        "idf": np.asarray(model.vectorizer.idf_, dtype=np.float64),
+        "row_norms": np.asarray(model.row_norms, dtype=np.float32),
+        "movie_ids": model.movie_ids.astype(np.int64),
+    }
+    checksum = _checksum(arrays)
+    directory = f"model-{checksum[:16]}"
+
+    try:
+        root.mkdir(parents=True, exist_ok=True)
+        target = root / directory
+        if not target.exists():
+            staging = Path(tempfile.mkdtemp(prefix=".staging-", dir=root))
+            for name, array in arrays.items():
+                np.save(staging / f"{name}.npy", array)
+            with open(staging / "vocabulary.json", "w") as f:
+                json.dump({term: int(col) for term, col in model.vectorizer.vocabulary_.items()}, f)
+            with open(staging / "manifest.json", "w") as f:
+                json.dump({
+                    "catalog_version": model.version,
+                    "checksum": checksum,
+                    "shape": list(matrix.shape),
+                    "nnz": int(matrix.nnz),
+                    "features_updated": model.features_updated.isoformat() if model.features_updated else None,
+                    "unseen_rows": model.unseen_rows
+                }, f)
+            try:
+                os.rename(staging, target)
+            except OSError:
+                # Another worker published the same artifact first
+                shutil.rmtree(staging, ignore_errors=True)
+
+        if model.neighbor_rows is not None and not (target / "neighbor_rows.npy").exists():
+            neighbors = {"neighbor_scores": model.neighbor_scores, "neighbor_rows": model.neighbor_rows}
+            _save_arrays(target, neighbors, NEIGHBOR_ARRAY_NAMES)
+
+        if model.ivf_index is not None and not (target / f"{IVF_ARRAY_NAMES[-1]}.npy").exists():
+            _save_arrays(target, model.ivf_index.arrays(), IVF_ARRAY_NAMES)
+
+        previous = _read_manifest(root)
+        pointer = root / f".{CURRENT_FILE}.{os.getpid()}"
+        with open(pointer, "w") as f:
+            json.dump({"directory": directory, "catalog_version": model.version}, f)
+        os.replace(pointer, root / CURRENT_FILE)
+        _prune(root, {directory, previous["path"].name if previous else directory})
+    except OSError as e:
+        logger.warning(f"Could not write model artifact to {root}: {e}")
+        return None
+
+    logger.info(f"Saved model artifact {directory} for catalog {model.version}")
+    return target
+
+
+def _prune(root: Path, keep):
+    """Remove published model directories other than the current and previous one
+
+    Workers still serving an older model keep their memory-mapped files until they load the new one.
+    """
+    for path in root.glob("model-*"):
+        if path.name not in keep and path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def load_model(db: Session, version: str, root: Optional[Path] = None) -> Optional[MovieModel]:
+    """Memory-map the current artifact, returns None when it is missing or stale"""
+    manifest = _read_manifest(root or get_artifact_dir())
+    if manifest is None:
+        return None
+    if manifest["catalog_version"] != version:
+        logger.info(f"Model artifact is stale ({manifest['catalog_version']} != {version})")
+        return None
+
+    path = manifest["path"]
+    loaded = _load_tfidf(manifest)
+    if loaded is None:
+        return None
+    vectorizer, tfidf_matrix, arrays = loaded
+
+    movies_df = load_movies_df(db)
+    if not np.array_equal(movies_df["id"].to_numpy(), arrays["movie_ids"]):
+        logger.info("Model artifact movie order does not match the catalog")
+        return None
+
+    model = MovieModel(version, vectorizer, tfidf_matrix, movies_df, row_norms=arrays["row_norms"],
+                       unseen_rows=manifest.get("unseen_rows", 0))
+    if all((path / f"{name}.npy").exists() for name in NEIGHBOR_ARRAY_NAMES):
+        model.neighbor_rows = np.load(path / "neighbor_rows.npy", mmap_mode="r")
+        model.neighbor_scores = np.load(path / "neighbor_scores.npy", mmap_mode="r")
+    if all((path / f"{name}.npy").exists() for name in IVF_ARRAY_NAMES):
+        model.ivf_index = IVFIndex.from_arrays(
+            {name: np.load(path / f"{name}.npy", mmap_mode="r") for name in IVF_ARRAY_NAMES}
+        )
+
+    logger.info(f"Loaded model artifact {path.name} for catalog {version}")
+    return model
+
+
+def load_tfidf_state(root: Optional[Path] = None) -> Optional[TfidfState]:
+    """Memory-map the current artifact's vectorizer and rows whatever its catalog version, to update it from"""
+    manifest = _read_manifest(root or get_artifact_dir())
+    if manifest is None or not manifest.get("features_updated"):
+        return None
+
+    loaded = _load_tfidf(manifest)
+    if loaded is None:
+        return None
+    vectorizer, tfidf_matrix, arrays = loaded
+    path = manifest["path"]
+    neighbors = {}
+    if all((path / f"{name}.npy").exists() for name in NEIGHBOR_ARRAY_NAMES):
+        neighbors = {name: np.load(path / f"{name}.npy", mmap_mode="r") for name in NEIGHBOR_ARRAY_NAMES}
+    ivf_index = None
+    if all((path / f"{name}.npy").exists() for name in IVF_ARRAY_NAMES):
+        ivf_index = IVFIndex.from_arrays(
+            {name: np.load(path / f"{name}.npy", mmap_mode="r") for name in IVF_ARRAY_NAMES}
+        )
+    return TfidfState(vectorizer, tfidf_matrix, arrays["movie_ids"], arrays["row_norms"],
+                      datetime.fromisoformat(manifest["features_updated"]), manifest.get("unseen_rows", 0),
+                      neighbors.get("neighbor_rows"), neighbors.get("neighbor_scores"), ivf_index)
+
+
+def _load_tfidf(manifest: Dict[str, Any]):
+    path = manifest["path"]
+    try:
+        arrays = {name: np.load(path / f"{name}.npy", mmap_mode="r") for name in ARRAY_NAMES}
+        with open(path / "vocabulary.json") as f:
+            vocabulary = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read model artifact {path}: {e}")
+        return None
+
+    tfidf_matrix = csr_matrix(
+        (arrays["data"], arrays["indices"], arrays["indptr"]),
+        shape=tuple(manifest["shape"]),
+        copy=False
+    )
+    vectorizer = create_vectorizer(vocabulary=vocabulary)
+    vectorizer.idf_ = np.asarray(arrays["idf"])
+    return vectorizer, tfidf_matrix, arrays
+
+
+def build_artifact():
+    """Offline build step: fit the model, its neighbour index and IVF index from the movies table and publish them"""
+    from app.database.init_db import init_db
+    from app.recommender.model import build_model
+    from app.recommender.neighbors import build_neighbors, default_neighbor_count
+
+    engine, SessionLocal = init_db()
+    with SessionLocal() as db:
+        model = build_model(db, get_catalog_version(db))
+        if model is None:
+            logger.warning("No movies in the database, nothing to build")
+            return None
+
+        model.neighbor_rows, model.neighbor_scores = build_neighbors(
+            model.tfidf_matrix,
+            model.row_norms,
+            top_n=default_neighbor_count()
+        )
+        model.ivf_index = IVFIndex.build(model.tfidf_matrix)
+        return save_model(model)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    build_artifact()
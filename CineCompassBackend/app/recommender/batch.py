@@ -0,0 +1,229 @@
+import os
+import json
+import time
+import argparse
+import logging
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Any
+
+import numpy as np
+from scipy.sparse import vstack
+from sqlalchemy.orm import Session
+
+from app.models.movie import Movie
+from app.models.rating import Rating
+from app.models.user_profile import UserProfile
+from app.recommender.artifact import get_artifact_dir
+from app.recommender.content_based import CineCompassRecommender, collect_stale_generations
+from app.recommender.model import MovieModel
+from app.recommender.profile import vector_from_json
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on the dense users x movies score block, about 160 MB of float64
+MAX_BLOCK_CELLS = 20_000_000
+
+
+def score_block(
+        model: MovieModel,
+        profiles: List[Tuple[int, Dict, Dict]],
+        limit: int
+) -> List[Tuple[int, List[int], List[float], int]]:
+    """Top movies for a block of (user_id, vector, contributions) profiles from one sparse x dense multiplication
+
+    Scores are min-max scaled per user over the unrated movies, the same normalization
+    update_recommendations applies to a single user.
+    """
+    n_features = model.tfidf_matrix.shape[1]
+    vectors = vstack([vector_from_json(vector, n_features) for _, vector, _ in profiles]).tocsr()
+    profile_norms = np.sqrt(np.asarray(vectors.multiply(vectors).sum(axis=1)).ravel())
+
+    # movies x features @ features x users, dense on the small side only
+    dots = np.asarray(model.tfidf_matrix @ vectors.toarray().T).T
+    norms = np.outer(profile_norms, model.row_norms)
+    similarities = np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
+
+    rated = np.zeros(similarities.shape, dtype=bool)
+    for i, (_, _, contributions) in enumerate(profiles):
+        rated[i, model.rows_for([int(movie_id) for movie_id in contributions])] = True
+
+    low = np.where(rated, np.inf, similarities).min(axis=1, keepdims=True)
+    high = np.where(rated, -np.inf, similarities).max(axis=1, keepdims=True)
+    spread = np.where(high - low > 0, high - low, 1.0)
+    scaled = np.where(rated, -np.inf, (similarities - low) / spread)
+
+    k = min(limit, model.size)
+    top = np.argpartition(scaled, -k, axis=1)[:, -k:]
+    top_scores = np.take_along_axis(scaled, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+    results = []
+    for i, (user_id, _, _) in enumerate(profiles):
+        available = int(model.size - rated[i].sum())
+        keep = min(k, available)
+        results.append((
+            user_id,
+            model.movie_ids[top[i, :keep]].tolist(),
+            top_scores[i, :keep].tolist(),
+            available
+        ))
+    return results
+
+
+class BatchRecompute:
+    """Recomputes the cached recommendations of every rated user in one shard, in blocks of users
+
+    Progress is checkpointed after every block, so an interrupted shard resumes after the last
+    user it finished as long as the model has not changed in between. The checkpoint is removed
+    once the shard completes.
+    """
+
+    def __init__(self, db: Session, shard: int = 0, shards: int = 1, block_size: int = 256,
+                 checkpoint_dir: Optional[Path] = None):
+        self.db = db
+        self.shard = shard
+        self.shards = shards
+        self.recommender = CineCompassRecommender(db)
+        self.model = self.recommender.model
+        self.block_size = max(1, min(block_size, MAX_BLOCK_CELLS // max(self.model.size, 1))) if self.model else block_size
+        self.checkpoint_path = (checkpoint_dir or get_artifact_dir() / "batch") / f"shard-{shard}-of-{shards}.json"
+
+    def _read_checkpoint(self) -> int:
+        try:
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        if checkpoint.get("model_version") != self.model.version:
+            logger.info(f"Ignoring checkpoint for model {checkpoint.get('model_version')}")
+            return 0
+        return int(checkpoint["last_user_id"])
+
+    def _write_checkpoint(self, last_user_id: int, users: int):
+        self.checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+        partial = self.checkpoint_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(partial, "w") as f:
+            json.dump({"model_version": self.model.version, "last_user_id": last_user_id, "users": users}, f)
+        os.replace(partial, self.checkpoint_path)
+
+    def _user_ids(self, after: int) -> List[int]:
+        query = self.db.query(Rating.user_id).distinct().filter(Rating.user_id > after)
+        if self.shards > 1:
+            query = query.filter(Rating.user_id % self.shards == self.shard)
+        return [user_id for user_id, in query.order_by(Rating.user_id).all()]
+
+    def _profiles(self, user_ids: List[int]) -> List[Tuple[int, Dict, Dict]]:
+        """(user_id, vector, contributions) for the block, rebuilding stale profiles from a single ratings query"""
+        stored = {
+            profile.user_id: profile
+            for profile in self.db.query(UserProfile).filter(UserProfile.user_id.in_(user_ids)).all()
+        }
+        stale = [user_id for user_id in user_ids if self.recommender._profile_is_stale(stored.get(user_id))]
+
+        if stale:
+            rated_movies = defaultdict(list)
+            for user_id, movie_id, rating, timestamp, genres, director in (
+                    self.db.query(Rating.user_id, Rating.movie_id, Rating.rating, Rating.timestamp,
+                                  Movie.genres, Movie.director)
+                    .join(Movie, Movie.id == Rating.movie_id)
+                    .filter(Rating.user_id.in_(stale))
+                    .all()
+            ):
+                rated_movies[user_id].append((movie_id, rating, timestamp, genres, director))
+
+            current_time = datetime.utcnow()
+            for user_id in stale:
+                rows = rated_movies.get(user_id, [])
+                genre_prefs, director_prefs = self.recommender._preferences_from(
+                    [(rating, genres, director) for _, rating, _, genres, director in rows]
+                )
+                profile = self.recommender._profile_from_ratings(
+                    user_id,
+                    [(movie_id, rating, timestamp) for movie_id, rating, timestamp, _, _ in rows],
+                    genre_prefs,
+                    director_prefs,
+                    current_time
+                )
+                if profile is None:
+                    stored.pop(user_id, None)
+                else:
+                    stored[user_id] = self.db.merge(profile)
+
+        # Read before committing, afterwards every profile would be reloaded one query at a time
+        profiles = [
+            (user_id, stored[user_id].vector, stored[user_id].contributions)
+            for user_id in user_ids if user_id in stored
+        ]
+        self.db.commit()
+        return profiles
+
+    def run(self, resume: bool = True) -> Dict[str, Any]:
+        start = time.perf_counter()
+        if self.model is None:
+            logger.warning("No movies in the database, nothing to recompute")
+            return {"shard": self.shard, "users": 0, "seconds": 0.0}
+
+        last_user_id = self._read_checkpoint() if resume else 0
+        user_ids = self._user_ids(last_user_id)
+        processed = 0
+
+        for i in range(0, len(user_ids), self.block_size):
+            block = user_ids[i:i + self.block_size]
+            profiles = self._profiles(block)
+            if profiles:
+                self.recommender.store_recommendations(score_block(self.model, profiles, self.recommender.cache_size))
+                collect_stale_generations(self.db, block)
+            processed += len(block)
+            self._write_checkpoint(block[-1], processed)
+
+            elapsed = time.perf_counter() - start
+            logger.info(f"Shard {self.shard}/{self.shards}: {processed}/{len(user_ids)} users, "
+                        f"{processed / elapsed:.1f} users/s")
+
+        # Finished, the next run starts over instead of resuming
+        self.checkpoint_path.unlink(missing_ok=True)
+        return {"shard": self.shard, "users": processed, "seconds": time.perf_counter() - start}
+
+
+def run_shard(shard: int, shards: int, block_size: int, resume: bool) -> Dict[str, Any]:
+    from app.database.init_db import init_db
+
+    logging.basicConfig(level=logging.INFO)
+    engine, SessionLocal = init_db()
+    with SessionLocal() as db:
+        return BatchRecompute(db, shard, shards, block_size).run(resume=resume)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute cached recommendations for all users")
+    parser.add_argument("--shards", type=int, default=1, help="split users into this many shards by user id")
+    parser.add_argument("--shard", type=int, help="only run this shard, by default all shards run in parallel")
+    parser.add_argument("--block-size", type=int, default=256, help="users scored per multiplication")
+    parser.add_argument("--restart", action="store_true", help="ignore checkpoints and start from the first user")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    shards = [args.shard] if args.shard is not None else list(range(args.shards))
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+        results = list(executor.map(
+            run_shard,
+            shards,
+            [args.shards] * len(shards),
+            [args.block_size] * len(shards),
+            [not args.restart] * len(shards)
+        ))
+    elapsed = time.perf_counter() - start
+
+    users = sum(result["users"] for result in results)
+    print(f"Recomputed {users} users in {elapsed:.1f}s ({users / elapsed if elapsed else 0:.1f} users/s)")
+
+
+if __name__ == "__main__":
+    main()
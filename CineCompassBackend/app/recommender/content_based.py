@@ -1,94 +1,78 @@
 import os
+import asyncio
 
 import numpy as np
-from pyexpat import features
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.preprocessing import MinMaxScaler
 from typing import List, Optional, Dict, Any, Tuple
 from datetime import datetime, timedelta
 import logging
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, insert, or_, select
+from sqlalchemy.exc import IntegrityError
 from app.models.rating import Rating
 from app.models.cached_recommendation import CachedRecommendation
 from app.models.movie import Movie
 from app.models.user import User
+from app.models.recommendation_state import RecommendationState
+from app.models.user_profile import UserProfile
 from app.schemas.rating import RatingCreate
 from app.schemas.recommendation import RecommendationResponse
-import pandas as pd
+from app.database.upsert import upsert
+from app.recommender.model import model_registry, top_k_indices
+from app.recommender.refresh_worker import RefreshWorker
+from app.recommender.retrieval import ExactRetriever, get_retriever
+from app.recommender.diversity import genre_jaccard, tfidf_cosine, mmr_rerank
+from app.recommender.profile import add_preference, remove_preference, rating_weight, vector_to_json, vector_from_json
 from dotenv import load_dotenv
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+def collect_stale_generations(db: Session, user_ids: List[int]) -> int:
+    """Delete cached rows older than the previous generation of each user or without one, returns the number removed
+
+    The previous generation is kept so a reader that looked up the state just before a flip can still
+    finish its page.
+    """
+    if not user_ids:
+        return 0
+
+    current = (
+        select(RecommendationState.generation)
+        .where(RecommendationState.user_id == CachedRecommendation.user_id)
+        .scalar_subquery()
+    )
+    deleted = db.query(CachedRecommendation).filter(
+        CachedRecommendation.user_id.in_(user_ids),
+        or_(CachedRecommendation.generation < current - 1, CachedRecommendation.generation.is_(None))
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+
 class CineCompassRecommender:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, refresh_worker: Optional[RefreshWorker] = None):
         self.db = db
-        max_features = 1000 if os.getenv("IS_PRODUCTION") == "true" else 2000
-        self.tfidf_vectorizer = TfidfVectorizer(
-            stop_words="english",
-            max_features=max_features,
-            min_df=3,
-            max_df=0.95,
-            ngram_range=(1, 2)
-        )
+        self.refresh_worker = refresh_worker
+        self.model = None
         self.tfidf_matrix = None
-        self.movies_df = None
         self.last_update_time = {}
         self.update_threshold = timedelta(hours=4)
+        self.cache_size = int(os.getenv("RECOMMENDATION_CACHE_SIZE", "300"))
+        self.approximate_threshold = int(os.getenv("APPROXIMATE_SCORING_THRESHOLD", "200000"))
         self.scaler = MinMaxScaler()
         self._load_movies()
 
     def _load_movies(self):
         try:
-            movies = self.db.query(Movie).all()
-            if movies:
-                self.movies_df = pd.DataFrame([{
-                    'id': movie.id,
-                    'title': movie.title,
-                    'combined_features': self._preprocess_features(movie),
-                    'details': {
-                        'genres': movie.genres,
-                        'cast': movie.cast,
-                        'director': movie.director,
-                        'poster_path': movie.poster_path,
-                        'backdrop_path': movie.backdrop_path,
-                        'overview': movie.overview,
-                        'vote_average': movie.vote_average,
-                        'popularity': movie.popularity
-                    }
-                } for movie in movies])
-
-                if not self.movies_df.empty:
-                    self.tfidf_matrix = self.tfidf_vectorizer.fit_transform(
-                        self.movies_df['combined_features']
-                    ).tocsr()
+            self.model = model_registry.get(self.db)
+            if self.model is not None:
+                self.tfidf_matrix = self.model.tfidf_matrix
         except Exception as e:
             logger.error(f"Error loading movies: {str(e)}")
             raise
 
-    def _preprocess_features(self, movie: Movie) -> str:
-        features = []
-
-        if movie.genres:
-            features.extend([f"genre_{g.lower()}" * 3 for g in movie.genres])
-
-        if movie.director:
-            features.append(f"director_{movie.director.lower()}" * 2)
-
-        if movie.cast:
-            for i, actor in enumerate(movie.cast[:3]): 
-                features.append(f"actor_{actor.lower()}")
-
-        if movie.overview:
-            cleaned_overview = movie.overview.lower()
-            for phrase in ["the movie", "the film", "the story"]:
-                cleaned_overview = cleaned_overview.replace(phrase, "")
-            features.append(cleaned_overview)
-
-        return " ".join(features)
-
     def _calculate_diversity_score(self, recommended_movies: List[Dict]) -> float:
         if not recommended_movies:
             return 0.0
@@ -106,54 +90,43 @@ class CineCompassRecommender:
         return (max_genres + max_directors) / 2
 
     def _get_user_preferences(self, user_id: int) -> Tuple[Dict, Dict]:
-        ratings = self.db.query(Rating).filter(Rating.user_id == user_id).all()
+        rated_movies = (
+            self.db.query(Rating.rating, Movie.genres, Movie.director)
+            .join(Movie, Movie.id == Rating.movie_id)
+            .filter(Rating.user_id == user_id)
+            .all()
+        )
+        return self._preferences_from(rated_movies)
 
+    @staticmethod
+    def _preferences_from(rated_movies: List[Tuple[float, List[str], str]]) -> Tuple[Dict, Dict]:
         genre_preferences = {}
         director_preferences = {}
 
-        for rating in ratings:
-            movie = self.db.query(Movie).filter(Movie.id == rating.movie_id).first()
-            if movie:
-                for genre in movie.genres:
-                    if genre not in genre_preferences:
-                        genre_preferences[genre] = {'count': 0, 'avg_rating': 0}
-                    genre_preferences[genre]['count'] += 1
-                    genre_preferences[genre]['avg_rating'] = (
-                            (genre_preferences[genre]['avg_rating'] * (genre_preferences[genre]['count'] - 1) +
-                             rating.rating) / genre_preferences[genre]['count']
-                    )
-
-                director = movie.director
-                if director not in director_preferences:
-                    director_preferences[director] = {'count': 0, 'avg_rating': 0}
-                director_preferences[director]['count'] += 1
-                director_preferences[director]['avg_rating'] = (
-                        (director_preferences[director]['avg_rating'] * (director_preferences[director]['count'] - 1) +
-                         rating.rating) / director_preferences[director]['count']
-                )
+        for rating, genres, director in rated_movies:
+            for genre in genres or []:
+                add_preference(genre_preferences, genre, rating)
+            add_preference(director_preferences, director, rating)
 
         return genre_preferences, director_preferences
 
     def process_rating(self, user_id: int, movie_id: int, rating: float) -> Dict[str, Any]:
         try:
-            existing_rating = (
-                self.db.query(Rating)
+            previous_rating = (
+                self.db.query(Rating.rating)
                 .filter(Rating.user_id == user_id, Rating.movie_id == movie_id)
-                .first()
+                .scalar()
             )
 
-            if existing_rating:
-                existing_rating.rating = rating
-                existing_rating.timestamp = datetime.utcnow()
-            else:
-                db_rating = Rating(
-                    user_id=user_id,
-                    movie_id=movie_id,
-                    rating=rating,
-                    timestamp=datetime.utcnow()
-                )
-                self.db.add(db_rating)
+            upsert(
+                self.db,
+                Rating,
+                [{"user_id": user_id, "movie_id": movie_id, "rating": rating, "timestamp": datetime.utcnow()}],
+                conflict_columns=["user_id", "movie_id"],
+                update_columns=["rating", "timestamp"]
+            )
 
+            self._apply_ratings_to_profile(user_id, [(movie_id, rating, previous_rating)])
             self.db.commit()
             return {"status": "success"}
         except Exception as e:
@@ -167,100 +140,177 @@ class CineCompassRecommender:
             page: int = 1,
             page_size: int = 20,
             last_sync_time: Optional[datetime] = None,
-            diversity_threshold: float = 0.3
+            diversity_threshold: float = 0.3,
+            cursor: Optional[int] = None,
+            diversity: str = "genre",
+            mmr_lambda: float = 0.7,
+            pool_size: Optional[int] = None
     ) -> RecommendationResponse:
         try:
             if last_sync_time:
-                new_ratings = self.db.query(Rating).filter(
-                    Rating.user_id == user_id,
-                    Rating.timestamp > last_sync_time
+                new_ratings = self.db.execute(self._new_ratings_query(user_id, last_sync_time)).scalars().all()
+                if new_ratings:
+                    return self._sync_response(page, page_size, new_ratings)
+
+            page, offset, expanded_page_size = self._page_window(page, page_size, cursor, pool_size)
+            state = self.db.execute(self._state_query(user_id)).first()
+
+            if self._needs_scoring(state, offset, expanded_page_size):
+                rec_items, total = self._score_page(user_id, offset, expanded_page_size)
+            else:
+                total, generation = state
+                recommendations = self.db.execute(
+                    self._cached_page_query(user_id, generation, offset, expanded_page_size)
                 ).all()
+                rec_items = self._hydrate([(movie_id, score) for movie_id, score in recommendations])
+
+            return self._finish_page(user_id, rec_items, total, page, page_size, offset, mmr_lambda, diversity)
+        except Exception as e:
+            logger.error(f"Error getting recommendations: {str(e)}")
+            raise
 
+    async def get_recommendations_async(
+            self,
+            async_db: AsyncSession,
+            user_id: int,
+            page: int = 1,
+            page_size: int = 20,
+            last_sync_time: Optional[datetime] = None,
+            cursor: Optional[int] = None,
+            diversity: str = "genre",
+            mmr_lambda: float = 0.7,
+            pool_size: Optional[int] = None,
+            state=None
+    ) -> RecommendationResponse:
+        """get_recommendations for the event loop, reads through async_db and runs scoring and MMR in a thread
+
+        A state already read with get_cache_state_async is used as is, so the page matches the
+        generation the caller saw.
+        """
+        try:
+            if last_sync_time:
+                new_ratings = (await async_db.execute(self._new_ratings_query(user_id, last_sync_time))).scalars().all()
                 if new_ratings:
-                    return RecommendationResponse(
-                        items=[],
-                        total=0,
-                        page=page,
-                        page_size=page_size,
-                        needs_sync=True,
-                        new_ratings=[rating.to_dict() for rating in new_ratings]
-                    )
-
-            expanded_page_size = int(page_size * 1.5)
-
-            recommendations = (self.db.query(CachedRecommendation)
-                               .filter(CachedRecommendation.user_id == user_id)
-                               .order_by(CachedRecommendation.similarity_score.desc())
-                               .offset((page - 1) * page_size)
-                               .limit(expanded_page_size)
-                               .all())
-
-            rec_items = [{
-                "id": rec.movie_id,
-                "similarity_score": rec.similarity_score,
-                **rec.details
-            } for rec in recommendations]
-
-            # MMR Selection (Diversity)
-            if len(rec_items) > 0:
-                 rec_items = self._mmr_selection(rec_items, page_size)
-
-            total = self.db.query(CachedRecommendation).filter(
-                CachedRecommendation.user_id == user_id
-            ).count()
-            
-            diversity_score = self._calculate_diversity_score(rec_items)
-
-            return RecommendationResponse(
-                items=rec_items,
-                total=total,
-                page=page,
-                page_size=page_size,
-                diversity_score=diversity_score
+                    return self._sync_response(page, page_size, new_ratings)
+
+            page, offset, expanded_page_size = self._page_window(page, page_size, cursor, pool_size)
+            if state is None:
+                state = await self.get_cache_state_async(async_db, user_id)
+
+            if self._needs_scoring(state, offset, expanded_page_size):
+                rec_items, total = await asyncio.to_thread(self._score_page, user_id, offset, expanded_page_size)
+            else:
+                total, generation = state
+                recommendations = (await async_db.execute(
+                    self._cached_page_query(user_id, generation, offset, expanded_page_size)
+                )).all()
+                rec_items = self._hydrate([(movie_id, score) for movie_id, score in recommendations])
+
+            return await asyncio.to_thread(
+                self._finish_page, user_id, rec_items, total, page, page_size, offset, mmr_lambda, diversity
             )
         except Exception as e:
             logger.error(f"Error getting recommendations: {str(e)}")
             raise
 
-    def _mmr_selection(self, items: List[Dict], k: int, lambda_param: float = 0.7) -> List[Dict]:
+    async def get_cache_state_async(self, async_db: AsyncSession, user_id: int):
+        """(total, generation) of the user's cached recommendations, None before the first refresh"""
+        return (await async_db.execute(self._state_query(user_id))).first()
+
+    @staticmethod
+    def _new_ratings_query(user_id: int, last_sync_time: datetime):
+        return select(Rating).where(Rating.user_id == user_id, Rating.timestamp > last_sync_time)
+
+    @staticmethod
+    def _sync_response(page: int, page_size: int, new_ratings: List[Rating]) -> RecommendationResponse:
+        return RecommendationResponse(
+            items=[],
+            total=0,
+            page=page,
+            page_size=page_size,
+            needs_sync=True,
+            new_ratings=[rating.to_dict() for rating in new_ratings]
+        )
+
+    @staticmethod
+    def _page_window(page: int, page_size: int, cursor: Optional[int], pool_size: Optional[int]) -> Tuple[int, int, int]:
+        """(page, offset, candidate pool size) for a page or cursor request"""
+        expanded_page_size = max(pool_size or int(page_size * 1.5), page_size)
+        # Cached ranks are contiguous from 1, so the cursor is the last rank the client has seen
+        offset = cursor if cursor is not None else (page - 1) * page_size
+        if cursor is not None:
+            page = cursor // page_size + 1
+        return page, offset, expanded_page_size
+
+    @staticmethod
+    def _state_query(user_id: int):
+        return select(RecommendationState.total, RecommendationState.generation).where(
+            RecommendationState.user_id == user_id
+        )
+
+    @staticmethod
+    def _cached_page_query(user_id: int, generation: int, offset: int, limit: int):
+        return (select(CachedRecommendation.movie_id, CachedRecommendation.similarity_score)
+                .where(CachedRecommendation.user_id == user_id,
+                       CachedRecommendation.generation == generation,
+                       CachedRecommendation.rank > offset)
+                .order_by(CachedRecommendation.rank)
+                .limit(limit))
+
+    def _needs_scoring(self, state, offset: int, expanded_page_size: int) -> bool:
+        if state is None or state.total is None:
+            # No refresh has finished for this user yet, score the page directly
+            return True
+        # The cache only holds the top cache_size movies, everything past it is scored on demand
+        return offset + expanded_page_size > self.cache_size and state.total > self.cache_size
+
+    def _finish_page(
+            self,
+            user_id: int,
+            rec_items: List[Dict],
+            total: int,
+            page: int,
+            page_size: int,
+            offset: int,
+            mmr_lambda: float,
+            diversity: str
+    ) -> RecommendationResponse:
+        # MMR Selection (Diversity)
+        if len(rec_items) > 0:
+             rec_items = self._mmr_selection(rec_items, page_size, lambda_param=mmr_lambda, diversity=diversity)
+
+        diversity_score = self._calculate_diversity_score(rec_items)
+
+        return RecommendationResponse(
+            items=rec_items,
+            total=total,
+            page=page,
+            page_size=page_size,
+            next_cursor=offset + page_size if offset + page_size < total else None,
+            refresh_pending=self.refresh_worker.is_pending(user_id) if self.refresh_worker else False,
+            diversity_score=diversity_score
+        )
+
+    def _mmr_selection(
+            self,
+            items: List[Dict],
+            k: int,
+            lambda_param: float = 0.7,
+            diversity: str = "genre"
+    ) -> List[Dict]:
+        """Re-rank for diversity, "embedding" compares TF-IDF rows and "genre" falls back to genre overlap"""
         if not items:
             return []
-            
-        selected = [items[0]]
-        candidates = items[1:]
-        
-        while len(selected) < k and candidates:
-            best_score = -float('inf')
-            best_candidate_idx = -1
-            
-            for i, candidate in enumerate(candidates):
-                relevance = candidate.get('similarity_score', 0)
-                
-                max_sim_to_selected = 0
-                candidate_genres = set(candidate.get('genres', []))
-                
-                for sel in selected:
-                    sel_genres = set(sel.get('genres', []))
-                    if not candidate_genres or not sel_genres:
-                        sim = 0
-                    else:
-                        intersection = len(candidate_genres.intersection(sel_genres))
-                        union = len(candidate_genres.union(sel_genres))
-                        sim = intersection / union if union > 0 else 0
-                    max_sim_to_selected = max(max_sim_to_selected, sim)
-                
-                mmr_score = lambda_param * relevance - (1 - lambda_param) * max_sim_to_selected
-                
-                if mmr_score > best_score:
-                    best_score = mmr_score
-                    best_candidate_idx = i
-            
-            if best_candidate_idx != -1:
-                selected.append(candidates.pop(best_candidate_idx))
-            else:
-                selected.append(candidates.pop(0))
-                
-        return selected
+
+        rows = self.model.rows_for([item['id'] for item in items])
+        relevance = np.array([item.get('similarity_score', 0) for item in items])
+        if diversity == "embedding":
+            similarity_to = tfidf_cosine(self.tfidf_matrix[rows], self.model.row_norms[rows])
+        else:
+            similarity_to = genre_jaccard(self.model.genre_matrix[rows])
+
+        order = mmr_rerank(relevance, similarity_to, k, lambda_param)
+        return [items[i] for i in order]
 
     def _merge_recommendations(
             self,
@@ -284,170 +334,345 @@ class CineCompassRecommender:
 
         return merged
 
-    def update_recommendations(self, user_id: int):
-        try:
-            ratings = self.db.query(Rating).filter(Rating.user_id == user_id).all()
-            if not ratings:
-                return
-
-            user_profile = np.zeros_like(self.tfidf_matrix.mean(axis=0).A1)
-            rated_movie_indices = []
-            recent_weights = []
+    def _rebuild_profile(self, user_id: int) -> Optional[UserProfile]:
+        """Recompute the stored profile from all of the user's ratings, applying the current time decay"""
+        ratings = self.db.query(Rating.movie_id, Rating.rating, Rating.timestamp).filter(Rating.user_id == user_id).all()
+        if not ratings:
+            return None
 
-            genre_prefs, director_prefs = self._get_user_preferences(user_id)
+        genre_prefs, director_prefs = self._get_user_preferences(user_id)
+        profile = self._profile_from_ratings(user_id, ratings, genre_prefs, director_prefs, datetime.utcnow())
+        if profile is None:
+            return None
 
-            current_time = datetime.utcnow()
-            for rating in ratings:
-                try:
-                    movie_idx = self.movies_df[self.movies_df["id"] == rating.movie_id].index[0]
-                    rated_movie_indices.append(movie_idx)
-
-                    days_old = (current_time - rating.timestamp).days
-                    time_weight = 1.0 / (1.0 + np.log10(days_old + 1)) 
-                    recent_weights.append(time_weight)
-
-                    movie = self.movies_df.iloc[movie_idx]
-
-                    raw_weight = rating.rating - 3.0
-                    
-                    genre_boost = 1.0
-                    director_boost = 1.0
-                    
-                    if raw_weight > 0:
-                        for genre in movie['details']['genres']:
-                            if genre in genre_prefs and genre_prefs[genre]['count'] >= 3:
-                                genre_boost += 0.2
-                        
-                        director = movie['details']['director']
-                        if director in director_prefs and director_prefs[director]['count'] >= 2:
-                            director_boost += 0.3
-
-                    final_weight = raw_weight * time_weight * genre_boost * director_boost
-                    user_profile += self.tfidf_matrix[movie_idx].toarray()[0] * final_weight
-                except IndexError:
-                    continue
-
-            if not rated_movie_indices:
-                return
+        try:
+            profile = self.db.merge(profile)
+            self.db.commit()
+        except IntegrityError:
+            # A concurrent refresh inserted the profile first, it was built from the same ratings
+            self.db.rollback()
+            profile = self.db.get(UserProfile, user_id)
+        return profile
 
-            user_profile = user_profile / np.linalg.norm(user_profile)
+    def _profile_from_ratings(
+            self,
+            user_id: int,
+            ratings: List[Tuple[int, float, datetime]],
+            genre_prefs: Dict,
+            director_prefs: Dict,
+            current_time: datetime
+    ) -> Optional[UserProfile]:
+        """Unsaved profile from (movie_id, rating, timestamp) rows, None when none of the movies are in the model"""
+        rated_movie_indices = []
+        profile_weights = []
+        contributions = {}
+
+        for movie_id, rating, timestamp in ratings:
+            movie_idx = self.model.row_for(movie_id)
+            if movie_idx is None:
+                continue
+
+            weight = rating_weight(
+                rating,
+                (current_time - timestamp).days,
+                self.model.genres[movie_idx],
+                self.model.directors[movie_idx],
+                genre_prefs,
+                director_prefs
+            )
+            rated_movie_indices.append(movie_idx)
+            profile_weights.append(weight)
+            contributions[str(movie_id)] = contributions.get(str(movie_id), 0.0) + weight
+
+        if not rated_movie_indices:
+            return None
+
+        user_profile = self.model.build_profile(np.array(rated_movie_indices), np.array(profile_weights))
+        return UserProfile(
+            user_id=user_id,
+            model_version=self.model.vocabulary_version,
+            vector=vector_to_json(user_profile),
+            contributions=contributions,
+            genre_preferences=genre_prefs,
+            director_preferences=director_prefs,
+            rebuilt_at=current_time
+        )
 
-            similarities = cosine_similarity(
-                user_profile.reshape(1, -1),
-                self.tfidf_matrix.toarray()
-            )[0]
+    def _get_profile(self, user_id: int) -> Optional[UserProfile]:
+        profile = self.db.get(UserProfile, user_id)
+        if self._profile_is_stale(profile):
+            return self._rebuild_profile(user_id)
+        return profile
+
+    def _profile_is_stale(self, profile: Optional[UserProfile]) -> bool:
+        return (
+            profile is None
+            or profile.model_version != self.model.vocabulary_version
+            or datetime.utcnow() - profile.rebuilt_at > self.update_threshold
+        )
 
-            mask = np.ones(len(self.tfidf_matrix.toarray()), dtype=bool)
-            mask[rated_movie_indices] = False
+    def _apply_ratings_to_profile(self, user_id: int, changes: List[Tuple[int, float, Optional[float]]]):
+        """Add or replace single movies in the stored profile instead of rebuilding it from every rating"""
+        if self.model is None or not changes:
+            return
+
+        profile = self.db.get(UserProfile, user_id)
+        if profile is None or profile.model_version != self.model.vocabulary_version:
+            # Built from scratch on the next refresh
+            return
+
+        vector = vector_from_json(profile.vector, self.tfidf_matrix.shape[1])
+        contributions = dict(profile.contributions)
+        genre_prefs = {genre: dict(stats) for genre, stats in profile.genre_preferences.items()}
+        director_prefs = {director: dict(stats) for director, stats in profile.director_preferences.items()}
+
+        for movie_id, rating, previous_rating in changes:
+            movie_idx = self.model.row_for(movie_id)
+            if movie_idx is None:
+                continue
+            genres = self.model.genres[movie_idx]
+            director = self.model.directors[movie_idx]
+
+            previous_weight = contributions.pop(str(movie_id), None)
+            if previous_weight is not None:
+                vector = vector - previous_weight * self.tfidf_matrix[movie_idx]
+                if previous_rating is not None:
+                    for genre in genres:
+                        remove_preference(genre_prefs, genre, previous_rating)
+                    remove_preference(director_prefs, director, previous_rating)
+
+            for genre in genres:
+                add_preference(genre_prefs, genre, rating)
+            add_preference(director_prefs, director, rating)
+
+            weight = rating_weight(rating, 0, genres, director, genre_prefs, director_prefs)
+            vector = vector + weight * self.tfidf_matrix[movie_idx]
+            contributions[str(movie_id)] = weight
+
+        profile.vector = vector_to_json(vector)
+        profile.contributions = contributions
+        profile.genre_preferences = genre_prefs
+        profile.director_preferences = director_prefs
+
+    def _score_user(self, user_id: int, limit: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Normalized similarity of the unrated candidate movies to the user's profile, with the matching model rows
+
+        The exact backend scores every movie, approximate ones return at least the best limit candidates.
+        """
+        if self.model is None:
+            return None
+
+        profile = self._get_profile(user_id)
+        if profile is None:
+            return None
+
+        rated_movie_ids = np.array([int(movie_id) for movie_id in profile.contributions], dtype=np.int64)
+        rated_movie_indices = self.model.rows_for(rated_movie_ids)
+        if len(rated_movie_indices) == 0:
+            return None
+
+        profile_vector = vector_from_json(profile.vector, self.tfidf_matrix.shape[1])
+        weights = np.array(list(profile.contributions.values()))
+
+        retriever = get_retriever(self.model, self.approximate_threshold)
+        similarities, available_indices = retriever.search(
+            profile_vector, rated_movie_ids, weights, rated_movie_indices, limit
+        )
+        if len(similarities) == 0 and retriever.name != ExactRetriever.name:
+            # Nothing liked strongly enough to seed the approximate backend
+            similarities, available_indices = ExactRetriever(self.model).search(
+                profile_vector, rated_movie_ids, weights, rated_movie_indices, limit
+            )
 
-            similarities = similarities[mask]
-            available_indices = np.where(mask)[0]
+        similarities = self.scaler.fit_transform(similarities.reshape(-1, 1)).ravel()
 
-            similarities = self.scaler.fit_transform(similarities.reshape(-1, 1)).ravel()
+        return similarities, available_indices
 
-            ranked_indices = np.argsort(similarities)[::-1]
+    def _hydrate(self, scored_movies: List[Tuple[int, float]]) -> List[Dict]:
+        """Attach the current movie details from the shared model to (movie_id, score) pairs"""
+        if self.model is None:
+            return []
 
-            self.db.query(CachedRecommendation).filter(
-                CachedRecommendation.user_id == user_id
-            ).delete()
-            self.db.commit()    
+        items = []
+        for movie_id, score in scored_movies:
+            details = self.model.details_for(movie_id)
+            if details is not None:
+                items.append({"id": movie_id, "similarity_score": score, **details})
+        return items
 
-            batch_size = 100
-            recommendations = []
+    def _score_page(self, user_id: int, offset: int, limit: int) -> Tuple[List[Dict], int]:
+        scored = self._score_user(user_id, offset + limit)
+        if scored is None:
+            return [], 0
 
-            for i, rank_idx in enumerate(ranked_indices):
-                movie_idx = available_indices[rank_idx]
-                movie = self.movies_df.iloc[movie_idx]
+        similarities, available_indices = scored
+        ranked_indices = top_k_indices(similarities, offset + limit)[offset:offset + limit]
 
-                cached_rec = CachedRecommendation(
-                    user_id=user_id,
-                    movie_id=int(movie["id"]),
-                    similarity_score=float(similarities[rank_idx]),
-                    details={
-                        "title": movie["title"],
-                        "genres": movie["details"]["genres"],
-                        "cast": movie["details"]["cast"],
-                        "director": movie["details"]["director"],
-                        "poster_path": movie["details"]["poster_path"],
-                        "backdrop_path": movie["details"]["backdrop_path"],
-                        "overview": movie["details"]["overview"],
-                        "vote_average": movie["details"]["vote_average"],
-                        "popularity": movie["details"]["popularity"]
-                    }
-                )
-                recommendations.append(cached_rec)
+        return self._hydrate(list(zip(
+            self.model.movie_ids[available_indices[ranked_indices]].tolist(),
+            similarities[ranked_indices].tolist()
+        ))), len(similarities)
 
-                if len(recommendations) >= batch_size:
-                    self.db.bulk_save_objects(recommendations)
-                    recommendations = []
+    def update_recommendations(self, user_id: int):
+        try:
+            scored = self._score_user(user_id, self.cache_size)
+            if scored is None:
+                return
 
-            if recommendations:
-                self.db.bulk_save_objects(recommendations)
+            similarities, available_indices = scored
+            ranked_indices = top_k_indices(similarities, self.cache_size)
 
-            self.db.commit()
+            self.store_recommendations([(
+                user_id,
+                self.model.movie_ids[available_indices[ranked_indices]].tolist(),
+                similarities[ranked_indices].tolist(),
+                len(similarities)
+            )])
 
         except Exception as e:
             logger.error(f"Error updating recommendations: {str(e)}")
             self.db.rollback()
             raise
 
-    def get_popular_movies(self, limit: int = 10) -> List[Dict[str, Any]]:
+    def store_recommendations(self, results: List[Tuple[int, List[int], List[float], int]]):
+        """Publish new cached top movies for many users from (user_id, movie_ids, scores, total) tuples
+
+        Rows are written under the next generation and the users' state rows are flipped to it in the
+        same transaction, so readers keep paging the previous generation until the commit and never see
+        a partial list. Superseded generations are removed later by collect_stale_generations.
+        """
+        if not results:
+            return
+
+        user_ids = [user_id for user_id, _, _, _ in results]
+        current = dict(
+            self.db.query(RecommendationState.user_id, RecommendationState.generation)
+            .filter(RecommendationState.user_id.in_(user_ids))
+            .all()
+        )
+        generations = {user_id: (current.get(user_id) or 0) + 1 for user_id in user_ids}
+
+        now = datetime.utcnow()
+        rows = [
+            {"user_id": user_id, "generation": generations[user_id], "movie_id": movie_id,
+             "similarity_score": score, "rank": rank, "created_at": now}
+            for user_id, movie_ids, scores, _ in results
+            for rank, (movie_id, score) in enumerate(zip(movie_ids, scores), start=1)
+        ]
+
         try:
-            popular_movies = (
-                self.db.query(Movie)
-                .order_by(Movie.popularity.desc())
-                .limit(limit)
-                .all()
+            if rows:
+                # executemany, one round trip per driver batch instead of one per row
+                self.db.execute(insert(CachedRecommendation), rows)
+
+            upsert(
+                self.db,
+                RecommendationState,
+                [{"user_id": user_id, "total": total, "generation": generations[user_id], "refreshed_at": now}
+                 for user_id, _, _, total in results],
+                conflict_columns=["user_id"],
+                update_columns=["total", "generation", "refreshed_at"]
             )
+            self.db.commit()
+        except IntegrityError:
+            # Another refresh published the same generation first
+            self.db.rollback()
+            if len(results) == 1:
+                logger.info(f"Skipped refresh for user {user_ids[0]}, a concurrent refresh already published it")
+                return
+            for result in results:
+                self.store_recommendations([result])
+
+    def get_similar_movies(self, movie_id: int, limit: int = 10) -> Optional[List[Dict]]:
+        if self.model is None:
+            return None
+
+        movie_idx = self.model.row_for(movie_id)
+        if movie_idx is None:
+            return None
+
+        rows, scores = self.model.similar_to(movie_idx, limit)
+        return self._hydrate(list(zip(self.model.movie_ids[rows].tolist(), np.asarray(scores).tolist())))
+
+    def schedule_refresh(self, user_id: int) -> str:
+        """Hand the refresh to the background worker if there is one, otherwise run it inline"""
+        self.last_update_time[user_id] = datetime.utcnow()
+        if self.refresh_worker is not None:
+            self.refresh_worker.enqueue(user_id)
+            return "pending"
+
+        self.update_recommendations(user_id)
+        return "completed"
+
+    def get_popular_movies(self, limit: int = 10) -> List[Dict[str, Any]]:
+        try:
+            popular_movies = self.db.execute(self._popular_movies_query(limit)).scalars().all()
+            return [self._popular_movie(movie) for movie in popular_movies]
+        except Exception as e:
+            logger.error(f"Error getting popular movies: {str(e)}")
+            raise
 
-            return [{
-                "id": movie.id,
-                "title": movie.title,
-                "overview": movie.overview,
-                "genres": movie.genres,
-                "poster_path": movie.poster_path,
-                "vote_average": movie.vote_average,
-                "popularity": movie.popularity
-            } for movie in popular_movies]
+    @classmethod
+    async def get_popular_movies_async(cls, async_db: AsyncSession, limit: int = 10) -> List[Dict[str, Any]]:
+        """Popular movies straight from the database, needs no model so it does not build a recommender"""
+        try:
+            popular_movies = (await async_db.execute(cls._popular_movies_query(limit))).scalars().all()
+            return [cls._popular_movie(movie) for movie in popular_movies]
         except Exception as e:
             logger.error(f"Error getting popular movies: {str(e)}")
             raise
 
+    @staticmethod
+    def _popular_movies_query(limit: int):
+        return select(Movie).order_by(Movie.popularity.desc()).limit(limit)
+
+    @staticmethod
+    def _popular_movie(movie: Movie) -> Dict[str, Any]:
+        return {
+            "id": movie.id,
+            "title": movie.title,
+            "overview": movie.overview,
+            "genres": movie.genres,
+            "poster_path": movie.poster_path,
+            "vote_average": movie.vote_average,
+            "popularity": movie.popularity
+        }
+
     def process_batch_ratings(self, user_id: int, ratings: List[RatingCreate]) -> Dict[str, Any]:
         try:
-            new_ratings = []
-            updated_count = 0
-
-            for rating_data in ratings:
-                existing_rating = (
-                    self.db.query(Rating)
-                    .filter(Rating.user_id == user_id, Rating.movie_id == rating_data.movie_id)
-                    .first()
-                )
-
-                if existing_rating:
-                    existing_rating.rating = rating_data.rating
-                    existing_rating.timestamp = datetime.utcnow()
-                    updated_count += 1
-                else:
-                    new_ratings.append(Rating(
-                        user_id=user_id,
-                        movie_id=rating_data.movie_id,
-                        rating=rating_data.rating,
-                        timestamp=datetime.utcnow()
-                    ))
-
-            if new_ratings:
-                self.db.bulk_save_objects(new_ratings)
+            # Later entries for the same movie win, one statement cannot update a row twice
+            submitted = {rating_data.movie_id: rating_data.rating for rating_data in ratings}
+
+            previous_ratings = dict(
+                self.db.query(Rating.movie_id, Rating.rating)
+                .filter(Rating.user_id == user_id, Rating.movie_id.in_(submitted))
+                .all()
+            )
+
+            current_time = datetime.utcnow()
+            upsert(
+                self.db,
+                Rating,
+                [{"user_id": user_id, "movie_id": movie_id, "rating": rating, "timestamp": current_time}
+                 for movie_id, rating in submitted.items()],
+                conflict_columns=["user_id", "movie_id"],
+                update_columns=["rating", "timestamp"]
+            )
 
+            self._apply_ratings_to_profile(user_id, [
+                (movie_id, rating, previous_ratings.get(movie_id)) for movie_id, rating in submitted.items()
+            ])
             self.db.commit()
 
-            self.update_recommendations(user_id)
-            self.last_update_time[user_id] = datetime.utcnow()
+            new_count = len(submitted) - len(previous_ratings)
+            updated_count = len(previous_ratings)
+
+            refresh_status = self.schedule_refresh(user_id)
 
             return {
                 "status": "success",
-                "message": f"Successfully processed {len(new_ratings)} new ratings and updated {updated_count} existing ratings"
+                "message": f"Successfully processed {new_count} new ratings and updated {updated_count} existing ratings",
+                "refresh_status": refresh_status
             }
         except Exception as e:
             logger.error(f"Error processing batch ratings: {str(e)}")
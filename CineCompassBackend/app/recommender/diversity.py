@@ -0,0 +1,62 @@
+from typing import Callable
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+def genre_jaccard(genre_matrix: np.ndarray) -> Callable[[int], np.ndarray]:
+    """Jaccard overlap of every row's genres with one row, computed against the whole pool at once"""
+    genres = genre_matrix.astype(np.float32)
+    counts = genres.sum(axis=1)
+
+    def similarity_to(idx: int) -> np.ndarray:
+        intersection = genres @ genres[idx]
+        union = counts + counts[idx] - intersection
+        return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+    return similarity_to
+
+
+def tfidf_cosine(rows: csr_matrix, row_norms: np.ndarray) -> Callable[[int], np.ndarray]:
+    """Cosine similarity between the pool's TF-IDF rows, from one small sparse Gram matrix"""
+    gram = (rows @ rows.T).toarray()
+    norms = np.outer(row_norms, row_norms)
+    gram = np.divide(gram, norms, out=np.zeros_like(gram), where=norms > 0)
+
+    def similarity_to(idx: int) -> np.ndarray:
+        return gram[idx]
+
+    return similarity_to
+
+
+def mmr_rerank(
+        relevance: np.ndarray,
+        similarity_to: Callable[[int], np.ndarray],
+        k: int,
+        lambda_param: float = 0.7
+) -> np.ndarray:
+    """Maximal marginal relevance order of the first k picks, the first item is always kept in place
+
+    Keeps a running max-similarity-to-selected vector, so each pick costs one similarity row
+    instead of comparing every candidate against every already selected item.
+    """
+    n = len(relevance)
+    if n == 0:
+        return np.array([], dtype=np.int64)
+
+    relevance = np.asarray(relevance, dtype=np.float64)
+    selected = [0]
+    available = np.ones(n, dtype=bool)
+    available[0] = False
+    max_similarity = similarity_to(0).astype(np.float64)
+
+    while len(selected) < min(k, n):
+        mmr_scores = lambda_param * relevance - (1 - lambda_param) * max_similarity
+        mmr_scores[~available] = -np.inf
+        best = int(np.argmax(mmr_scores))
+
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, similarity_to(best), out=max_similarity)
+
+    return np.array(selected, dtype=np.int64)
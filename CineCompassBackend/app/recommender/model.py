@@ -0,0 +1,515 @@
+import os
+import json
+import hashlib
+import threading
+import time
+import logging
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Any, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix, vstack
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.models.movie import Movie
+from app.recommender.neighbors import build_neighbors, default_neighbor_count, patch_neighbors
+
+logger = logging.getLogger(__name__)
+
+
+def preprocess_features(movie: Movie) -> str:
+    features = []
+
+    if movie.genres:
+        features.extend([f"genre_{g.lower()}" * 3 for g in movie.genres])
+
+    if movie.director:
+        features.append(f"director_{movie.director.lower()}" * 2)
+
+    if movie.cast:
+        for i, actor in enumerate(movie.cast[:3]):
+            features.append(f"actor_{actor.lower()}")
+
+    if movie.overview:
+        cleaned_overview = movie.overview.lower()
+        for phrase in ["the movie", "the film", "the story"]:
+            cleaned_overview = cleaned_overview.replace(phrase, "")
+        features.append(cleaned_overview)
+
+    return " ".join(features)
+
+
+def create_vectorizer(vocabulary: Optional[Dict[str, int]] = None) -> TfidfVectorizer:
+    max_features = 1000 if os.getenv("IS_PRODUCTION") == "true" else 2000
+    return TfidfVectorizer(
+        stop_words="english",
+        max_features=max_features,
+        min_df=3,
+        max_df=0.95,
+        ngram_range=(1, 2),
+        vocabulary=vocabulary
+    )
+
+
+def catalog_version_query():
+    return select(func.count(Movie.id), func.max(Movie.last_updated))
+
+
+def features_version_query():
+    # Rows written before features_updated existed fall back to when they were fetched
+    return select(func.count(Movie.id), func.max(func.coalesce(Movie.features_updated, Movie.last_updated)))
+
+
+def format_catalog_version(count: int, last_updated: Optional[datetime]) -> str:
+    return f"{count}:{last_updated.isoformat() if last_updated else ''}"
+
+
+def get_catalog_version(db: Session) -> str:
+    """Cheap fingerprint of what the model is built from, changes when movies are added or their text changes
+
+    Refreshes that only touch popularity or ratings leave it alone, so they do not trigger a rebuild.
+    """
+    count, features_updated = db.execute(features_version_query()).one()
+    return format_catalog_version(count, features_updated)
+
+
+def get_catalog_versions(db: Session) -> Tuple[str, str]:
+    """The model's catalog version and the version of the movie details it serves, read in one query"""
+    count, features_updated, last_updated = db.execute(
+        select(func.count(Movie.id), func.max(func.coalesce(Movie.features_updated, Movie.last_updated)),
+               func.max(Movie.last_updated))
+    ).one()
+    return format_catalog_version(count, features_updated), format_catalog_version(count, last_updated)
+
+
+def vocabulary_version(vectorizer: Optional[TfidfVectorizer]) -> Optional[str]:
+    """Fingerprint of the vocabulary and IDF, profile vectors built against one stay valid while it holds"""
+    if vectorizer is None or not hasattr(vectorizer, "idf_"):
+        return None
+    vocabulary = getattr(vectorizer, "vocabulary_", None) or vectorizer.vocabulary
+    digest = hashlib.sha1(np.ascontiguousarray(vectorizer.idf_, dtype=np.float64).tobytes())
+    digest.update(json.dumps(sorted((term, int(col)) for term, col in vocabulary.items())).encode())
+    return digest.hexdigest()
+
+
+class TfidfState(NamedTuple):
+    """What an incremental update needs from a previous model, without its movie details"""
+    vectorizer: TfidfVectorizer
+    tfidf_matrix: csr_matrix
+    movie_ids: np.ndarray
+    row_norms: np.ndarray
+    # Newest features_updated among the movies in the matrix, rows changed after it are transformed again
+    features_updated: Optional[datetime]
+    # Rows transformed against a vocabulary and IDF fitted without them
+    unseen_rows: int
+    neighbor_rows: Optional[np.ndarray] = None
+    neighbor_scores: Optional[np.ndarray] = None
+    ivf_index: Any = None
+
+
+class MovieModel:
+    """Immutable TF-IDF snapshot of the catalog, shared read-only by all requests"""
+
+    def __init__(
+            self,
+            version: str,
+            vectorizer: TfidfVectorizer,
+            tfidf_matrix: csr_matrix,
+            movies_df: pd.DataFrame,
+            row_norms: Optional[np.ndarray] = None,
+            unseen_rows: int = 0,
+            details_version: Optional[str] = None
+    ):
+        self.version = version
+        # Catalog version of the movie details, which can move on without the TF-IDF rows
+        self.details_version = details_version
+        # Same across incremental updates, which keep existing rows and only add or replace changed movies
+        self.vocabulary_version = vocabulary_version(vectorizer) or version
+        self.vectorizer = vectorizer
+        self.tfidf_matrix = tfidf_matrix
+        self.unseen_rows = unseen_rows
+        self.movie_ids = movies_df["id"].to_numpy(dtype=np.int64)
+        features_updated = movies_df["features_updated"].max() if "features_updated" in movies_df else None
+        self.features_updated: Optional[datetime] = (
+            None if pd.isna(features_updated) else pd.Timestamp(features_updated).to_pydatetime()
+        )
+
+        # Dense id -> row array, -1 for ids that are not in the catalog
+        self.row_lookup = np.full(int(self.movie_ids.max()) + 1 if len(self.movie_ids) else 0, -1, dtype=np.int32)
+        self.row_lookup[self.movie_ids] = np.arange(len(self.movie_ids), dtype=np.int32)
+
+        details = movies_df["details"].tolist()
+        self.titles = movies_df["title"].to_numpy(dtype=object)
+        self.genres = np.empty(len(details), dtype=object)
+        self.genres[:] = [d["genres"] or [] for d in details]
+
+        # One boolean column per genre, used for vectorized genre overlap
+        self.genre_names = sorted({genre for genres in self.genres for genre in genres})
+        genre_columns = {genre: col for col, genre in enumerate(self.genre_names)}
+        self.genre_matrix = np.zeros((len(details), len(self.genre_names)), dtype=bool)
+        for row, genres in enumerate(self.genres):
+            self.genre_matrix[row, [genre_columns[genre] for genre in genres]] = True
+        self.directors = np.array([d["director"] for d in details], dtype=object)
+        self.vote_average = np.array([d["vote_average"] or 0.0 for d in details], dtype=np.float64)
+        self.popularity = np.array([d["popularity"] or 0.0 for d in details], dtype=np.float64)
+        self.movie_details: List[Dict[str, Any]] = [
+            {"title": title, **movie_details} for title, movie_details in zip(self.titles, details)
+        ]
+
+        if row_norms is None:
+            row_norms = np.sqrt(np.asarray(tfidf_matrix.multiply(tfidf_matrix).sum(axis=1)).ravel())
+        self.row_norms = row_norms
+        # Precomputed top-N item neighbours, attached by the artifact build/load when available
+        self.neighbor_rows: Optional[np.ndarray] = None
+        self.neighbor_scores: Optional[np.ndarray] = None
+        # Dense ANN index for the ivf retrieval backend, loaded from the artifact or built in the background
+        self.ivf_index = None
+        self.built_at = time.time()
+
+        for array in (tfidf_matrix.data, tfidf_matrix.indices, tfidf_matrix.indptr, self.movie_ids, self.row_norms,
+                      self.row_lookup, self.genre_matrix, self.vote_average, self.popularity):
+            if array.flags.writeable:
+                array.flags.writeable = False
+
+    @property
+    def size(self) -> int:
+        return self.tfidf_matrix.shape[0]
+
+    def with_details(self, movies_df: pd.DataFrame, details_version: str) -> Optional["MovieModel"]:
+        """Same TF-IDF rows and indexes with fresh movie details, None when the catalog's movies differ"""
+        if not np.array_equal(movies_df["id"].to_numpy(dtype=np.int64), self.movie_ids):
+            return None
+
+        model = MovieModel(self.version, self.vectorizer, self.tfidf_matrix, movies_df, row_norms=self.row_norms,
+                           unseen_rows=self.unseen_rows, details_version=details_version)
+        model.neighbor_rows, model.neighbor_scores = self.neighbor_rows, self.neighbor_scores
+        model.ivf_index = self.ivf_index
+        return model
+
+    @property
+    def tfidf_state(self) -> TfidfState:
+        return TfidfState(self.vectorizer, self.tfidf_matrix, self.movie_ids, self.row_norms, self.features_updated,
+                          self.unseen_rows, self.neighbor_rows, self.neighbor_scores, self.ivf_index)
+
+    def row_for(self, movie_id: int) -> Optional[int]:
+        if 0 <= movie_id < len(self.row_lookup) and self.row_lookup[movie_id] >= 0:
+            return int(self.row_lookup[movie_id])
+        return None
+
+    def rows_for(self, movie_ids) -> np.ndarray:
+        """Matrix rows for many movie ids at once, ids outside the catalog are dropped"""
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        movie_ids = movie_ids[(movie_ids >= 0) & (movie_ids < len(self.row_lookup))]
+        rows = self.row_lookup[movie_ids]
+        return rows[rows >= 0]
+
+    def details_for(self, movie_id: int) -> Optional[Dict[str, Any]]:
+        row = self.row_for(movie_id)
+        return self.movie_details[row] if row is not None else None
+
+    def build_profile(self, rows: np.ndarray, weights: np.ndarray) -> csr_matrix:
+        """Weighted sum of the given movie rows as a 1 x features sparse vector"""
+        selector = csr_matrix(
+            (np.asarray(weights, dtype=np.float64), (np.zeros(len(rows), dtype=np.int32), np.asarray(rows))),
+            shape=(1, self.size)
+        )
+        return (selector @ self.tfidf_matrix).tocsr()
+
+    def score(self, profile: csr_matrix) -> np.ndarray:
+        """Cosine similarity of every movie to the profile, one sparse mat-vec against the row norms"""
+        profile_norm = np.sqrt(profile.multiply(profile).sum())
+        if profile_norm == 0:
+            return np.zeros(self.size)
+
+        dots = np.asarray((self.tfidf_matrix @ profile.T).todense()).ravel()
+        norms = self.row_norms * profile_norm
+        return np.divide(dots, norms, out=np.zeros_like(dots, dtype=np.float64), where=norms > 0)
+
+    def score_rows(self, profile: csr_matrix, rows: np.ndarray) -> np.ndarray:
+        """Cosine similarity of only the given movie rows to the profile"""
+        profile_norm = np.sqrt(profile.multiply(profile).sum())
+        if profile_norm == 0 or len(rows) == 0:
+            return np.zeros(len(rows))
+
+        dots = np.asarray((self.tfidf_matrix[rows] @ profile.T).todense()).ravel()
+        norms = np.asarray(self.row_norms)[rows] * profile_norm
+        return np.divide(dots, norms, out=np.zeros_like(dots, dtype=np.float64), where=norms > 0)
+
+    def similar_to(self, row: int, limit: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows and scores of the movies most similar to one movie, from the neighbour index when there is one"""
+        if self.neighbor_rows is not None and limit <= self.neighbor_rows.shape[1]:
+            return self.neighbor_rows[row, :limit], self.neighbor_scores[row, :limit]
+
+        scores = self.score(self.tfidf_matrix[row])
+        scores[row] = -np.inf
+        top = top_k_indices(scores, min(limit, self.size - 1))
+        return top, scores[top]
+
+    def approximate_scores(
+            self,
+            movie_ids: np.ndarray,
+            weights: np.ndarray,
+            exclude_rows: np.ndarray,
+            seeds: int = 20
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Scores and rows of candidate movies, merged from the neighbour lists of the strongest liked movies"""
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        weights = np.asarray(weights, dtype=np.float64)
+        known = (movie_ids >= 0) & (movie_ids < len(self.row_lookup))
+        rows, weights = self.row_lookup[movie_ids[known]], weights[known]
+
+        liked = (rows >= 0) & (weights > 0)
+        rows, weights = rows[liked], weights[liked]
+        strongest = np.argsort(weights)[::-1][:seeds]
+        rows, weights = rows[strongest], weights[strongest]
+
+        candidates = self.neighbor_rows[rows].ravel()
+        contributions = (self.neighbor_scores[rows] * weights[:, None]).ravel()
+        candidate_rows, inverse = np.unique(candidates, return_inverse=True)
+        scores = np.bincount(inverse, weights=contributions, minlength=len(candidate_rows))
+
+        keep = ~np.isin(candidate_rows, exclude_rows)
+        return scores[keep], candidate_rows[keep]
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores in descending order, without sorting the whole array"""
+    if k >= len(scores):
+        return np.argsort(scores)[::-1]
+    top = np.argpartition(scores, -k)[-k:]
+    return top[np.argsort(scores[top])[::-1]]
+
+
+def load_movies_df(db: Session) -> pd.DataFrame:
+    movies = db.query(Movie).order_by(Movie.id).all()
+    return pd.DataFrame([{
+        'id': movie.id,
+        'title': movie.title,
+        'combined_features': preprocess_features(movie),
+        'features_updated': movie.features_updated or movie.last_updated,
+        'details': {
+            'genres': movie.genres,
+            'cast': movie.cast,
+            'director': movie.director,
+            'poster_path': movie.poster_path,
+            'backdrop_path': movie.backdrop_path,
+            'overview': movie.overview,
+            'vote_average': movie.vote_average,
+            'popularity': movie.popularity
+        }
+    } for movie in movies])
+
+
+def build_model(
+        db: Session,
+        version: Optional[str] = None,
+        movies_df: Optional[pd.DataFrame] = None
+) -> Optional[MovieModel]:
+    version = version or get_catalog_version(db)
+    movies_df = load_movies_df(db) if movies_df is None else movies_df
+    if movies_df.empty:
+        return None
+
+    vectorizer = create_vectorizer()
+    tfidf_matrix = vectorizer.fit_transform(movies_df['combined_features']).tocsr()
+
+    logger.info(f"Built TF-IDF model {version} with {tfidf_matrix.shape[0]} movies and {tfidf_matrix.shape[1]} features")
+    return MovieModel(version, vectorizer, tfidf_matrix, movies_df)
+
+
+def update_model(
+        previous: TfidfState,
+        movies_df: pd.DataFrame,
+        version: str,
+        refit_threshold: float = 0.2
+) -> Optional[MovieModel]:
+    """Bring a previous model up to date by transforming only the new and changed movies
+
+    Their rows are computed with the previous vocabulary and IDF and spliced between the previous rows,
+    so the cost grows with the number of changed movies rather than the catalog. Terms the vocabulary
+    does not know are dropped, so returns None once more than refit_threshold of the catalog was never
+    seen by the fit and a full build is due.
+    """
+    if movies_df.empty or previous.features_updated is None or not hasattr(previous.vectorizer, "idf_"):
+        return None
+
+    movie_ids = movies_df["id"].to_numpy(dtype=np.int64)
+    previous_rows = np.full(len(movie_ids), -1, dtype=np.int64)
+    known = np.isin(movie_ids, previous.movie_ids)
+    previous_rows[known] = np.searchsorted(previous.movie_ids, movie_ids[known])
+
+    changed = ~known | (pd.to_datetime(movies_df["features_updated"]) > previous.features_updated).to_numpy()
+    unseen_rows = previous.unseen_rows + int(changed.sum())
+    if unseen_rows > refit_threshold * len(movie_ids):
+        logger.info(f"{unseen_rows} of {len(movie_ids)} movies are not in the fitted vocabulary, refitting")
+        return None
+
+    changed_rows = np.flatnonzero(changed)
+    new_matrix = previous.vectorizer.transform(movies_df["combined_features"].iloc[changed_rows]).tocsr()
+    new_norms = np.sqrt(np.asarray(new_matrix.multiply(new_matrix).sum(axis=1)).ravel())
+
+    # Kept previous rows followed by the new ones, then reordered to the catalog's id order
+    kept_rows = np.flatnonzero(~changed)
+    combined = vstack([previous.tfidf_matrix[previous_rows[kept_rows]], new_matrix], format="csr")
+    order = np.empty(len(movie_ids), dtype=np.int64)
+    order[kept_rows] = np.arange(len(kept_rows))
+    order[changed_rows] = len(kept_rows) + np.arange(len(changed_rows))
+    tfidf_matrix = combined[order]
+    row_norms = np.concatenate([np.asarray(previous.row_norms)[previous_rows[kept_rows]], new_norms])[order]
+
+    logger.info(f"Updated TF-IDF model to {version}: {len(changed_rows)} movies transformed, "
+                f"{len(previous.movie_ids) - len(kept_rows)} replaced or removed")
+    model = MovieModel(version, previous.vectorizer, tfidf_matrix, movies_df, row_norms=row_norms,
+                       unseen_rows=unseen_rows)
+    if previous.neighbor_rows is not None:
+        model.neighbor_rows, model.neighbor_scores = patch_neighbors(
+            previous.neighbor_rows, previous.neighbor_scores, previous_rows[kept_rows], kept_rows, changed_rows,
+            tfidf_matrix, row_norms
+        )
+    if previous.ivf_index is not None:
+        model.ivf_index = previous.ivf_index.patch(previous_rows[kept_rows], kept_rows, changed_rows, tfidf_matrix)
+    return model
+
+
+class ModelRegistry:
+    """Holds the current MovieModel for the process and swaps it atomically when the catalog changes"""
+
+    def __init__(self, check_interval: float = 30.0, refit_threshold: float = 0.2):
+        self.check_interval = check_interval
+        self.refit_threshold = refit_threshold
+        self._model: Optional[MovieModel] = None
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+        self._refitting = False
+
+    def get(self, db: Session) -> Optional[MovieModel]:
+        model = self._model
+        if model is not None and time.monotonic() - self._last_check < self.check_interval:
+            return model
+
+        version, details_version = get_catalog_versions(db)
+        if model is not None and model.version == version and model.details_version == details_version:
+            self._last_check = time.monotonic()
+            return model
+
+        # Keep serving the previous snapshot while another request rebuilds
+        if not self._lock.acquire(blocking=model is None):
+            return model
+        try:
+            current = self._model
+            if current is None or current.version != version:
+                # A background refit swaps its model in when done, and the next check catches up from there
+                if not self._refitting:
+                    self._model = self._load_or_build(db, version, details_version)
+            elif current.details_version != details_version:
+                # Only popularity, ratings or artwork changed, keep the TF-IDF rows and reload the details
+                self._model = (current.with_details(load_movies_df(db), details_version)
+                               or self._load_or_build(db, version, details_version))
+            self._last_check = time.monotonic()
+            return self._model
+        finally:
+            self._lock.release()
+
+    def _load_or_build(self, db: Session, version: str, details_version: Optional[str] = None) -> Optional[MovieModel]:
+        from app.recommender import artifact
+
+        # The details are read after the versions, so they are at least as new as details_version
+        model = artifact.load_model(db, version)
+        if model is not None:
+            model.details_version = details_version
+            return model
+
+        # Start from the model being served, or the last published artifact after a restart
+        previous = self._model.tfidf_state if self._model is not None else artifact.load_tfidf_state()
+        movies_df = load_movies_df(db)
+        if previous is not None:
+            model = update_model(previous, movies_df, version, self.refit_threshold)
+        if model is not None:
+            model.details_version = details_version
+            artifact.save_model(model)
+            return model
+
+        # Indexes the previous artifact shipped are rebuilt before the new one is published
+        with_neighbors = previous is not None and previous.neighbor_rows is not None
+        with_ivf = previous is not None and previous.ivf_index is not None
+        if self._model is not None:
+            # Refitting and rebuilding the indexes takes a while, keep serving the current model meanwhile
+            self._refitting = True
+            threading.Thread(target=self._refit, args=(version, details_version, movies_df, with_neighbors, with_ivf),
+                             name="model-refit", daemon=True).start()
+            return self._model
+
+        model = build_model(db, version, movies_df)
+        if model is None:
+            return None
+        model.details_version = details_version
+        if with_neighbors or with_ivf:
+            # Nothing else to serve after a restart, so serve the model and attach its indexes once they are built.
+            # Updates wait for them too, an update of this model would be published without them
+            self._refitting = True
+            threading.Thread(target=self._index_and_publish, args=(model, with_neighbors, with_ivf),
+                             name="model-index", daemon=True).start()
+        else:
+            artifact.save_model(model)
+        return model
+
+    def _refit(
+            self,
+            version: str,
+            details_version: Optional[str],
+            movies_df: pd.DataFrame,
+            with_neighbors: bool,
+            with_ivf: bool
+    ):
+        from app.recommender import artifact
+
+        try:
+            model = build_model(None, version, movies_df)
+            if model is not None:
+                model.details_version = details_version
+                self._build_indexes(model, with_neighbors, with_ivf)
+                artifact.save_model(model)
+                self._model = model
+        except Exception as e:
+            logger.error(f"Could not refit the model for catalog {version}: {str(e)}")
+        finally:
+            self._refitting = False
+            self._last_check = 0.0
+
+    def _index_and_publish(self, model: MovieModel, with_neighbors: bool, with_ivf: bool):
+        from app.recommender import artifact
+
+        try:
+            self._build_indexes(model, with_neighbors, with_ivf)
+            artifact.save_model(model)
+        except Exception as e:
+            logger.error(f"Could not build the indexes for catalog {model.version}: {str(e)}")
+        finally:
+            self._refitting = False
+            self._last_check = 0.0
+
+    @staticmethod
+    def _build_indexes(model: MovieModel, with_neighbors: bool, with_ivf: bool):
+        from app.recommender.retrieval import IVFIndex
+
+        if with_neighbors:
+            neighbor_rows, neighbor_scores = build_neighbors(
+                model.tfidf_matrix, model.row_norms, top_n=default_neighbor_count()
+            )
+            # Scores first, similar_to reads them once it sees the rows
+            model.neighbor_scores = neighbor_scores
+            model.neighbor_rows = neighbor_rows
+        if with_ivf:
+            model.ivf_index = IVFIndex.build(model.tfidf_matrix)
+
+    def invalidate(self):
+        self._last_check = 0.0
+
+
+model_registry = ModelRegistry(
+    check_interval=float(os.getenv("MODEL_CHECK_INTERVAL", "30")),
+    refit_threshold=float(os.getenv("MODEL_REFIT_THRESHOLD", "0.2"))
+)
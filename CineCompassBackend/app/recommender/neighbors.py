@@ -0,0 +1,136 @@
+import os
+import logging
+from typing import Tuple
+
+import numpy as np
+from joblib import Parallel, delayed
+from scipy.sparse import csr_matrix
+
+logger = logging.getLogger(__name__)
+
+
+def _similarities(tfidf_matrix: csr_matrix, row_norms: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """Dense cosine similarities of the given rows to every movie, a movie is not its own neighbour"""
+    similarities = (tfidf_matrix[rows] @ tfidf_matrix.T).toarray()
+    norms = np.outer(row_norms[rows], row_norms)
+    similarities = np.divide(similarities, norms, out=np.zeros_like(similarities), where=norms > 0)
+    similarities[np.arange(len(rows)), rows] = -np.inf
+    return similarities
+
+
+def _top(similarities: np.ndarray, top_n: int) -> Tuple[np.ndarray, np.ndarray]:
+    top = np.argpartition(similarities, -top_n, axis=1)[:, -top_n:]
+    top_scores = np.take_along_axis(similarities, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    return (
+        np.take_along_axis(top, order, axis=1).astype(np.int32),
+        np.take_along_axis(top_scores, order, axis=1).astype(np.float32)
+    )
+
+
+def _neighbors_block(
+        tfidf_matrix: csr_matrix,
+        row_norms: np.ndarray,
+        start: int,
+        stop: int,
+        top_n: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    return _top(_similarities(tfidf_matrix, row_norms, np.arange(start, stop)), top_n)
+
+
+def build_neighbors(
+        tfidf_matrix: csr_matrix,
+        row_norms: np.ndarray,
+        top_n: int = 50,
+        block_size: int = 1000,
+        n_jobs: int = -1
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-N cosine neighbours of every movie as (rows, scores) arrays of shape movies x N
+
+    Works through the catalog in blocks of rows so only block_size x movies similarities are
+    ever dense at once, and spreads the blocks across cores.
+    """
+    n_movies = tfidf_matrix.shape[0]
+    top_n = min(top_n, n_movies - 1)
+    if top_n <= 0:
+        return np.zeros((n_movies, 0), dtype=np.int32), np.zeros((n_movies, 0), dtype=np.float32)
+
+    row_norms = np.asarray(row_norms, dtype=np.float64)
+    blocks = Parallel(n_jobs=n_jobs)(
+        delayed(_neighbors_block)(tfidf_matrix, row_norms, start, min(start + block_size, n_movies), top_n)
+        for start in range(0, n_movies, block_size)
+    )
+
+    neighbor_rows = np.vstack([rows for rows, _ in blocks])
+    neighbor_scores = np.vstack([scores for _, scores in blocks])
+    logger.info(f"Built {top_n} neighbours for {n_movies} movies")
+    return neighbor_rows, neighbor_scores
+
+
+def default_neighbor_count() -> int:
+    return int(os.getenv("SIMILAR_MOVIES_COUNT", "50"))
+
+
+def patch_neighbors(
+        previous_rows: np.ndarray,
+        previous_scores: np.ndarray,
+        kept_previous: np.ndarray,
+        kept_rows: np.ndarray,
+        changed_rows: np.ndarray,
+        tfidf_matrix: csr_matrix,
+        row_norms: np.ndarray,
+        max_cells: int = 5_000_000
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Neighbour lists for a model whose kept_rows are unchanged copies of kept_previous in the previous one
+
+    Changed movies get full lists and are offered to every kept movie, kept movies that lost a
+    neighbour to a changed or removed one are computed again. The work grows with those two counts.
+    """
+    n_movies = tfidf_matrix.shape[0]
+    top_n = previous_rows.shape[1]
+    if top_n == 0 or top_n > n_movies - 1:
+        return build_neighbors(tfidf_matrix, row_norms, top_n=top_n)
+
+    row_norms = np.asarray(row_norms, dtype=np.float64)
+    old_to_new = np.full(len(previous_rows), -1, dtype=np.int64)
+    old_to_new[kept_previous] = kept_rows
+
+    neighbor_rows = np.empty((n_movies, top_n), dtype=np.int32)
+    neighbor_scores = np.empty((n_movies, top_n), dtype=np.float32)
+    carried = old_to_new[np.asarray(previous_rows)[kept_previous]]
+    # A list that lost a neighbour to a changed or removed movie may now miss a kept one it never held
+    lost = (carried < 0).any(axis=1)
+    intact = kept_rows[~lost]
+    neighbor_rows[intact] = carried[~lost]
+    neighbor_scores[intact] = np.asarray(previous_scores)[kept_previous[~lost]]
+    lowest = neighbor_scores[intact].min(axis=1)
+
+    block_size = max(1, max_cells // n_movies)
+    for start in range(0, len(changed_rows), block_size):
+        rows = changed_rows[start:start + block_size]
+        similarities = _similarities(tfidf_matrix, row_norms, rows)
+        neighbor_rows[rows], neighbor_scores[rows] = _top(similarities, top_n)
+
+        # Only intact movies one of these beats the weakest neighbour of need merging
+        offered = similarities[:, intact].T
+        improved = np.flatnonzero((offered > lowest[:, None]).any(axis=1))
+        if len(improved) == 0:
+            continue
+        targets = intact[improved]
+        offered_rows = np.broadcast_to(rows.astype(np.int32), (len(targets), len(rows)))
+        merged_rows = np.hstack([neighbor_rows[targets], offered_rows])
+        merged_scores = np.hstack([neighbor_scores[targets], offered[improved].astype(np.float32)])
+        top = np.argpartition(merged_scores, -top_n, axis=1)[:, -top_n:]
+        top_scores = np.take_along_axis(merged_scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        neighbor_rows[targets] = np.take_along_axis(np.take_along_axis(merged_rows, top, axis=1), order, axis=1)
+        neighbor_scores[targets] = np.take_along_axis(top_scores, order, axis=1)
+        lowest[improved] = neighbor_scores[targets].min(axis=1)
+
+    holes = kept_rows[lost]
+    for start in range(0, len(holes), block_size):
+        rows = holes[start:start + block_size]
+        neighbor_rows[rows], neighbor_scores[rows] = _top(_similarities(tfidf_matrix, row_norms, rows), top_n)
+
+    logger.info(f"Patched neighbours for {len(changed_rows)} changed and {len(holes)} affected movies")
+    return neighbor_rows, neighbor_scores
@@ -0,0 +1,65 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+def add_preference(preferences: Dict[str, Dict[str, float]], key: Optional[str], rating: float):
+    if key not in preferences:
+        preferences[key] = {'count': 0, 'avg_rating': 0}
+    preferences[key]['count'] += 1
+    preferences[key]['avg_rating'] = (
+            (preferences[key]['avg_rating'] * (preferences[key]['count'] - 1) + rating) / preferences[key]['count']
+    )
+
+
+def remove_preference(preferences: Dict[str, Dict[str, float]], key: Optional[str], rating: float):
+    if key not in preferences:
+        return
+    count = preferences[key]['count'] - 1
+    if count <= 0:
+        del preferences[key]
+        return
+    preferences[key] = {
+        'count': count,
+        'avg_rating': (preferences[key]['avg_rating'] * (count + 1) - rating) / count
+    }
+
+
+def rating_weight(
+        rating: float,
+        days_old: int,
+        genres: List[str],
+        director: Optional[str],
+        genre_prefs: Dict[str, Dict[str, float]],
+        director_prefs: Dict[str, Dict[str, float]]
+) -> float:
+    """How much a single rating pulls the user profile towards (or away from) the movie"""
+    time_weight = 1.0 / (1.0 + np.log10(days_old + 1))
+    raw_weight = rating - 3.0
+
+    genre_boost = 1.0
+    director_boost = 1.0
+
+    if raw_weight > 0:
+        for genre in genres:
+            if genre in genre_prefs and genre_prefs[genre]['count'] >= 3:
+                genre_boost += 0.2
+
+        if director in director_prefs and director_prefs[director]['count'] >= 2:
+            director_boost += 0.3
+
+    return raw_weight * time_weight * genre_boost * director_boost
+
+
+def vector_to_json(vector: csr_matrix) -> Dict[str, list]:
+    vector = vector.tocsr()
+    vector.sum_duplicates()
+    vector.eliminate_zeros()
+    return {"indices": vector.indices.tolist(), "values": vector.data.tolist()}
+
+
+def vector_from_json(data: Dict[str, list], n_features: int) -> csr_matrix:
+    indices = np.asarray(data["indices"], dtype=np.int32)
+    values = np.asarray(data["values"], dtype=np.float64)
+    return csr_matrix((values, indices, np.array([0, len(indices)])), shape=(1, n_features))
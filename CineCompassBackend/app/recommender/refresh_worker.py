@@ -0,0 +1,178 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Callable, Dict, Set, Optional, Any
+
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+
+class RefreshWorker:
+    """Runs update_recommendations off the request path, coalescing bursts per user into one recompute
+
+    Users whose cache was refreshed are remembered, and their superseded cache generations are
+    deleted in one statement at most every gc_interval seconds.
+    """
+
+    def __init__(
+            self,
+            session_factory: Callable[[], Session],
+            executor: Optional[Executor] = None,
+            max_workers: int = 2,
+            gc_interval: float = 60.0
+    ):
+        self.session_factory = session_factory
+        self.executor = executor or ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="recommendation-refresh")
+        self._pending: Dict[int, float] = {}
+        self._running: Set[int] = set()
+        self._rerun: Set[int] = set()
+        self._idle = threading.Condition()
+        self._completed = 0
+        self._failed = 0
+        self._coalesced = 0
+        self._last_lag = 0.0
+        self._max_lag = 0.0
+        self.gc_interval = gc_interval
+        self._refreshed: Set[int] = set()
+        self._collecting = False
+        self._last_collect = time.monotonic()
+        self._collected = 0
+
+    def enqueue(self, user_id: int) -> bool:
+        """Schedule a refresh, returns False if it was merged into one that is already queued or running"""
+        with self._idle:
+            if user_id in self._pending:
+                self._coalesced += 1
+                return False
+            if user_id in self._running:
+                # Ratings written after the running job read them need one more pass
+                self._rerun.add(user_id)
+                self._coalesced += 1
+                return False
+            self._pending[user_id] = time.monotonic()
+
+        self.executor.submit(self._run, user_id)
+        return True
+
+    def is_pending(self, user_id: int) -> bool:
+        with self._idle:
+            return user_id in self._pending or user_id in self._running
+
+    def _run(self, user_id: int):
+        from app.recommender.content_based import CineCompassRecommender
+
+        with self._idle:
+            enqueued_at = self._pending.pop(user_id)
+            self._running.add(user_id)
+        lag = time.monotonic() - enqueued_at
+
+        try:
+            with self.session_factory() as db:
+                CineCompassRecommender(db).update_recommendations(user_id)
+            succeeded = True
+        except Exception as e:
+            logger.error(f"Background refresh for user {user_id} failed: {str(e)}")
+            succeeded = False
+
+        with self._idle:
+            self._running.discard(user_id)
+            self._last_lag = lag
+            self._max_lag = max(self._max_lag, lag)
+            if succeeded:
+                self._completed += 1
+            else:
+                self._failed += 1
+            rerun = user_id in self._rerun
+            if rerun:
+                self._rerun.discard(user_id)
+                self._pending[user_id] = time.monotonic()
+            if succeeded:
+                self._refreshed.add(user_id)
+            collect = self._take_refreshed() if time.monotonic() - self._last_collect >= self.gc_interval else None
+            self._idle.notify_all()
+
+        if rerun:
+            self.executor.submit(self._run, user_id)
+        if collect:
+            self.executor.submit(self._collect, collect)
+
+    def _take_refreshed(self) -> Optional[Set[int]]:
+        # Caller holds the lock
+        if self._collecting or not self._refreshed:
+            return None
+        user_ids, self._refreshed = self._refreshed, set()
+        self._collecting = True
+        return user_ids
+
+    def _collect(self, user_ids: Set[int]):
+        from app.recommender.content_based import collect_stale_generations
+
+        deleted = 0
+        try:
+            with self.session_factory() as db:
+                deleted = collect_stale_generations(db, sorted(user_ids))
+        except Exception as e:
+            logger.error(f"Collecting stale recommendation generations failed: {str(e)}")
+            with self._idle:
+                self._refreshed |= user_ids
+
+        with self._idle:
+            self._collected += deleted
+            self._collecting = False
+            self._last_collect = time.monotonic()
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Wait until nothing is queued or running, mostly useful in tests"""
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._pending and not self._running, timeout)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._idle:
+            now = time.monotonic()
+            return {
+                "queue_depth": len(self._pending),
+                "running": len(self._running),
+                "completed": self._completed,
+                "failed": self._failed,
+                "coalesced": self._coalesced,
+                "oldest_pending_seconds": max((now - t for t in self._pending.values()), default=0.0),
+                "last_lag_seconds": self._last_lag,
+                "max_lag_seconds": self._max_lag,
+                "collected_rows": self._collected
+            }
+
+    def shutdown(self, wait: bool = True):
+        with self._idle:
+            collect = self._take_refreshed()
+        if collect:
+            self.executor.submit(self._collect, collect)
+        self.executor.shutdown(wait=wait)
+
+
+_refresh_worker: Optional[RefreshWorker] = None
+_refresh_worker_lock = threading.Lock()
+
+
+def get_refresh_worker() -> RefreshWorker:
+    global _refresh_worker
+    with _refresh_worker_lock:
+        if _refresh_worker is None:
+            from app.database.init_db import get_sessionmaker
+
+            _refresh_worker = RefreshWorker(
+                get_sessionmaker(),
+                max_workers=int(os.getenv("REFRESH_WORKERS", "2")),
+                gc_interval=float(os.getenv("CACHE_GC_INTERVAL", "60"))
+            )
+        return _refresh_worker
+
+
+def shutdown_refresh_worker():
+    global _refresh_worker
+    with _refresh_worker_lock:
+        if _refresh_worker is not None:
+            _refresh_worker.shutdown()
+            _refresh_worker = None
@@ -0,0 +1,229 @@
+import os
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import TruncatedSVD
+from sklearn.preprocessing import normalize
+
+from app.recommender.model import MovieModel, top_k_indices
+
+logger = logging.getLogger(__name__)
+
+IVF_ARRAY_NAMES = ["ivf_components", "ivf_centroids", "ivf_order", "ivf_offsets"]
+BACKENDS = ["auto", "exact", "neighbors", "ivf"]
+
+
+class IVFIndex:
+    """Inverted-file index over TruncatedSVD projections of the TF-IDF rows
+
+    Every movie is projected into a small dense space and filed under its nearest k-means centroid.
+    A query only looks at the movies filed under its closest centroids, the projections themselves
+    are not kept because candidates are reranked against the sparse rows.
+    """
+
+    def __init__(
+            self,
+            components: np.ndarray,
+            centroids: np.ndarray,
+            order: np.ndarray,
+            offsets: np.ndarray
+    ):
+        self.components = components
+        self.centroids = centroids
+        # Movie rows grouped by list, list i is order[offsets[i]:offsets[i + 1]]
+        self.order = order
+        self.offsets = offsets
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(
+            cls,
+            tfidf_matrix: csr_matrix,
+            n_components: int = 128,
+            n_lists: Optional[int] = None,
+            seed: int = 0
+    ) -> "IVFIndex":
+        n_movies, n_features = tfidf_matrix.shape
+        n_components = max(1, min(n_components, n_features - 1, n_movies - 1))
+        svd = TruncatedSVD(n_components=n_components, random_state=seed)
+        vectors = normalize(svd.fit_transform(tfidf_matrix)).astype(np.float32)
+
+        n_lists = min(n_lists or max(1, int(np.sqrt(n_movies))), n_movies)
+        kmeans = MiniBatchKMeans(n_clusters=n_lists, batch_size=4096, n_init=3, random_state=seed).fit(vectors)
+        labels = kmeans.labels_
+        order = np.argsort(labels, kind="stable").astype(np.int32)
+        offsets = np.searchsorted(labels[order], np.arange(n_lists + 1)).astype(np.int64)
+
+        logger.info(f"Built IVF index with {n_lists} lists over {n_components} SVD components for {n_movies} movies")
+        return cls(
+            svd.components_.astype(np.float32),
+            normalize(kmeans.cluster_centers_).astype(np.float32),
+            order,
+            offsets
+        )
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            "ivf_components": self.components,
+            "ivf_centroids": self.centroids,
+            "ivf_order": self.order,
+            "ivf_offsets": self.offsets
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> "IVFIndex":
+        return cls(*(arrays[name] for name in IVF_ARRAY_NAMES))
+
+    def patch(
+            self,
+            kept_previous: np.ndarray,
+            kept_rows: np.ndarray,
+            changed_rows: np.ndarray,
+            tfidf_matrix: csr_matrix
+    ) -> "IVFIndex":
+        """Index for a model whose kept_rows are unchanged copies of kept_previous in the indexed one
+
+        Kept movies stay in their lists and changed movies are filed under their nearest centroid,
+        the projection and centroids are reused as they are.
+        """
+        labels = np.empty(len(self.order), dtype=np.int64)
+        labels[self.order] = np.repeat(np.arange(self.n_lists), np.diff(self.offsets))
+        new_labels = np.empty(tfidf_matrix.shape[0], dtype=np.int64)
+        new_labels[kept_rows] = labels[kept_previous]
+        if len(changed_rows):
+            vectors = normalize(np.asarray(tfidf_matrix[changed_rows] @ self.components.T, dtype=np.float32))
+            new_labels[changed_rows] = np.argmax(vectors @ self.centroids.T, axis=1)
+
+        order = np.argsort(new_labels, kind="stable").astype(np.int32)
+        offsets = np.searchsorted(new_labels[order], np.arange(self.n_lists + 1)).astype(np.int64)
+        return IVFIndex(self.components, self.centroids, order, offsets)
+
+    def project(self, profile: csr_matrix) -> np.ndarray:
+        query = np.asarray(profile @ self.components.T, dtype=np.float32).ravel()
+        norm = np.linalg.norm(query)
+        return query / norm if norm > 0 else query
+
+    def candidates(self, query: np.ndarray, n_probe: int) -> np.ndarray:
+        lists = top_k_indices(self.centroids @ query, min(n_probe, self.n_lists))
+        return np.concatenate([self.order[self.offsets[i]:self.offsets[i + 1]] for i in lists])
+
+
+class ExactRetriever:
+    """Scores every movie in the catalog, the reference the approximate backends are measured against"""
+
+    name = "exact"
+
+    def __init__(self, model: MovieModel):
+        self.model = model
+
+    def search(
+            self,
+            profile: csr_matrix,
+            movie_ids: np.ndarray,
+            weights: np.ndarray,
+            exclude_rows: np.ndarray,
+            limit: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Scores and rows of candidate movies, at least the best limit of them for approximate backends"""
+        similarities = self.model.score(profile)
+        mask = np.ones(self.model.size, dtype=bool)
+        mask[exclude_rows] = False
+        return similarities[mask], np.where(mask)[0]
+
+
+class NeighborRetriever(ExactRetriever):
+    """Merges the precomputed neighbour lists of the movies the user liked most"""
+
+    name = "neighbors"
+
+    def search(self, profile, movie_ids, weights, exclude_rows, limit):
+        return self.model.approximate_scores(movie_ids, weights, exclude_rows)
+
+
+class IVFRetriever(ExactRetriever):
+    """Pulls candidates from the closest IVF lists, then reranks them with the exact TF-IDF cosine"""
+
+    name = "ivf"
+
+    def __init__(self, model: MovieModel, index: IVFIndex, n_probe: int = 16):
+        super().__init__(model)
+        self.index = index
+        self.n_probe = n_probe
+
+    def search(self, profile, movie_ids, weights, exclude_rows, limit):
+        query = self.index.project(profile)
+        if not query.any():
+            return np.zeros(0), np.zeros(0, dtype=np.int64)
+
+        wanted = limit + len(exclude_rows)
+        n_probe = self.n_probe
+        rows = self.index.candidates(query, n_probe)
+        # Small lists around the query, widen until there is enough to fill the limit
+        while len(rows) < wanted and n_probe < self.index.n_lists:
+            n_probe *= 2
+            rows = self.index.candidates(query, n_probe)
+
+        rows = rows[~np.isin(rows, exclude_rows)]
+        return self.model.score_rows(profile, rows), rows
+
+
+_ivf_lock = threading.Lock()
+_ivf_building = set()
+
+
+def _build_ivf_index(model: MovieModel):
+    from app.recommender import artifact
+
+    try:
+        model.ivf_index = IVFIndex.build(model.tfidf_matrix)
+        # Adds the index to the current artifact, a model that was replaced meanwhile is not published again
+        if artifact.published_version() == model.version:
+            artifact.save_model(model)
+    except Exception as e:
+        logger.error(f"Could not build the IVF index for catalog {model.version}: {str(e)}")
+    finally:
+        with _ivf_lock:
+            _ivf_building.discard(id(model))
+
+
+def get_ivf_index(model: MovieModel) -> Optional[IVFIndex]:
+    """The model's IVF index, None while it is built in the background when the artifact did not ship one"""
+    if model.ivf_index is None:
+        with _ivf_lock:
+            if model.ivf_index is None and id(model) not in _ivf_building:
+                _ivf_building.add(id(model))
+                threading.Thread(target=_build_ivf_index, args=(model,), name="ivf-index", daemon=True).start()
+    return model.ivf_index
+
+
+def get_retriever(model: MovieModel, approximate_threshold: int, backend: Optional[str] = None) -> ExactRetriever:
+    """Retrieval backend from RETRIEVAL_BACKEND, "auto" only approximates catalogs above the threshold"""
+    backend = backend or os.getenv("RETRIEVAL_BACKEND", "auto")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown retrieval backend {backend}, expected one of {', '.join(BACKENDS)}")
+
+    if backend == "auto":
+        if model.size <= approximate_threshold:
+            backend = "exact"
+        elif model.ivf_index is None and model.neighbor_rows is not None:
+            # Use what the artifact shipped rather than building an IVF index for this catalog
+            backend = "neighbors"
+        else:
+            backend = "ivf"
+
+    if backend == "ivf":
+        index = get_ivf_index(model)
+        if index is not None:
+            return IVFRetriever(model, index, n_probe=int(os.getenv("IVF_PROBE", "16")))
+        # Not built yet, serve from the neighbour lists or score everything until it is
+        backend = "neighbors"
+    if backend == "neighbors" and model.neighbor_rows is not None:
+        return NeighborRetriever(model)
+    return ExactRetriever(model)
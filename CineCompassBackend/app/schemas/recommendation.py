@@ -14,5 +14,7 @@ class RecommendationResponse(BaseModel):
     total: int
     page: int
     page_size: int
+    next_cursor: Optional[int] = None
+    refresh_pending: Optional[bool] = False
     needs_sync: Optional[bool] = False
     new_ratings: Optional[List[Dict[str, Any]]] = None
\ No newline at end of file
@@ -0,0 +1,62 @@
+"""Recall@K and query latency of the IVF retrieval backend against exact scoring
+
+Run from CineCompassBackend: python -m benchmarks.ann [movies ...]
+"""
+import sys
+import time
+
+import numpy as np
+
+from app.recommender.model import top_k_indices
+from app.recommender.retrieval import ExactRetriever, IVFIndex, IVFRetriever
+from benchmarks.synthetic import synthetic_model
+
+QUERIES = 50
+
+
+def _user_rows(model, rng) -> np.ndarray:
+    # A few tastes per user, each a seed movie and its closest titles
+    rows = []
+    for seed in rng.choice(model.size, size=3, replace=False):
+        rows.extend([seed, *model.similar_to(seed, 5)[0].tolist()])
+    return np.unique(rows)
+
+
+def _timed_top(retriever, profile, rows, k):
+    start = time.perf_counter()
+    scores, candidates = retriever.search(profile, None, None, rows, k)
+    top = candidates[top_k_indices(scores, k)]
+    return top, time.perf_counter() - start
+
+
+def main():
+    sizes = [int(n) for n in sys.argv[1:]] or [5_000, 50_000, 500_000]
+    rng = np.random.default_rng(7)
+    print(f"{'movies':>8} {'build s':>8} {'exact ms':>9} {'ivf ms':>7} {'recall@10':>10} {'recall@100':>11}")
+    for n_movies in sizes:
+        model = synthetic_model(n_movies, topics=50)
+
+        start = time.perf_counter()
+        index = IVFIndex.build(model.tfidf_matrix)
+        build_time = time.perf_counter() - start
+
+        exact = ExactRetriever(model)
+        ivf = IVFRetriever(model, index)
+        exact_times, ivf_times, recall_10, recall_100 = [], [], [], []
+        for _ in range(QUERIES):
+            rows = _user_rows(model, rng)
+            profile = model.build_profile(rows, rng.uniform(0.5, 1.0, size=len(rows)))
+
+            exact_top, exact_time = _timed_top(exact, profile, rows, 100)
+            ivf_top, ivf_time = _timed_top(ivf, profile, rows, 100)
+            exact_times.append(exact_time)
+            ivf_times.append(ivf_time)
+            recall_10.append(len(set(exact_top[:10].tolist()) & set(ivf_top[:10].tolist())) / 10)
+            recall_100.append(len(set(exact_top.tolist()) & set(ivf_top.tolist())) / 100)
+
+        print(f"{n_movies:>8} {build_time:>8.1f} {np.median(exact_times) * 1e3:>9.2f} "
+              f"{np.median(ivf_times) * 1e3:>7.2f} {np.mean(recall_10):>10.3f} {np.mean(recall_100):>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Scoring throughput of the batch recompute job against scoring users one at a time
+
+Run from CineCompassBackend: python -m benchmarks.batch
+"""
+import time
+
+import numpy as np
+
+from app.recommender.batch import score_block
+from app.recommender.model import top_k_indices
+from app.recommender.profile import vector_to_json
+from benchmarks.synthetic import synthetic_model
+
+USERS = 512
+CACHE_SIZE = 300
+
+
+def main():
+    rng = np.random.default_rng(11)
+    print(f"{'movies':>8} {'block':>6} {'per-user users/s':>17} {'batch users/s':>14}")
+    for n_movies in (5_000, 50_000):
+        model = synthetic_model(n_movies)
+        profiles = []
+        for user_id in range(USERS):
+            rows = rng.choice(n_movies, size=20, replace=False)
+            weights = rng.uniform(0.2, 1.0, size=len(rows))
+            contributions = {str(model.movie_ids[row]): weight for row, weight in zip(rows, weights)}
+            profiles.append((user_id, vector_to_json(model.build_profile(rows, weights)), contributions))
+
+        start = time.perf_counter()
+        for _, vector, contributions in profiles:
+            scores = model.score(model.build_profile(
+                model.rows_for([int(movie_id) for movie_id in contributions]),
+                np.array(list(contributions.values()))
+            ))
+            top_k_indices(scores, CACHE_SIZE)
+        per_user = USERS / (time.perf_counter() - start)
+
+        for block_size in (64, 256):
+            start = time.perf_counter()
+            for i in range(0, USERS, block_size):
+                score_block(model, profiles[i:i + block_size], CACHE_SIZE)
+            batch = USERS / (time.perf_counter() - start)
+            print(f"{n_movies:>8} {block_size:>6} {per_user:>17.0f} {batch:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Rows written and model invalidations of a catalog refresh against re-populating from scratch
+
+Populates the database from the local TMDB stub, then changes part of the stub's catalog and refreshes:
+once with new overviews, once with popularity changes only, and once re-fetching every movie.
+Only movies whose content changed should be written, and the model version should only move when
+text changed.
+
+Run from CineCompassBackend: python -m benchmarks.catalog_refresh [--movies N] [--changed N]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from datetime import timedelta
+
+from sqlalchemy import event
+
+
+async def run(args):
+    from app.database.database_builder import CineCompassDatabaseBuilder
+    from app.database.init_db import init_db, dispose_engine
+    from app.database.rate_limit import TokenBucket
+    from app.recommender.model import get_catalog_version
+    from benchmarks.tmdb_stub import StubCatalog, StubServer, start_stub
+
+    engine, SessionLocal = init_db()
+    statements = 0
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_statement(*_):
+        nonlocal statements
+        statements += 1
+
+    catalog = StubCatalog(int(args.movies * 1.2))
+    server = StubServer(catalog, rate=None, latency=(0.005, 0.02))
+    runner, base_url = await start_stub(server)
+
+    def version():
+        with SessionLocal() as db:
+            return get_catalog_version(db)
+
+    print(f"{'run':>22} {'seconds':>8} {'fetched':>8} {'written':>8} {'unchanged':>10} {'text changed':>13} "
+          f"{'statements':>11} {'model':>8}")
+    try:
+        async def measure(name, run_builder, mutate=None):
+            nonlocal statements
+            if mutate:
+                mutate()
+            before = version()
+            builder = CineCompassDatabaseBuilder(base_url=base_url, rate_limiter=TokenBucket(1e6))
+            statements = 0
+            start = time.perf_counter()
+            report = await run_builder(builder)
+            elapsed = time.perf_counter() - start
+            written = report["saved"]
+            model = "rebuild" if version() != before else "kept"
+            print(f"{name:>22} {elapsed:>8.1f} {written + report['unchanged']:>8} {written:>8} "
+                  f"{report['unchanged']:>10} {report['features_changed']:>13} {statements:>11} {model:>8}",
+                  flush=True)
+            catalog.changed.clear()
+
+        await measure("populate", lambda builder: builder.run_population_async(target_size=args.movies))
+        await measure("refresh, new overviews", lambda builder: builder.run_refresh_async(),
+                      lambda: catalog.mutate(args.changed, overview=True))
+        await measure("refresh, popularity", lambda builder: builder.run_refresh_async(),
+                      lambda: catalog.mutate(args.changed))
+        await measure("re-fetch everything", lambda builder: builder.run_refresh_async(stale_after=timedelta(0)))
+    finally:
+        await runner.cleanup()
+        dispose_engine()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--movies", type=int, default=2000)
+    parser.add_argument("--changed", type=int, default=100, help="movies changed on the stub before each refresh")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'refresh.db')}"
+    logging.getLogger("app.database.database_builder").setLevel(logging.ERROR)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Request latency and database connections with one pooled engine against an engine per request
+
+Every simulated request looks up a user by session id, the query every endpoint starts with.
+Defaults to a throwaway SQLite file, pass --database-url to run against a local Postgres.
+
+Run from CineCompassBackend: python -m benchmarks.db_pool [--database-url URL] [--threads N] [--requests N]
+"""
+import argparse
+import gc
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import Pool
+
+from app.database.init_db import Base, create_db_engine, create_schema
+from app.models.user import User
+
+
+class ConnectionCounter:
+    """Counts new DBAPI connections across all pools and the most that were checked out at once"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.in_use = 0
+        self.peak = 0
+        event.listen(Pool, "connect", self._connect)
+        event.listen(Pool, "checkout", self._checkout)
+        event.listen(Pool, "checkin", self._checkin)
+
+    def _connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.opened += 1
+
+    def _checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.in_use += 1
+            self.peak = max(self.peak, self.in_use)
+
+    def _checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.in_use -= 1
+
+    def reset(self):
+        with self._lock:
+            self.opened = 0
+            self.peak = self.in_use
+
+    def remove(self):
+        event.remove(Pool, "connect", self._connect)
+        event.remove(Pool, "checkout", self._checkout)
+        event.remove(Pool, "checkin", self._checkin)
+
+
+def engine_per_request(database_url: str):
+    # What get_db did before: a new engine, pool and create_all for every request
+    engine = create_db_engine(database_url)
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)()
+
+
+def run(open_session, threads: int, requests: int):
+    latencies = []
+
+    def request(i: int):
+        start = time.perf_counter()
+        db = open_session()
+        try:
+            db.query(User).filter(User.session_id == f"bench-{i % 50}").first()
+        finally:
+            db.close()
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(request, range(requests)))
+    return np.array(latencies), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    database_url = args.database_url or f"sqlite:///{os.path.join(directory, 'bench.db')}"
+
+    engine = create_db_engine(database_url)
+    create_schema(engine)
+    with sessionmaker(bind=engine)() as db:
+        if db.query(User).count() == 0:
+            db.add_all([User(session_id=f"bench-{i}") for i in range(50)])
+            db.commit()
+    engine.dispose()
+
+    counter = ConnectionCounter()
+    print(f"{'mode':>18} {'p50 ms':>7} {'p99 ms':>7} {'req/s':>7} {'opened':>7} {'peak in use':>12}")
+
+    shared = create_db_engine(database_url)
+    modes = [
+        ("shared pool", sessionmaker(bind=shared)),
+        ("engine per request", lambda: engine_per_request(database_url)),
+    ]
+    for name, open_session in modes:
+        # Engines left behind by the previous mode only let go of their connections once collected
+        gc.collect()
+        counter.reset()
+        latencies, elapsed = run(open_session, args.threads, args.requests)
+        print(f"{name:>18} {np.percentile(latencies, 50) * 1e3:>7.2f} {np.percentile(latencies, 99) * 1e3:>7.2f} "
+              f"{args.requests / elapsed:>7.0f} {counter.opened:>7} {counter.peak:>12}")
+
+    shared.dispose()
+    counter.remove()
+
+
+if __name__ == "__main__":
+    main()
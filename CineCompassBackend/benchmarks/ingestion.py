@@ -0,0 +1,66 @@
+"""Movies/sec and drop rate of the database builder against the local TMDB stub
+
+The stub answers 429 above --stub-rate requests per second and fails a share of requests with 503.
+"no limit, no retries" behaves like the builder before the shared rate limit: concurrency is capped,
+and a throttled movie is lost. The limited runs start below and above the stub's limit.
+
+Run from CineCompassBackend: python -m benchmarks.ingestion [--movies N] [--stub-rate R]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+
+
+async def run(args):
+    from app.database.database_builder import CineCompassDatabaseBuilder
+    from app.database.init_db import init_db, dispose_engine
+    from app.database.rate_limit import TokenBucket
+    from app.models.movie import Movie
+    from benchmarks.tmdb_stub import StubCatalog, StubServer, start_stub
+
+    engine, SessionLocal = init_db()
+    catalog = StubCatalog(args.movies * 3)
+
+    print(f"{'scenario':>22} {'movies/s':>9} {'saved':>6} {'drop rate':>10} {'429s':>6} {'retries':>8}")
+    scenarios = [
+        ("no limit, no retries", 1e6, 0),
+        (f"limit {args.stub_rate * 0.8:.0f}/s", args.stub_rate * 0.8, 5),
+        (f"limit {args.stub_rate * 4:.0f}/s, adapting", args.stub_rate * 4, 5),
+    ]
+    for name, rate, max_retries in scenarios:
+        with SessionLocal() as db:
+            db.query(Movie).delete()
+            db.commit()
+
+        server = StubServer(catalog, rate=args.stub_rate, error_rate=args.error_rate)
+        runner, base_url = await start_stub(server)
+        try:
+            builder = CineCompassDatabaseBuilder(base_url=base_url, rate_limiter=TokenBucket(rate))
+            builder.max_retries = max_retries
+            report = await builder.run_population_async(target_size=args.movies)
+        finally:
+            await runner.cleanup()
+
+        print(f"{name:>22} {report['movies_per_second']:>9.1f} {report['saved']:>6} {report['drop_rate']:>10.2%} "
+              f"{server.throttled:>6} {report['retries']:>8}", flush=True)
+
+    dispose_engine()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--movies", type=int, default=500)
+    parser.add_argument("--stub-rate", type=float, default=50, help="requests per second the stub allows")
+    parser.add_argument("--error-rate", type=float, default=0.01, help="share of requests the stub fails with 503")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'ingestion.db')}"
+    logging.getLogger("app.database.database_builder").setLevel(logging.ERROR)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""p50/p99 latency of GET /recommendations while rating writes keep the refresh worker busy
+
+Runs the app in-process on a throwaway SQLite database with a generated catalog. Latencies are for
+first pages served from the cache, while a share of other reads ask for pages past the cache that
+are scored on demand. The "blocking"
+scenario mounts the previous style of route, synchronous session and recommender calls inside
+async def, for comparison.
+
+Run from CineCompassBackend: python -m benchmarks.load_recommendations [--movies N] [--seconds S]
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+
+def seed_database(n_movies: int, n_users: int, rng: random.Random, ratings_per_user: int = 20):
+    from sqlalchemy import insert
+    from app.database.init_db import init_db
+    from app.models.movie import Movie
+    from app.models.rating import Rating
+    from app.models.user import User
+
+    words = [f"word{i}" for i in range(3000)]
+    genres = ["Action", "Adventure", "Animation", "Comedy", "Crime", "Drama", "Family", "Fantasy", "Horror",
+              "Mystery", "Romance", "Science Fiction", "Thriller", "War", "Western"]
+    now = datetime.utcnow()
+
+    engine, SessionLocal = init_db()
+    with SessionLocal() as db:
+        db.execute(insert(Movie), [{
+            "id": movie_id,
+            "title": f"Movie {movie_id}",
+            "overview": " ".join(rng.choices(words, k=40)),
+            "genres": rng.sample(genres, rng.randint(1, 3)),
+            "cast": [f"Actor {rng.randint(1, n_movies // 5)}" for _ in range(4)],
+            "director": f"Director {rng.randint(1, n_movies // 10)}",
+            "popularity": rng.random() * 100,
+            "vote_average": rng.random() * 10,
+            "poster_path": None,
+            "backdrop_path": None,
+            "combined_features": "",
+            "last_updated": now
+        } for movie_id in range(1, n_movies + 1)])
+        db.execute(insert(User), [{"id": user_id, "session_id": f"load-{user_id}", "created_at": now}
+                                  for user_id in range(1, n_users + 1)])
+        db.execute(insert(Rating), [{
+            "user_id": user_id,
+            "movie_id": movie_id,
+            "rating": rng.randint(1, 5),
+            "timestamp": now - timedelta(days=rng.randint(0, 90))
+        } for user_id in range(1, n_users + 1) for movie_id in rng.sample(range(1, n_movies + 1), ratings_per_user)])
+        db.commit()
+
+
+def add_blocking_routes(app):
+    """The endpoints as they were before the async read path, for the baseline scenario"""
+    from fastapi import Depends, Header
+    from sqlalchemy.orm import Session
+    from app.api.v1.endpoints import get_recommender
+    from app.auth.deps import get_db
+    from app.models.user import User
+    from app.schemas.rating import BatchRatingCreate
+
+    @app.get("/blocking/recommendations")
+    async def blocking_recommendations(
+            page: int = 1,
+            page_size: int = 20,
+            session_id: str = Header(alias="X-Session-ID"),
+            db: Session = Depends(get_db),
+            recommender=Depends(get_recommender)
+    ):
+        user = db.query(User).filter(User.session_id == session_id).first()
+        return recommender.get_recommendations(user_id=user.id, page=page, page_size=page_size)
+
+    @app.post("/blocking/ratings/batch")
+    async def blocking_batch_ratings(
+            ratings: BatchRatingCreate,
+            session_id: str = Header(alias="X-Session-ID"),
+            db: Session = Depends(get_db),
+            recommender=Depends(get_recommender)
+    ):
+        user = db.query(User).filter(User.session_id == session_id).first()
+        return recommender.process_batch_ratings(user_id=user.id, ratings=ratings.ratings)
+
+
+async def run_scenario(client, prefix: str, readers: int, writers: int, seconds: float, n_movies: int,
+                       deep_pages: float, rng):
+    latencies = []
+    writes = 0
+    deadline = time.perf_counter() + seconds
+
+    async def reader(user_id: int):
+        headers = {"X-Session-ID": f"load-{user_id}"}
+        while time.perf_counter() < deadline:
+            deep = rng.random() < deep_pages
+            params = {"page_size": 20, "page": rng.randint(20, 100) if deep else 1}
+            start = time.perf_counter()
+            response = await client.get(f"{prefix}/recommendations", params=params, headers=headers)
+            response.raise_for_status()
+            if not deep:
+                latencies.append(time.perf_counter() - start)
+
+    async def writer(user_id: int):
+        nonlocal writes
+        headers = {"X-Session-ID": f"load-{user_id}"}
+        while time.perf_counter() < deadline:
+            ratings = [{"movie_id": movie_id, "rating": rng.randint(1, 5)}
+                       for movie_id in rng.sample(range(1, n_movies + 1), 5)]
+            response = await client.post(f"{prefix}/ratings/batch", json={"ratings": ratings}, headers=headers)
+            response.raise_for_status()
+            writes += 1
+
+    await asyncio.gather(
+        *(reader(user_id) for user_id in range(1, readers + 1)),
+        *(writer(user_id) for user_id in range(readers + 1, readers + writers + 1))
+    )
+    return np.array(latencies), writes
+
+
+async def run(args):
+    import httpx
+    import main
+    from app.recommender.batch import BatchRecompute
+    from app.recommender.refresh_worker import get_refresh_worker, shutdown_refresh_worker
+    from app.database.init_db import get_sessionmaker, dispose_engine, dispose_async_engine
+
+    rng = random.Random(5)
+    seed_database(args.movies, args.readers + args.writers, rng)
+    with get_sessionmaker()() as db:
+        BatchRecompute(db).run(resume=False)
+
+    add_blocking_routes(main.app)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        print(f"{'scenario':>22} {'cached':>7} {'p50 ms':>8} {'p99 ms':>8} {'writes':>7}")
+        scenarios = [
+            ("async, idle", "", 0),
+            ("async, refreshing", "", args.writers),
+            ("blocking, refreshing", "/blocking", args.writers),
+        ]
+        for name, prefix, writers in scenarios:
+            latencies, writes = await run_scenario(
+                client, prefix, args.readers, writers, args.seconds, args.movies, args.deep_pages, rng
+            )
+            get_refresh_worker().join(60)
+            print(f"{name:>22} {len(latencies):>7} {np.percentile(latencies, 50) * 1e3:>8.1f} "
+                  f"{np.percentile(latencies, 99) * 1e3:>8.1f} {writes:>7}", flush=True)
+
+    shutdown_refresh_worker()
+    dispose_engine()
+    await dispose_async_engine()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--movies", type=int, default=5000)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--deep-pages", type=float, default=0.1, help="share of reads past the cached pages")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'load.db')}"
+    os.environ["MODEL_ARTIFACT_DIR"] = os.path.join(directory, "artifacts")
+    # Blocking routes hold their connection while they wait for the event loop, with fewer connections
+    # than clients they deadlock on the pool, which the old engine per request never hit
+    os.environ.setdefault("DB_POOL_SIZE", str(args.readers + args.writers))
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
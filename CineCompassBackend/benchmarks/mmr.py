@@ -0,0 +1,106 @@
+"""Latency of MMR diversity re-ranking: the original pure-Python loop vs the vectorized version,
+and genre Jaccard vs TF-IDF cosine similarity per page size
+
+Run from CineCompassBackend: python -m benchmarks.mmr
+"""
+import time
+
+import numpy as np
+
+from app.recommender.diversity import genre_jaccard, tfidf_cosine, mmr_rerank
+from benchmarks.synthetic import synthetic_model
+
+
+def python_mmr(items, k, lambda_param=0.7):
+    selected = [items[0]]
+    candidates = items[1:]
+
+    while len(selected) < k and candidates:
+        best_score = -float('inf')
+        best_candidate_idx = -1
+
+        for i, candidate in enumerate(candidates):
+            relevance = candidate.get('similarity_score', 0)
+
+            max_sim_to_selected = 0
+            candidate_genres = set(candidate.get('genres', []))
+
+            for sel in selected:
+                sel_genres = set(sel.get('genres', []))
+                if not candidate_genres or not sel_genres:
+                    sim = 0
+                else:
+                    intersection = len(candidate_genres.intersection(sel_genres))
+                    union = len(candidate_genres.union(sel_genres))
+                    sim = intersection / union if union > 0 else 0
+                max_sim_to_selected = max(max_sim_to_selected, sim)
+
+            mmr_score = lambda_param * relevance - (1 - lambda_param) * max_sim_to_selected
+
+            if mmr_score > best_score:
+                best_score = mmr_score
+                best_candidate_idx = i
+
+        if best_candidate_idx != -1:
+            selected.append(candidates.pop(best_candidate_idx))
+        else:
+            selected.append(candidates.pop(0))
+
+    return selected
+
+
+def vectorized_mmr(model, items, k, lambda_param=0.7, diversity="genre"):
+    rows = model.rows_for([item['id'] for item in items])
+    relevance = np.array([item['similarity_score'] for item in items])
+    if diversity == "embedding":
+        similarity_to = tfidf_cosine(model.tfidf_matrix[rows], model.row_norms[rows])
+    else:
+        similarity_to = genre_jaccard(model.genre_matrix[rows])
+    order = mmr_rerank(relevance, similarity_to, k, lambda_param)
+    return [items[i] for i in order]
+
+
+def make_items(model, rng, pool):
+    rows = rng.choice(model.size, size=pool, replace=False)
+    scores = np.sort(rng.random(pool))[::-1]
+    return [{
+        'id': int(model.movie_ids[row]),
+        'similarity_score': float(score),
+        'genres': list(model.genres[row])
+    } for row, score in zip(rows, scores)]
+
+
+def timed(fn, *args, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main():
+    model = synthetic_model(5_000)
+    rng = np.random.default_rng(2)
+
+    print(f"{'pool':>6} {'k':>4} {'python ms':>10} {'numpy ms':>9} {'same order':>11}")
+    for pool, k in ((30, 20), (150, 100), (500, 50), (500, 200), (2000, 100)):
+        items = make_items(model, rng, pool)
+        expected, python_time = timed(python_mmr, list(items), k, repeat=1 if pool > 500 else 3)
+        actual, numpy_time = timed(vectorized_mmr, model, items, k)
+        same = [item['id'] for item in expected] == [item['id'] for item in actual]
+
+        print(f"{pool:>6} {k:>4} {python_time * 1e3:>10.2f} {numpy_time * 1e3:>9.2f} {str(same):>11}")
+
+    print()
+    print(f"{'page':>6} {'pool':>5} {'genre ms':>9} {'embedding ms':>13}")
+    for page_size in (10, 20, 50, 100, 200):
+        pool = min(int(page_size * 1.5), 500)
+        items = make_items(model, rng, pool)
+        _, genre_time = timed(vectorized_mmr, model, items, page_size, 0.7, "genre")
+        _, embedding_time = timed(vectorized_mmr, model, items, page_size, 0.7, "embedding")
+        print(f"{page_size:>6} {pool:>5} {genre_time * 1e3:>9.2f} {embedding_time * 1e3:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
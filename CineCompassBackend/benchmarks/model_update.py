@@ -0,0 +1,99 @@
+"""Time to bring the model up to date after new movies are ingested, incremental update against a full refit
+
+Seeds a catalog, builds the model once, then adds movies in rounds. Each round times update_model and
+build_model on the same movies and compares /movies/{id}/similar of both models for a sample of movies.
+Loading the movies table is the same for both and timed separately.
+
+Run from CineCompassBackend: python -m benchmarks.model_update [--movies N] [--added N] [--rounds N]
+"""
+import argparse
+import logging
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+
+def add_movies(SessionLocal, first_id: int, n_movies: int, rng: random.Random):
+    from sqlalchemy import insert
+    from app.models.movie import Movie
+
+    words = [f"word{i}" for i in range(3000)]
+    now = datetime.now()
+    with SessionLocal() as db:
+        db.execute(insert(Movie), [{
+            "id": movie_id,
+            "title": f"Movie {movie_id}",
+            "overview": " ".join(rng.choices(words, k=40)),
+            "genres": rng.sample(["Action", "Comedy", "Drama", "Horror", "Romance", "Thriller"], 2),
+            "cast": [f"Actor {rng.randint(1, 2000)}" for _ in range(4)],
+            "director": f"Director {rng.randint(1, 500)}",
+            "popularity": rng.random() * 100,
+            "vote_average": rng.random() * 10,
+            "poster_path": None,
+            "backdrop_path": None,
+            "combined_features": "",
+            "last_updated": now,
+            "features_updated": now
+        } for movie_id in range(first_id, first_id + n_movies)])
+        db.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--movies", type=int, default=20000)
+    parser.add_argument("--added", type=int, default=200, help="movies ingested per round")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'update.db')}"
+    logging.getLogger("app.recommender.model").setLevel(logging.WARNING)
+
+    from app.database.init_db import init_db, dispose_engine
+    from app.recommender.model import build_model, get_catalog_version, load_movies_df, update_model
+    from benchmarks.load_recommendations import seed_database
+
+    rng = random.Random(5)
+    seed_database(args.movies, 1, rng, ratings_per_user=1)
+    engine, SessionLocal = init_db()
+    with SessionLocal() as db:
+        model = build_model(db)
+
+    print(f"{'movies':>8} {'load s':>7} {'update s':>9} {'refit s':>8} {'speedup':>8} {'unseen':>7} {'similar@10':>11}")
+    next_id = args.movies + 1
+    for _ in range(args.rounds):
+        add_movies(SessionLocal, next_id, args.added, rng)
+        next_id += args.added
+
+        with SessionLocal() as db:
+            version = get_catalog_version(db)
+            start = time.perf_counter()
+            movies_df = load_movies_df(db)
+            load_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            updated = update_model(model.tfidf_state, movies_df, version, refit_threshold=1.0)
+            update_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            refit = build_model(db, version, movies_df)
+            refit_time = time.perf_counter() - start
+
+        # Agreement of similar movies, for old movies and the ones just added
+        rows = np.concatenate([np.arange(0, args.movies, args.movies // 100),
+                               np.arange(updated.size - 50, updated.size)])
+        overlap = [len(set(updated.similar_to(row, 10)[0].tolist()) & set(refit.similar_to(row, 10)[0].tolist())) / 10
+                   for row in rows]
+        print(f"{updated.size:>8} {load_time:>7.2f} {update_time:>9.3f} {refit_time:>8.2f} "
+              f"{refit_time / update_time:>7.0f}x {updated.unseen_rows:>7} {np.mean(overlap):>11.3f}", flush=True)
+        model = updated
+
+    dispose_engine()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Rows/sec of the movie writer, one upsert per batch against the previous session.merge per row
+
+Each mode writes the same generated movies in batches, first as new rows and then again as updates.
+The last pass puts one row that cannot be written into every batch and counts what got saved.
+Defaults to a throwaway SQLite file, pass --database-url to run against a local Postgres.
+
+Run from CineCompassBackend: python -m benchmarks.movie_writes [--database-url URL] [--rows N]
+"""
+import argparse
+import logging
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+from app.database.database_builder import CineCompassDatabaseBuilder
+from app.database.init_db import create_db_engine, create_schema
+from app.models.movie import Movie
+
+
+def merge_per_row(db, rows: List[Dict]) -> List[Dict]:
+    # What _bulk_save did before: a SELECT by primary key and then an INSERT or UPDATE for every movie
+    try:
+        for row in rows:
+            db.merge(Movie(**row))
+        db.commit()
+        return rows
+    except Exception:
+        db.rollback()
+        return []
+
+
+def generate_rows(n_rows: int, rng: random.Random) -> List[Dict]:
+    words = [f"word{i}" for i in range(2000)]
+    rows = []
+    for movie_id in range(1, n_rows + 1):
+        overview = " ".join(rng.choices(words, k=30))
+        rows.append({
+            "id": movie_id,
+            "title": f"Movie {movie_id}",
+            "overview": overview,
+            "genres": rng.sample(["Action", "Comedy", "Drama", "Horror", "Romance", "Thriller"], 2),
+            "cast": [f"Actor {rng.randint(1, 5000)}" for _ in range(5)],
+            "director": f"Director {rng.randint(1, 1000)}",
+            "popularity": rng.random() * 100,
+            "vote_average": rng.random() * 10,
+            "last_updated": datetime.now(),
+            "combined_features": f"Movie {movie_id} {overview}",
+            "poster_path": None,
+            "backdrop_path": None,
+            "features_updated": datetime.now()
+        })
+        rows[-1]["content_hash"] = CineCompassDatabaseBuilder.content_hash(rows[-1])
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=50)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    database_url = args.database_url or f"sqlite:///{os.path.join(directory, 'writes.db')}"
+    logging.getLogger("app.database.database_builder").setLevel(logging.CRITICAL)
+
+    engine = create_db_engine(database_url)
+    create_schema(engine)
+    SessionLocal = sessionmaker(bind=engine)
+    statements = 0
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_statement(*_):
+        nonlocal statements
+        statements += 1
+
+    rows = generate_rows(args.rows, random.Random(4))
+    batches = [rows[i:i + args.batch_size] for i in range(0, len(rows), args.batch_size)]
+    # A value the JSON column cannot serialize, so the row fails when the statement executes
+    bad_batches = [batch[:-1] + [{**batch[-1], "genres": [object()]}] for batch in batches]
+
+    print(f"{engine.dialect.name}, {args.rows} rows in batches of {args.batch_size}")
+    print(f"{'writer':>14} {'pass':>9} {'rows/s':>8} {'statements/batch':>17} {'saved':>6}")
+    for name, write in (("merge per row", merge_per_row), ("bulk upsert", CineCompassDatabaseBuilder.save_movies)):
+        with SessionLocal() as db:
+            db.query(Movie).delete()
+            db.commit()
+
+        for phase, phase_batches in (("insert", batches), ("update", batches), ("bad row", bad_batches)):
+            statements = 0
+            saved = 0
+            start = time.perf_counter()
+            with SessionLocal() as db:
+                for batch in phase_batches:
+                    saved += len(write(db, batch))
+            elapsed = time.perf_counter() - start
+            print(f"{name:>14} {phase:>9} {len(rows) / elapsed:>8.0f} {statements / len(phase_batches):>17.1f} "
+                  f"{saved:>6}", flush=True)
+
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
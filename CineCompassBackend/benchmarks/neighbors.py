@@ -0,0 +1,44 @@
+"""Build time of the item-item neighbour index and lookup latency of /movies/{id}/similar
+
+Run from CineCompassBackend: python -m benchmarks.neighbors
+"""
+import time
+
+import numpy as np
+
+from app.recommender.neighbors import build_neighbors
+from benchmarks.synthetic import synthetic_model
+
+
+def main():
+    rng = np.random.default_rng(3)
+    print(f"{'movies':>8} {'build s':>8} {'index MB':>9} {'lookup us':>10} {'on-the-fly us':>14} {'recall@10':>10}")
+    for n_movies in (5_000, 20_000, 50_000):
+        model = synthetic_model(n_movies)
+
+        start = time.perf_counter()
+        neighbor_rows, neighbor_scores = build_neighbors(model.tfidf_matrix, model.row_norms, top_n=50)
+        build_time = time.perf_counter() - start
+
+        rows = rng.choice(n_movies, size=200, replace=False)
+        exact = {}
+        start = time.perf_counter()
+        for row in rows:
+            exact[row] = set(model.similar_to(row, 10)[0].tolist())
+        exact_time = (time.perf_counter() - start) / len(rows)
+
+        model.neighbor_rows, model.neighbor_scores = neighbor_rows, neighbor_scores
+        recall = []
+        start = time.perf_counter()
+        for row in rows:
+            found = model.similar_to(row, 10)[0]
+            recall.append(len(exact[row] & set(found.tolist())) / 10)
+        lookup_time = (time.perf_counter() - start) / len(rows)
+
+        index_mb = (neighbor_rows.nbytes + neighbor_scores.nbytes) / 1e6
+        print(f"{n_movies:>8} {build_time:>8.2f} {index_mb:>9.1f} {lookup_time * 1e6:>10.1f} "
+              f"{exact_time * 1e6:>14.1f} {np.mean(recall):>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Total population time of the streaming ingestion pipeline against the previous gather-then-batch flow
+
+Both builders share the rate limiter, retries and database writes, and run against the local TMDB
+stub with per-request latency. Only the shape of the pipeline differs.
+
+Run from CineCompassBackend: python -m benchmarks.population [--movies N] [--stub-rate R]
+"""
+import argparse
+import asyncio
+import logging
+import math
+import os
+import tempfile
+import time
+
+import aiohttp
+
+from app.database.database_builder import CineCompassDatabaseBuilder, IngestionStats
+
+
+class GatherThenBatchBuilder(CineCompassDatabaseBuilder):
+    """run_population_async as it was before the pipeline, for the baseline"""
+
+    async def run_population_async(self, target_size: int = 5000):
+        self.stats = IngestionStats()
+        needed = target_size - len(self.processed_movies)
+
+        async with aiohttp.ClientSession() as session:
+            sources = ["popular", "top_rated", "now_playing"]
+            pages_per_source = math.ceil((needed / 20) / len(sources)) + 5
+            results = await asyncio.gather(*(
+                self.fetch_page_async(session, source, page)
+                for source in sources for page in range(1, pages_per_source + 1)
+            ))
+
+            unique_candidates = {}
+            for batch in results:
+                for movie in batch:
+                    if movie['id'] not in self.processed_movies:
+                        unique_candidates[movie['id']] = movie
+            candidates_list = list(unique_candidates.values())[:needed]
+            self.stats.candidates = len(candidates_list)
+
+            batch_size = 50
+            for i in range(0, len(candidates_list), batch_size):
+                detailed_results = await asyncio.gather(*(
+                    self.fetch_movie_details_async(session, m) for m in candidates_list[i:i + batch_size]
+                ))
+                self._bulk_save([r for r in detailed_results if r is not None])
+
+        return self.stats.report()
+
+
+async def run(args):
+    from app.database.init_db import init_db, dispose_engine
+    from app.database.rate_limit import TokenBucket
+    from app.models.movie import Movie
+    from benchmarks.tmdb_stub import StubCatalog, StubServer, start_stub
+
+    engine, SessionLocal = init_db()
+    catalog = StubCatalog(int(args.movies * 1.2))
+
+    print(f"{'stub limit':>10} {'pipeline':>18} {'seconds':>8} {'movies/s':>9} {'saved':>6}")
+    for stub_rate in (None, args.stub_rate):
+        for name, builder_class in (("gather-then-batch", GatherThenBatchBuilder),
+                                    ("streaming", CineCompassDatabaseBuilder)):
+            with SessionLocal() as db:
+                db.query(Movie).delete()
+                db.commit()
+
+            server = StubServer(catalog, rate=stub_rate, latency=(0.02, 0.08))
+            runner, base_url = await start_stub(server)
+            try:
+                # Just under the stub's limit, so the limited runs measure the pipeline rather than 429s
+                rate_limiter = TokenBucket(stub_rate * 0.9 if stub_rate else 1e6)
+                builder = builder_class(base_url=base_url, rate_limiter=rate_limiter)
+                start = time.perf_counter()
+                report = await builder.run_population_async(target_size=args.movies)
+                elapsed = time.perf_counter() - start
+            finally:
+                await runner.cleanup()
+
+            limit = f"{stub_rate:.0f}/s" if stub_rate else "none"
+            print(f"{limit:>10} {name:>18} {elapsed:>8.1f} {report['saved'] / elapsed:>9.1f} {report['saved']:>6}",
+                  flush=True)
+
+    dispose_engine()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--movies", type=int, default=5000)
+    parser.add_argument("--stub-rate", type=float, default=200, help="requests per second the limited stub allows")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'population.db')}"
+    logging.getLogger("app.database.database_builder").setLevel(logging.ERROR)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Throughput and payload bytes of /movies/popular and /recommendations with the response cache
+
+Clients poll the same first page. "uncached" rebuilds every response, "cached" serves the stored body
+and "revalidated" sends the ETag from the previous response back in If-None-Match.
+
+Run from CineCompassBackend: python -m benchmarks.response_cache [--movies N] [--requests N]
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.load_recommendations import seed_database
+
+
+async def run_mode(client, path: str, params: dict, users: int, clients: int, requests: int, revalidate: bool):
+    remaining = requests
+    received = 0
+    etags = {}
+
+    async def worker(worker_id: int):
+        nonlocal remaining, received
+        while remaining > 0:
+            remaining -= 1
+            user_id = worker_id % users + 1
+            headers = {"X-Session-ID": f"load-{user_id}"}
+            if revalidate and user_id in etags:
+                headers["If-None-Match"] = etags[user_id]
+            response = await client.get(path, params=params, headers=headers)
+            if response.status_code not in (200, 304):
+                response.raise_for_status()
+            etags[user_id] = response.headers["etag"]
+            received += len(response.content)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(clients)))
+    return requests / (time.perf_counter() - start), received / requests
+
+
+async def run(args):
+    import httpx
+    import main
+    from app.api.response_cache import get_response_cache
+    from app.database.init_db import get_sessionmaker, dispose_engine, dispose_async_engine
+    from app.recommender.batch import BatchRecompute
+
+    seed_database(args.movies, args.clients, random.Random(9))
+    with get_sessionmaker()() as db:
+        BatchRecompute(db).run(resume=False)
+    response_cache = get_response_cache()
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        print(f"{'endpoint':>16} {'mode':>12} {'req/s':>7} {'bytes/req':>10}")
+        endpoints = [
+            ("/movies/popular", {"limit": 50}),
+            ("/recommendations", {"page_size": 20}),
+        ]
+        modes = [("uncached", 0, False), ("cached", 2048, False), ("revalidated", 2048, True)]
+        for path, params in endpoints:
+            for name, max_size, revalidate in modes:
+                response_cache.clear()
+                response_cache.max_size = max_size
+                throughput, size = await run_mode(
+                    client, path, params, args.clients, args.clients, args.requests, revalidate
+                )
+                print(f"{path:>16} {name:>12} {throughput:>7.0f} {size:>10.0f}", flush=True)
+
+    dispose_engine()
+    await dispose_async_engine()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--movies", type=int, default=5000)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'responses.db')}"
+    os.environ["MODEL_ARTIFACT_DIR"] = os.path.join(directory, "artifacts")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
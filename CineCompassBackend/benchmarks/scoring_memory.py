@@ -0,0 +1,58 @@
+"""Peak memory and latency of one profile refresh: dense cosine_similarity vs the sparse CSR path
+
+Run from CineCompassBackend: python -m benchmarks.scoring_memory
+"""
+import time
+import tracemalloc
+
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+
+from benchmarks.synthetic import synthetic_model
+
+
+def dense_refresh(model, rows, weights):
+    user_profile = np.zeros(model.tfidf_matrix.shape[1])
+    for row, weight in zip(rows, weights):
+        user_profile += model.tfidf_matrix[row].toarray()[0] * weight
+    user_profile = user_profile / np.linalg.norm(user_profile)
+    similarities = cosine_similarity(user_profile.reshape(1, -1), model.tfidf_matrix.toarray())[0]
+    mask = np.ones(len(model.tfidf_matrix.toarray()), dtype=bool)
+    mask[rows] = False
+    return similarities[mask]
+
+
+def sparse_refresh(model, rows, weights):
+    similarities = model.score(model.build_profile(rows, weights))
+    mask = np.ones(model.size, dtype=bool)
+    mask[rows] = False
+    return similarities[mask]
+
+
+def measure(fn, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    rng = np.random.default_rng(1)
+    print(f"{'movies':>8} {'nnz':>9} {'dense MB':>9} {'sparse MB':>10} {'dense ms':>9} {'sparse ms':>10} {'max diff':>9}")
+    for n_movies in (5_000, 20_000, 50_000):
+        model = synthetic_model(n_movies)
+        rows = rng.choice(n_movies, size=50, replace=False)
+        weights = rng.uniform(-2, 2, size=50)
+
+        dense, dense_time, dense_peak = measure(dense_refresh, model, rows, weights)
+        sparse, sparse_time, sparse_peak = measure(sparse_refresh, model, rows, weights)
+
+        print(f"{n_movies:>8} {model.tfidf_matrix.nnz:>9} {dense_peak / 1e6:>9.1f} {sparse_peak / 1e6:>10.1f} "
+              f"{dense_time * 1e3:>9.1f} {sparse_time * 1e3:>10.1f} {np.abs(dense - sparse).max():>9.1e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Latency of GET /is-onboarded, the session lookup every endpoint starts with
+
+Compares the session cache, the COUNT query it falls back to on a miss, and the previous lookup that
+loaded the user and their whole ratings relationship to check onboarding.
+
+Run from CineCompassBackend: python -m benchmarks.session_lookup [--ratings N] [--requests N]
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.load_recommendations import seed_database
+
+
+def add_relationship_route(app):
+    """/is-onboarded as it was before the session cache, for the baseline"""
+    from fastapi import Depends, Header
+    from sqlalchemy import select
+    from sqlalchemy.ext.asyncio import AsyncSession
+    from app.auth.deps import get_async_db
+    from app.models.user import User, ONBOARDING_RATINGS
+
+    @app.get("/relationship/is-onboarded")
+    async def relationship_is_onboarded(
+            session_id: str = Header(alias="X-Session-ID"),
+            db: AsyncSession = Depends(get_async_db)
+    ):
+        user = (await db.execute(select(User).where(User.session_id == session_id))).scalar_one()
+        ratings = await db.run_sync(lambda _: user.ratings)
+        return len(ratings) > ONBOARDING_RATINGS
+
+
+async def run_mode(client, path: str, users: int, clients: int, requests: int, rng: random.Random):
+    latencies = []
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            headers = {"X-Session-ID": f"load-{rng.randint(1, users)}"}
+            start = time.perf_counter()
+            response = await client.get(path, headers=headers)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(clients)))
+    return np.array(latencies), time.perf_counter() - start
+
+
+async def run(args):
+    import httpx
+    import main
+    from app.auth.session_cache import get_session_cache
+    from app.database.init_db import dispose_engine, dispose_async_engine
+
+    rng = random.Random(3)
+    seed_database(args.ratings * 2, args.users, rng, ratings_per_user=args.ratings)
+    add_relationship_route(main.app)
+    session_cache = get_session_cache()
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        print(f"{'mode':>22} {'p50 ms':>7} {'p99 ms':>7} {'req/s':>7}")
+        modes = [
+            ("session cache", "/is-onboarded", args.users),
+            ("count query", "/is-onboarded", 0),
+            ("ratings relationship", "/relationship/is-onboarded", 0),
+        ]
+        for name, path, cache_size in modes:
+            session_cache.clear()
+            session_cache.max_size = cache_size
+            latencies, elapsed = await run_mode(client, path, args.users, args.clients, args.requests, rng)
+            print(f"{name:>22} {np.percentile(latencies, 50) * 1e3:>7.2f} {np.percentile(latencies, 99) * 1e3:>7.2f} "
+                  f"{args.requests / elapsed:>7.0f}", flush=True)
+
+    dispose_engine()
+    await dispose_async_engine()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--ratings", type=int, default=500, help="ratings per user")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=4000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'sessions.db')}"
+    os.environ["MODEL_ARTIFACT_DIR"] = os.path.join(directory, "artifacts")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
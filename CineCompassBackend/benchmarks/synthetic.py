@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from sklearn.preprocessing import normalize
+
+from app.recommender.model import MovieModel
+
+GENRES = ["Action", "Adventure", "Animation", "Comedy", "Crime", "Documentary", "Drama", "Family", "Fantasy",
+          "History", "Horror", "Music", "Mystery", "Romance", "Science Fiction", "Thriller", "War", "Western"]
+
+
+def synthetic_model(
+        n_movies: int,
+        n_features: int = 2000,
+        nnz_per_row: int = 40,
+        seed: int = 0,
+        topics: int = 0
+) -> MovieModel:
+    """Random L2-normalized TF-IDF-like matrix with matching movie metadata, no database needed
+
+    With topics, half of every movie's terms come from the feature block of one random topic, which
+    gives the matrix the cluster structure real genres and casts have.
+    """
+    rng = np.random.default_rng(seed)
+    indptr = np.arange(0, (n_movies + 1) * nnz_per_row, nnz_per_row, dtype=np.int64)
+    # Zipf-ish feature popularity so some columns are shared by many movies
+    indices = np.minimum(rng.zipf(1.3, size=n_movies * nnz_per_row) - 1, n_features - 1).astype(np.int32)
+    if topics:
+        block = n_features // topics
+        topic_terms = (np.repeat(rng.integers(0, topics, size=n_movies), nnz_per_row) * block
+                       + rng.integers(0, block, size=n_movies * nnz_per_row))
+        indices = np.where(rng.random(n_movies * nnz_per_row) < 0.5, topic_terms, indices).astype(np.int32)
+    data = rng.random(n_movies * nnz_per_row)
+    matrix = csr_matrix((data, indices, indptr), shape=(n_movies, n_features))
+    matrix.sum_duplicates()
+    matrix = normalize(matrix).tocsr()
+
+    movies_df = pd.DataFrame([{
+        'id': movie_id,
+        'title': f"Movie {movie_id}",
+        'combined_features': "",
+        'details': {
+            'genres': list(rng.choice(GENRES, size=rng.integers(1, 4), replace=False)),
+            'cast': [f"Actor {rng.integers(0, n_movies // 5 + 1)}" for _ in range(5)],
+            'director': f"Director {rng.integers(0, n_movies // 10 + 1)}",
+            'poster_path': None,
+            'backdrop_path': None,
+            'overview': "",
+            'vote_average': float(rng.random() * 10),
+            'popularity': float(rng.random() * 100)
+        }
+    } for movie_id in range(1, n_movies + 1)])
+
+    return MovieModel(f"synthetic-{n_movies}", None, matrix, movies_df)
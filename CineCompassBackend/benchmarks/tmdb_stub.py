@@ -0,0 +1,170 @@
+"""Local stand-in for the TMDB endpoints the database builder calls, with rate limiting and latency
+
+Serves /movie/{popular,top_rated,now_playing}?page=N, /movie/{id}?append_to_response=credits and
+/movie/changes?page=N for a generated catalog. Requests above the rate limit get a 429 with Retry-After,
+like TMDB does.
+
+Run from CineCompassBackend: python -m benchmarks.tmdb_stub [--port 8001] [--rate 50]
+and point the builder at it with TMDB_BASE_URL=http://localhost:8001
+"""
+import argparse
+import asyncio
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+LISTS = ("popular", "top_rated", "now_playing")
+PAGE_SIZE = 20
+CHANGES_PAGE_SIZE = 100
+GENRES = ["Action", "Adventure", "Animation", "Comedy", "Crime", "Drama", "Family", "Fantasy", "Horror",
+          "Mystery", "Romance", "Science Fiction", "Thriller", "War", "Western"]
+
+
+class StubCatalog:
+    def __init__(self, n_movies: int, seed: int = 0):
+        self.rng = rng = random.Random(seed)
+        self.words = words = [f"word{i}" for i in range(2000)]
+        # Ids mutated since the catalog was generated, served by /movie/changes whatever the dates
+        self.changed: List[int] = []
+        self.movies: Dict[int, Dict] = {}
+        for movie_id in range(1, n_movies + 1):
+            self.movies[movie_id] = {
+                "id": movie_id,
+                "title": f"Movie {movie_id}",
+                "overview": " ".join(rng.choices(words, k=30)),
+                "popularity": round(rng.random() * 100, 3),
+                "vote_average": round(rng.random() * 10, 1),
+                "poster_path": f"/poster{movie_id}.jpg",
+                "backdrop_path": f"/backdrop{movie_id}.jpg",
+                "genres": [{"id": GENRES.index(name), "name": name} for name in rng.sample(GENRES, rng.randint(1, 3))],
+                "cast": [f"Actor {rng.randint(1, n_movies // 4 + 1)}" for _ in range(6)],
+                "director": f"Director {rng.randint(1, n_movies // 10 + 1)}",
+            }
+        ids = list(self.movies)
+        self.lists: Dict[str, List[int]] = {}
+        for name in LISTS:
+            rng.shuffle(ids)
+            self.lists[name] = list(ids)
+
+    def mutate(self, n_movies: int, overview: bool = False) -> List[int]:
+        """Change the popularity, and the overview when asked, of n random movies and report them as changed"""
+        movie_ids = self.rng.sample(list(self.movies), n_movies)
+        for movie_id in movie_ids:
+            movie = self.movies[movie_id]
+            movie["popularity"] = round(self.rng.random() * 100, 3)
+            if overview:
+                movie["overview"] = " ".join(self.rng.choices(self.words, k=30))
+        self.changed.extend(movie_ids)
+        return movie_ids
+
+    def basic(self, movie_id: int) -> Dict:
+        movie = self.movies[movie_id]
+        return {key: movie[key] for key in ("id", "title", "overview", "popularity", "vote_average",
+                                            "poster_path", "backdrop_path")}
+
+    def details(self, movie_id: int, credits: bool) -> Dict:
+        movie = self.movies[movie_id]
+        details = {**self.basic(movie_id), "genres": movie["genres"]}
+        if credits:
+            details["credits"] = {
+                "cast": [{"name": name} for name in movie["cast"]],
+                "crew": [{"name": movie["director"], "job": "Director"}],
+            }
+        return details
+
+
+class StubServer:
+    """aiohttp application over a StubCatalog, counting what it served"""
+
+    def __init__(self, catalog: StubCatalog, rate: Optional[float] = 50.0, latency: Tuple[float, float] = (0.02, 0.08),
+                 error_rate: float = 0.0, seed: int = 0):
+        self.catalog = catalog
+        self.rate = rate
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self._tokens = rate or 0.0
+        self._updated = time.monotonic()
+        self.served = 0
+        self.throttled = 0
+        self.failed = 0
+        self.app = web.Application()
+        self.app.router.add_get("/movie/{key}", self.movie)
+
+    def _allow(self) -> bool:
+        if not self.rate:
+            return True
+        now = time.monotonic()
+        self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    async def movie(self, request: web.Request) -> web.Response:
+        if not self._allow():
+            self.throttled += 1
+            return web.json_response({"status_code": 25, "status_message": "Too many requests"}, status=429,
+                                     headers={"Retry-After": "1"})
+
+        await asyncio.sleep(self.rng.uniform(*self.latency))
+        if self.rng.random() < self.error_rate:
+            self.failed += 1
+            return web.json_response({"status_message": "Service unavailable"}, status=503)
+
+        key = request.match_info["key"]
+        if key == "changes":
+            page = int(request.query.get("page", "1"))
+            ids = list(dict.fromkeys(self.catalog.changed))
+            total_pages = max(1, (len(ids) + CHANGES_PAGE_SIZE - 1) // CHANGES_PAGE_SIZE)
+            results = [{"id": movie_id, "adult": False}
+                       for movie_id in ids[(page - 1) * CHANGES_PAGE_SIZE:page * CHANGES_PAGE_SIZE]]
+            self.served += 1
+            return web.json_response({"page": page, "results": results, "total_pages": total_pages})
+
+        if key in self.catalog.lists:
+            page = int(request.query.get("page", "1"))
+            ids = self.catalog.lists[key]
+            total_pages = (len(ids) + PAGE_SIZE - 1) // PAGE_SIZE
+            results = [self.catalog.basic(movie_id) for movie_id in ids[(page - 1) * PAGE_SIZE:page * PAGE_SIZE]]
+            self.served += 1
+            return web.json_response({"page": page, "results": results, "total_pages": total_pages})
+
+        if key.isdigit() and int(key) in self.catalog.movies:
+            credits = "credits" in request.query.get("append_to_response", "")
+            self.served += 1
+            return web.json_response(self.catalog.details(int(key), credits))
+
+        return web.json_response({"status_code": 34, "status_message": "Not found"}, status=404)
+
+    def counters(self) -> Dict[str, int]:
+        return {"served": self.served, "throttled": self.throttled, "failed": self.failed}
+
+
+async def start_stub(server: StubServer, host: str = "127.0.0.1", port: int = 0) -> Tuple[web.AppRunner, str]:
+    """Serve the stub in the running loop, returns the runner to clean up and its base URL"""
+    runner = web.AppRunner(server.app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--movies", type=int, default=10000)
+    parser.add_argument("--rate", type=float, default=50, help="requests per second before answering 429")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = StubServer(StubCatalog(args.movies), rate=args.rate, error_rate=args.error_rate)
+    web.run_app(server.app, host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,8 +4,13 @@ from fastapi.middleware.cors import CORSMiddleware
 from app.api.v1 import endpoints
 import uvicorn
 from app.database.database_builder import CineCompassDatabaseBuilder
+from app.database.init_db import get_engine, create_schema, dispose_engine, dispose_async_engine
+from app.api.response_cache import get_response_cache
+from app.recommender.model import model_registry
+from app.recommender.refresh_worker import shutdown_refresh_worker
 import asyncio
 import logging
+import os
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -16,15 +21,36 @@ async def populate_database_background(builder: CineCompassDatabaseBuilder):
         logger.info("Starting background database population...")
         
         await builder.run_population_async(target_size=target_size)
+        model_registry.invalidate()
+        get_response_cache().invalidate_catalog()
         
         logger.info(f"Database population completed. Target size: {target_size}")
     except Exception as e:
         logger.error(f"Error during background database population: {str(e)}")
 
+    await refresh_catalog_background(builder)
+
+async def refresh_catalog_background(builder: CineCompassDatabaseBuilder):
+    interval = float(os.getenv("CATALOG_REFRESH_INTERVAL", "86400"))
+    if interval <= 0:
+        return
+
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await builder.run_refresh_async()
+            get_response_cache().invalidate_catalog()
+            # Popularity-only changes keep the TF-IDF rows and only reload the movie details
+            model_registry.invalidate()
+        except Exception as e:
+            logger.error(f"Error during catalog refresh: {str(e)}")
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     try:
+        create_schema(get_engine())
+
         builder = CineCompassDatabaseBuilder()
         asyncio.create_task(populate_database_background(builder))
         logger.info("Database population task initiated")
@@ -33,6 +59,9 @@ async def lifespan(app: FastAPI):
 
     yield
     logger.info("Shutting down application")
+    shutdown_refresh_worker()
+    dispose_engine()
+    await dispose_async_engine()
 
 app = FastAPI(title="CineCompass API", lifespan=lifespan)
 
@@ -42,6 +71,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 app.include_router(endpoints.router)
@@ -0,0 +1,110 @@
+import asyncio
+import random
+from datetime import datetime
+
+import pytest
+from sqlalchemy import event, insert
+from sqlalchemy.orm import sessionmaker
+
+from app.database.database_builder import CineCompassDatabaseBuilder
+from app.database.init_db import create_db_engine, create_schema, dispose_engine
+from app.database.rate_limit import TokenBucket
+from app.models.movie import Movie
+from app.models.user import User
+from app.recommender import content_based
+from app.recommender.model import ModelRegistry
+from benchmarks.tmdb_stub import start_stub
+
+GENRES = ["Action", "Comedy", "Drama", "Horror", "Romance", "Thriller"]
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    """Throwaway SQLite database with a small catalog and one user"""
+    monkeypatch.setenv("MODEL_ARTIFACT_DIR", str(tmp_path / "artifacts"))
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    create_schema(engine)
+
+    rng = random.Random(0)
+    words = [f"word{i}" for i in range(60)]
+    now = datetime.now()
+    with engine.begin() as connection:
+        connection.execute(insert(Movie), [{
+            "id": movie_id,
+            "title": f"Movie {movie_id}",
+            "overview": " ".join(rng.choices(words, k=20)),
+            "genres": rng.sample(GENRES, 2),
+            "cast": [f"Actor {rng.randint(1, 10)}" for _ in range(3)],
+            "director": f"Director {rng.randint(1, 5)}",
+            "popularity": rng.random() * 100,
+            "vote_average": rng.random() * 10,
+            "combined_features": "",
+            "last_updated": now,
+            "features_updated": now
+        } for movie_id in range(1, 51)])
+        connection.execute(insert(User), [{"id": 1, "session_id": "test-user", "created_at": now}])
+
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def session_factory(engine):
+    return sessionmaker(bind=engine)
+
+
+@pytest.fixture(autouse=True)
+def model_registry(monkeypatch):
+    # A registry per test, so no model leaks between test databases
+    registry = ModelRegistry(check_interval=0)
+    monkeypatch.setattr(content_based, "model_registry", registry)
+    return registry
+
+
+class StatementCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *_):
+        self.count += 1
+
+
+@pytest.fixture
+def statements(engine):
+    return StatementCounter(engine)
+
+
+class RecordingWorker:
+    """Takes the place of the refresh worker, so only the request's own statements are counted"""
+
+    def __init__(self):
+        self.enqueued = []
+
+    def enqueue(self, user_id: int):
+        self.enqueued.append(user_id)
+
+
+@pytest.fixture
+def builder_factory(engine, session_factory, monkeypatch):
+    """Database builders on the test database, pointed at a TMDB stub's base URL"""
+    monkeypatch.setenv("DATABASE_URL", str(engine.url))
+
+    def create(base_url: str, rate_limiter=None) -> CineCompassDatabaseBuilder:
+        return CineCompassDatabaseBuilder(session_factory, base_url=base_url,
+                                          rate_limiter=rate_limiter or TokenBucket(1e6))
+
+    yield create
+    dispose_engine()
+
+
+def run_with_stub(server, scenario):
+    """Serve a StubServer while the coroutine scenario(base_url) runs, returns what it returns"""
+    async def run():
+        runner, base_url = await start_stub(server)
+        try:
+            return await scenario(base_url)
+        finally:
+            await runner.cleanup()
+
+    return asyncio.run(run())
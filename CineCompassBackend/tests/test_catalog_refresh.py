@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from app.database.database_builder import CHANGES_FEED
+from app.database.init_db import create_schema
+from app.models.catalog_sync import CatalogSync
+from app.models.movie import Movie
+from app.recommender.model import get_catalog_version
+from benchmarks.tmdb_stub import StubCatalog, StubServer
+from tests.conftest import run_with_stub
+
+
+async def refresh(builder_factory, server, base_url, stale_after=None):
+    report = await builder_factory(base_url).run_refresh_async(stale_after=stale_after)
+    server.catalog.changed.clear()
+    return report
+
+
+def catalog_version(session_factory):
+    with session_factory() as db:
+        return get_catalog_version(db)
+
+
+def test_unchanged_movies_are_not_written(builder_factory):
+    server = StubServer(StubCatalog(50), rate=None, latency=(0, 0))
+
+    async def scenario(base_url):
+        first = await refresh(builder_factory, server, base_url, stale_after=timedelta(0))
+        second = await refresh(builder_factory, server, base_url, stale_after=timedelta(0))
+        return first, second
+
+    first, second = run_with_stub(server, scenario)
+    assert first["saved"] == 50
+    assert second["saved"] == 0
+    assert second["unchanged"] == 50
+    assert second["features_changed"] == 0
+
+
+def test_only_text_changes_move_the_model(builder_factory, session_factory):
+    server = StubServer(StubCatalog(50), rate=None, latency=(0, 0))
+
+    async def scenario(base_url):
+        await refresh(builder_factory, server, base_url, stale_after=timedelta(0))
+        before = catalog_version(session_factory)
+
+        server.catalog.mutate(5)
+        report = await refresh(builder_factory, server, base_url)
+        assert report["saved"] == 5
+        assert report["features_changed"] == 0
+        assert catalog_version(session_factory) == before
+
+        server.catalog.mutate(5, overview=True)
+        report = await refresh(builder_factory, server, base_url)
+        assert report["saved"] == 5
+        assert report["features_changed"] == 5
+        assert catalog_version(session_factory) != before
+
+    run_with_stub(server, scenario)
+
+
+def test_cursor_stays_when_the_changes_feed_fails(builder_factory, session_factory):
+    synced_at = datetime.now() - timedelta(days=3)
+    with session_factory() as db:
+        db.add(CatalogSync(source=CHANGES_FEED, synced_at=synced_at))
+        db.commit()
+
+    server = StubServer(StubCatalog(50), rate=None, latency=(0, 0), error_rate=1.0)
+    server.catalog.mutate(5, overview=True)
+
+    def cursor():
+        with session_factory() as db:
+            return db.get(CatalogSync, CHANGES_FEED).synced_at
+
+    async def scenario(base_url):
+        builder = builder_factory(base_url)
+        builder.max_retries = 0
+        await builder.run_refresh_async()
+        assert cursor() == synced_at
+
+        # The changes the failed read missed are picked up from the same cursor
+        server.error_rate = 0.0
+        report = await builder.run_refresh_async()
+        assert report["features_changed"] == 5
+        assert cursor() > synced_at
+
+    run_with_stub(server, scenario)
+
+
+def test_features_updated_is_backfilled(engine, session_factory):
+    # Movies fetched before features_updated existed
+    with engine.begin() as connection:
+        connection.execute(update(Movie).where(Movie.id <= 10).values(features_updated=None))
+
+    create_schema(engine)
+
+    with session_factory() as db:
+        rows = db.query(Movie.last_updated, Movie.features_updated).filter(Movie.id <= 10).all()
+    assert all(features_updated == last_updated for last_updated, features_updated in rows)
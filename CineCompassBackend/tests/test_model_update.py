@@ -0,0 +1,98 @@
+from datetime import datetime
+
+from sqlalchemy import delete, insert, update
+
+from app.models.movie import Movie
+from app.recommender import artifact
+from app.recommender.content_based import CineCompassRecommender
+from app.recommender.neighbors import build_neighbors
+from app.recommender.retrieval import IVFIndex
+from app.schemas.rating import RatingCreate
+from tests.conftest import RecordingWorker
+
+
+def add_movies(session_factory, movie_ids):
+    now = datetime.now()
+    with session_factory() as db:
+        db.execute(insert(Movie), [{
+            "id": movie_id,
+            "title": f"Movie {movie_id}",
+            "overview": "word1 word2 word3 word4",
+            "genres": ["Drama"],
+            "cast": ["Actor 1"],
+            "director": "Director 1",
+            "popularity": 1.0,
+            "vote_average": 5.0,
+            "combined_features": "",
+            "last_updated": now,
+            "features_updated": now
+        } for movie_id in movie_ids])
+        db.commit()
+
+
+def test_added_movies_update_the_model_without_refitting(session_factory, model_registry):
+    with session_factory() as db:
+        before = model_registry.get(db)
+    add_movies(session_factory, [101, 102])
+    with session_factory() as db:
+        after = model_registry.get(db)
+
+    assert after.version != before.version
+    assert after.size == before.size + 2
+    assert after.unseen_rows == 2
+    assert after.vocabulary_version == before.vocabulary_version
+    # Rows of the movies that were already there are kept as they were
+    assert abs(after.tfidf_matrix[:before.size] - before.tfidf_matrix).max() == 0
+
+
+def test_profiles_stay_valid_across_incremental_updates(session_factory, model_registry):
+    with session_factory() as db:
+        recommender = CineCompassRecommender(db, refresh_worker=RecordingWorker())
+        recommender.process_batch_ratings(1, [RatingCreate(movie_id=movie_id, rating=5.0) for movie_id in (1, 2, 3)])
+        profile = recommender._rebuild_profile(1)
+        vector = dict(profile.vector)
+
+    add_movies(session_factory, [101])
+    with session_factory() as db:
+        recommender = CineCompassRecommender(db, refresh_worker=RecordingWorker())
+        assert not recommender._profile_is_stale(recommender._get_profile(1))
+
+        # Applied to the stored vector instead of waiting for a full rebuild
+        recommender.process_batch_ratings(1, [RatingCreate(movie_id=4, rating=5.0)])
+        assert "4" in recommender._get_profile(1).contributions
+        assert recommender._get_profile(1).vector != vector
+
+
+def test_updates_carry_the_neighbour_index_over(session_factory, model_registry):
+    with session_factory() as db:
+        before = model_registry.get(db)
+    before.neighbor_rows, before.neighbor_scores = build_neighbors(before.tfidf_matrix, before.row_norms, top_n=10)
+    artifact.save_model(before)
+
+    add_movies(session_factory, [101, 102])
+    with session_factory() as db:
+        db.execute(update(Movie).where(Movie.id == 5).values(overview="word1 word2 word3 word4",
+                                                             features_updated=datetime.now()))
+        db.execute(delete(Movie).where(Movie.id == 7))
+        db.commit()
+        after = model_registry.get(db)
+
+    assert after.version != before.version
+    _, expected_scores = build_neighbors(after.tfidf_matrix, after.row_norms, top_n=10)
+    assert abs(after.neighbor_scores - expected_scores).max() < 1e-6
+    # Published along with the model, so the next update or restart starts from it
+    assert artifact.load_tfidf_state().neighbor_rows is not None
+
+
+def test_updates_file_changed_movies_in_the_ivf_index(session_factory, model_registry):
+    with session_factory() as db:
+        before = model_registry.get(db)
+    before.ivf_index = IVFIndex.build(before.tfidf_matrix, n_components=8, n_lists=4)
+
+    add_movies(session_factory, [101, 102])
+    with session_factory() as db:
+        after = model_registry.get(db)
+
+    assert after.ivf_index is not None
+    assert sorted(after.ivf_index.order.tolist()) == list(range(after.size))
+    assert after.ivf_index.offsets[-1] == after.size
@@ -0,0 +1,76 @@
+import asyncio
+import time
+
+import aiohttp
+
+from app.database.rate_limit import TokenBucket
+from benchmarks.tmdb_stub import StubCatalog, StubServer
+from tests.conftest import run_with_stub
+
+
+def test_throttling_halves_the_rate_once_per_cooldown():
+    bucket = TokenBucket(rate=40, cooldown=60)
+    bucket.on_throttled()
+    bucket.on_throttled()
+    assert bucket.rate == 20
+
+    bucket.on_success()
+    assert 20 < bucket.rate < 21
+
+
+def test_retry_after_pauses_the_whole_bucket():
+    bucket = TokenBucket(rate=1000)
+    bucket.on_throttled(retry_after=0.3)
+
+    async def acquire_two():
+        start = time.monotonic()
+        await asyncio.gather(bucket.acquire(), bucket.acquire())
+        return time.monotonic() - start
+
+    assert asyncio.run(acquire_two()) >= 0.3
+
+
+def test_throttled_requests_wait_for_retry_after(builder_factory):
+    # One request per second, the second one is answered with 429 and Retry-After: 1
+    server = StubServer(StubCatalog(10), rate=1, latency=(0, 0))
+
+    async def scenario(base_url):
+        builder = builder_factory(base_url, TokenBucket(rate=100))
+        builder.max_retries = 1
+        async with aiohttp.ClientSession() as session:
+            start = time.monotonic()
+            first, second = [await builder.fetch_movie_details_async(session, {"id": movie_id}) for movie_id in (1, 2)]
+            return builder, first, second, time.monotonic() - start
+
+    builder, first, second, elapsed = run_with_stub(server, scenario)
+    assert first["details"]["id"] == 1 and second["details"]["id"] == 2
+    assert server.throttled == 1 and builder.stats.throttled == 1
+    # Halved by the 429, then crept up by the success that followed
+    assert 50 <= builder.rate_limiter.rate < 51
+    assert elapsed >= 1
+
+
+def test_movies_that_run_out_of_retries_are_queued_and_dropped(builder_factory):
+    server = StubServer(StubCatalog(60), rate=None, latency=(0, 0), error_rate=1.0)
+
+    async def scenario(base_url):
+        builder = builder_factory(base_url)
+        builder.max_retries = 0
+        async with aiohttp.ClientSession() as session:
+            assert await builder.fetch_movie_details_async(session, {"id": 55}) is None
+            # A movie already in the database is left for the next refresh instead
+            assert await builder.fetch_movie_details_async(session, {"id": 5}) is None
+            queued = set(builder.retry_queue)
+
+            await builder._drain_retry_queue(session)
+            dropped = builder.stats.dropped
+
+            server.error_rate = 0.0
+            await builder._drain_retry_queue(session)
+        return builder, queued, dropped
+
+    builder, queued, dropped = run_with_stub(server, scenario)
+    assert queued == {55}
+    assert dropped == 1
+    assert builder.stats.dropped == 0 and not builder.retry_queue
+    assert 55 in builder.processed_movies
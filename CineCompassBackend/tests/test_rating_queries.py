@@ -0,0 +1,58 @@
+import pytest
+
+from app.recommender.content_based import CineCompassRecommender
+from app.schemas.rating import RatingCreate
+from tests.conftest import RecordingWorker
+
+
+def recommender(db):
+    return CineCompassRecommender(db, refresh_worker=RecordingWorker())
+
+
+def rate(session_factory, movie_ids, rating=4.0):
+    with session_factory() as db:
+        return recommender(db).process_batch_ratings(
+            1, [RatingCreate(movie_id=movie_id, rating=rating) for movie_id in movie_ids]
+        )
+
+
+@pytest.mark.parametrize("batch_size", [1, 5, 20])
+def test_batch_ratings_without_profile_run_a_fixed_number_of_statements(session_factory, statements, batch_size):
+    with session_factory() as db:
+        rec = recommender(db)
+        statements.count = 0
+        rec.process_batch_ratings(1, [RatingCreate(movie_id=movie_id, rating=4.0)
+                                      for movie_id in range(1, batch_size + 1)])
+
+    # Previous ratings, the upsert and the profile lookup
+    assert statements.count == 3
+
+
+@pytest.mark.parametrize("batch_size", [1, 5, 20])
+def test_batch_ratings_with_profile_run_a_fixed_number_of_statements(session_factory, statements, batch_size):
+    rate(session_factory, [30, 31, 32])
+    with session_factory() as db:
+        assert recommender(db)._rebuild_profile(1) is not None
+
+    with session_factory() as db:
+        rec = recommender(db)
+        statements.count = 0
+        result = rec.process_batch_ratings(1, [RatingCreate(movie_id=movie_id, rating=5.0)
+                                               for movie_id in range(1, batch_size + 1)])
+
+    # Previous ratings, the upsert, the profile lookup and the profile update
+    assert statements.count == 4
+    assert result["refresh_status"] == "pending"
+
+
+@pytest.mark.parametrize("n_ratings", [1, 10, 40])
+def test_user_preferences_are_read_in_one_statement(session_factory, statements, n_ratings):
+    rate(session_factory, range(1, n_ratings + 1))
+
+    with session_factory() as db:
+        rec = recommender(db)
+        statements.count = 0
+        genre_prefs, director_prefs = rec._get_user_preferences(1)
+
+    assert statements.count == 1
+    assert sum(stats["count"] for stats in director_prefs.values()) == n_ratings
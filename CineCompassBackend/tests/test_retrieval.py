@@ -0,0 +1,16 @@
+import threading
+
+from app.recommender.retrieval import ExactRetriever, IVFRetriever, get_retriever
+
+
+def test_ivf_index_is_built_off_the_request_path(session_factory, model_registry):
+    with session_factory() as db:
+        model = model_registry.get(db)
+
+    # Scores everything until the index is there instead of building it in the request
+    assert type(get_retriever(model, approximate_threshold=0, backend="ivf")) is ExactRetriever
+    for thread in threading.enumerate():
+        if thread.name == "ivf-index":
+            thread.join()
+
+    assert isinstance(get_retriever(model, approximate_threshold=0, backend="ivf"), IVFRetriever)
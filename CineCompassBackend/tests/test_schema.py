@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, text
+
+from app.database.init_db import create_schema
+from app.models.cached_recommendation import CachedRecommendation
+from app.models.rating import Rating
+from app.models.recommendation_state import RecommendationState
+from app.recommender.content_based import CineCompassRecommender, collect_stale_generations
+from app.schemas.rating import RatingCreate
+from tests.conftest import RecordingWorker
+
+
+def test_duplicate_ratings_are_removed_before_the_unique_index(engine, session_factory):
+    # A database from before the unique index, with the duplicates bulk saves and concurrent writes left behind
+    now = datetime.utcnow()
+    with engine.begin() as connection:
+        connection.execute(text("DROP INDEX uq_ratings_user_movie"))
+        connection.execute(insert(Rating), [
+            {"user_id": 1, "movie_id": 1, "rating": 2.0, "timestamp": now - timedelta(days=1)},
+            {"user_id": 1, "movie_id": 1, "rating": 4.0, "timestamp": now},
+            {"user_id": 1, "movie_id": 2, "rating": 1.0, "timestamp": now},
+            {"user_id": 1, "movie_id": 2, "rating": 3.0, "timestamp": now},
+        ])
+
+    create_schema(engine)
+
+    with session_factory() as db:
+        ratings = sorted(db.query(Rating.movie_id, Rating.rating).all())
+        assert ratings == [(1, 4.0), (2, 3.0)]
+
+        recommender = CineCompassRecommender(db, refresh_worker=RecordingWorker())
+        result = recommender.process_batch_ratings(1, [RatingCreate(movie_id=1, rating=5.0)])
+        assert result["status"] == "success"
+
+
+def test_cached_rows_without_a_generation_are_removed(engine, session_factory):
+    # Rows cached before generations existed, ensure_columns added the column as NULL
+    legacy = [{"user_id": 1, "generation": None, "movie_id": movie_id, "rank": rank}
+              for rank, movie_id in enumerate((1, 2, 3))]
+    with engine.begin() as connection:
+        connection.execute(insert(RecommendationState), [{"user_id": 1, "total": 1, "generation": 1}])
+        connection.execute(insert(CachedRecommendation),
+                           legacy + [{"user_id": 1, "generation": 1, "movie_id": 4, "rank": 0}])
+
+    create_schema(engine)
+    with session_factory() as db:
+        assert db.query(CachedRecommendation.movie_id).all() == [(4,)]
+
+    # The collector removes them as well
+    with engine.begin() as connection:
+        connection.execute(insert(CachedRecommendation), legacy)
+    with session_factory() as db:
+        assert collect_stale_generations(db, [1]) == 3
+        assert db.query(CachedRecommendation.movie_id).all() == [(4,)]